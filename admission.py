@@ -0,0 +1,202 @@
+import os
+import time
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+from outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Updates a bot accepts at once, including those queued behind their chat; 0 means no limit
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '0'))
+# Token-bucket quotas per user and per chat; a rate of 0 disables the quota
+ADMISSION_USER_PER_MINUTE = float(os.getenv('ADMISSION_USER_PER_MINUTE', '0'))
+ADMISSION_USER_BURST = int(os.getenv('ADMISSION_USER_BURST', '5'))
+ADMISSION_CHAT_PER_MINUTE = float(os.getenv('ADMISSION_CHAT_PER_MINUTE', '0'))
+ADMISSION_CHAT_BURST = int(os.getenv('ADMISSION_CHAT_BURST', '10'))
+# What happens to an update over a limit: drop it, delay it up to ADMISSION_MAX_DELAY seconds, or reply "busy"
+ADMISSION_SHED_POLICY = os.getenv('ADMISSION_SHED_POLICY', 'drop')
+ADMISSION_MAX_DELAY = float(os.getenv('ADMISSION_MAX_DELAY', '5'))
+ADMISSION_BUSY_MESSAGE = os.getenv(
+    'ADMISSION_BUSY_MESSAGE', "I'm getting a lot of messages right now. Please try again in a moment."
+)
+
+SHED_POLICIES = ('drop', 'delay', 'busy')
+
+# One "busy" reply per chat in this many seconds; the rest are shed silently
+BUSY_NOTICE_INTERVAL = 60.0
+
+
+class AdmissionPolicy:
+    """A bot's admission limits and what to do with updates over them"""
+
+    __slots__ = ('max_in_flight', 'user_per_minute', 'user_burst', 'chat_per_minute', 'chat_burst',
+                 'shed', 'max_delay', 'busy_message')
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+                 user_per_minute=ADMISSION_USER_PER_MINUTE, user_burst=ADMISSION_USER_BURST,
+                 chat_per_minute=ADMISSION_CHAT_PER_MINUTE, chat_burst=ADMISSION_CHAT_BURST,
+                 shed=ADMISSION_SHED_POLICY, max_delay=ADMISSION_MAX_DELAY, busy_message=ADMISSION_BUSY_MESSAGE):
+        if shed not in SHED_POLICIES:
+            raise ValueError(f"Shed policy must be one of {', '.join(SHED_POLICIES)}, got {shed!r}")
+        self.max_in_flight = max_in_flight
+        self.user_per_minute = user_per_minute
+        self.user_burst = user_burst
+        self.chat_per_minute = chat_per_minute
+        self.chat_burst = chat_burst
+        self.shed = shed
+        self.max_delay = max_delay
+        self.busy_message = busy_message
+
+    @classmethod
+    def from_option(cls, option=None):
+        """Build the policy for a bot's "admission" option, or None if it sets no limit
+
+        The option is a dict of this class's arguments; they default to the
+        ADMISSION_* environment variables. false turns admission control off.
+        """
+        if option is False:
+            return None
+        policy = cls(**(option or {}))
+        if not (policy.max_in_flight or policy.user_per_minute or policy.chat_per_minute):
+            return None
+        return policy
+
+
+class AdmissionController:
+    """Decide per update whether a bot takes it on now, later or not at all"""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self._slots = asyncio.Semaphore(policy.max_in_flight) if policy.max_in_flight else None
+        self._users = {}
+        self._chats = {}
+        self._notified = {}
+        self.in_flight = 0
+
+    def _bucket(self, buckets, key, per_minute, burst, now):
+        if not per_minute or key is None:
+            return None
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) > 10000:
+                for idle in [k for k, b in buckets.items() if b.full(now)]:
+                    del buckets[idle]
+            bucket = buckets[key] = TokenBucket(per_minute / 60, burst, now)
+        return bucket
+
+    async def admit(self, update):
+        """Wait until the update may run and return None, or return why it is shed
+
+        Every admitted update must be followed by a call to release().
+        """
+        policy = self.policy
+        delay = policy.shed == 'delay'
+        now = time.monotonic()
+        user = update.effective_user if isinstance(update, Update) else None
+        chat = update.effective_chat if isinstance(update, Update) else None
+        quotas = (
+            ('user', self._bucket(self._users, user and user.id, policy.user_per_minute, policy.user_burst, now)),
+            ('chat', self._bucket(self._chats, chat and chat.id, policy.chat_per_minute, policy.chat_burst, now)),
+        )
+        wait = 0.0
+        for reason, bucket in quotas:
+            if bucket is None:
+                continue
+            quota_wait = bucket.wait_time(now)
+            if quota_wait > 0 and (not delay or quota_wait > policy.max_delay):
+                return reason
+            wait = max(wait, quota_wait)
+        # Tokens are reserved now, so delayed updates of one user keep their order
+        for _, bucket in quotas:
+            if bucket is not None:
+                bucket.take(now)
+        if wait > 0:
+            metrics.UPDATES_DELAYED.inc(bot=metrics.current_labels.get()[0])
+            await asyncio.sleep(wait)
+
+        if self._slots is not None:
+            if self._slots.locked() and not delay:
+                return 'in_flight'
+            try:
+                await asyncio.wait_for(self._slots.acquire(), policy.max_delay)
+            except asyncio.TimeoutError:
+                return 'in_flight'
+        self.in_flight += 1
+        return None
+
+    def release(self):
+        self.in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def should_notify(self, chat_id):
+        """Whether a shed update in this chat should get the "busy" reply"""
+        if self.policy.shed != 'busy' or chat_id is None:
+            return False
+        now = time.monotonic()
+        if now - self._notified.get(chat_id, -BUSY_NOTICE_INTERVAL) < BUSY_NOTICE_INTERVAL:
+            return False
+        if len(self._notified) > 10000:
+            self._notified = {k: t for k, t in self._notified.items() if now - t < BUSY_NOTICE_INTERVAL}
+        self._notified[chat_id] = now
+        return True
+
+
+class AdmissionUpdateProcessor(BaseUpdateProcessor):
+    """Run each update past an AdmissionController before handing it to another update processor
+
+    Admission is decided as soon as the Application fetches the update,
+    before it waits for a concurrency slot or queues behind its chat, and
+    the update counts as in flight until its handlers finish. Shed updates
+    are counted in telegram_updates_shed_total by reason. In sequential mode
+    a delayed update holds up the whole bot, so "delay" is meant for bots
+    with concurrent_updates.
+    """
+
+    __slots__ = ('inner', 'controller', 'bot_name', 'notify_busy')
+
+    def __init__(self, inner, controller, bot_name='', notify_busy=None):
+        super().__init__(inner.max_concurrent_updates)
+        self.inner = inner
+        self.controller = controller
+        self.bot_name = bot_name
+        self.notify_busy = notify_busy
+
+    async def _run_admitted(self, coroutine):
+        try:
+            await coroutine
+        finally:
+            self.controller.release()
+
+    async def process_update(self, update, coroutine):
+        token = metrics.current_labels.set((self.bot_name, 'admission'))
+        try:
+            reason = await self.controller.admit(update)
+        finally:
+            metrics.current_labels.reset(token)
+        if reason is None:
+            await self.inner.process_update(update, self._run_admitted(coroutine))
+            return
+
+        coroutine.close()
+        metrics.UPDATES_SHED.inc(bot=self.bot_name, reason=reason)
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if self.notify_busy is not None and self.controller.should_notify(chat and chat.id):
+            try:
+                await self.notify_busy(update, self.controller.policy.busy_message)
+            except Exception as e:
+                logger.error(f"Failed to tell chat {chat.id} the bot is busy: {e}")
+
+    async def do_process_update(self, update, coroutine):
+        await self.inner.do_process_update(update, coroutine)
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
@@ -0,0 +1,7 @@
+import os
+
+# Quiet period after the last album item before the album is sent; 0 sends every item on its own
+ALBUM_WINDOW_MS = int(os.getenv('ALBUM_WINDOW_MS', '0'))
+
+# Telegram albums hold at most 10 items
+ALBUM_MAX_ITEMS = 10
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def split_batch_response(payloads, response):
+    """Map an n8n batch response back to the payloads it answers
+
+    n8n may answer with a list of replies that carry ``message_id`` (and
+    optionally ``chat_id``), with a list in the same order as the batch, or
+    with ``{"replies": [...]}`` in either form. Anything it does not answer
+    gets None, which the handlers treat as "no reply".
+    """
+    if isinstance(response, dict):
+        if isinstance(response.get('replies'), list):
+            response = response['replies']
+        elif len(payloads) == 1:
+            return [response]
+    if not isinstance(response, list):
+        return [None] * len(payloads)
+
+    by_key = {}
+    for item in response:
+        if isinstance(item, dict) and item.get('message_id') is not None:
+            by_key[(item.get('chat_id'), item['message_id'])] = item
+    if by_key:
+        results = []
+        for data in payloads:
+            message_id = data.get('message_id')
+            item = by_key.get((data.get('chat_id'), message_id))
+            if item is None:
+                item = by_key.get((None, message_id))
+            results.append(item)
+        return results
+
+    if len(response) == len(payloads):
+        return list(response)
+    logger.warning(f"Cannot match {len(response)} n8n replies to a batch of {len(payloads)}")
+    return [None] * len(payloads)
+
+
+class WebhookBatcher:
+    """Group payloads per webhook URL and post them to n8n as one JSON array
+
+    A batch is sent when `window` seconds have passed since its first payload
+    or when it reaches `max_size`, whichever comes first. Each caller gets back
+    only the part of the n8n response that belongs to its own payload.
+    """
+
+    def __init__(self, n8n_client, window=0.05, max_size=20):
+        self.n8n_client = n8n_client
+        self.window = window
+        self.max_size = max_size
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()
+
+    async def request(self, webhook_url, data, headers=None):
+        """Add data to the next batch for webhook_url, raising httpx.HTTPError on failure"""
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(webhook_url, [])
+        batch.append((data, headers, future))
+        if len(batch) >= self.max_size:
+            self._flush(webhook_url)
+        elif len(batch) == 1:
+            self._timers[webhook_url] = asyncio.get_running_loop().call_later(
+                self.window, self._flush, webhook_url
+            )
+        return await future
+
+    async def post(self, webhook_url, data, headers=None):
+        """Send data to n8n webhook as part of a batch"""
+        try:
+            return await self.request(webhook_url, data, headers)
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to send data to n8n: {e}")
+            return None
+
+    def _flush(self, webhook_url):
+        timer = self._timers.pop(webhook_url, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(webhook_url, None)
+        if batch:
+            task = asyncio.create_task(self._send(webhook_url, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, webhook_url, batch):
+        payloads = [data for data, _, _ in batch]
+        keys = [(headers or {}).get('X-Idempotency-Key') for _, headers, _ in batch]
+        headers = {'X-Idempotency-Key': ','.join(keys)} if all(keys) else None
+        try:
+            response = await self.n8n_client.request(webhook_url, payloads, headers)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), reply in zip(batch, split_batch_response(payloads, response)):
+            if not future.done():
+                future.set_result(reply)
+
+    async def aclose(self):
+        """Send everything still waiting for its window"""
+        for webhook_url in list(self._pending):
+            self._flush(webhook_url)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,128 @@
+"""Benchmark: concurrent updates through the blocking vs async n8n forwarder.
+
+Starts a local fake n8n webhook that answers after a fixed delay, then feeds
+the same burst of text updates through a handler that uses the old blocking
+``requests.post`` call and through ``bot.create_message_handler``.
+
+    python benchmarks/bench_n8n_forwarder.py --updates 50 --delay 0.2
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'bench')
+os.environ.setdefault('N8N_WEBHOOK_URL', 'http://127.0.0.1/webhook')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN_TVO', 'bench')
+os.environ.setdefault('N8N_WEBHOOK_URL_TVO', 'http://127.0.0.1/webhook')
+
+import logging
+logging.disable(logging.INFO)
+
+import bot
+
+
+async def start_fake_n8n(delay):
+    """Serve a webhook that replies {"reply": "ok"} after `delay` seconds"""
+    body = b'{"reply": "ok"}'
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                headers = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in headers.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                await reader.readexactly(length)
+                await asyncio.sleep(delay)
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}/webhook/bench"
+
+
+def run_fake_n8n_in_thread(delay):
+    """Run the fake webhook on its own loop so blocking clients can't stall it"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server, webhook_url = asyncio.run_coroutine_threadsafe(start_fake_n8n(delay), loop).result()
+    return loop, webhook_url
+
+
+def make_update(i):
+    """Build a minimal stand-in for a text Update"""
+    async def reply_text(text):
+        return None
+
+    message = SimpleNamespace(
+        message_id=i, text=f"message {i}", chat_id=1000 + i,
+        date=datetime.now(timezone.utc), reply_text=reply_text,
+    )
+    user = SimpleNamespace(id=i, username=f"user{i}", first_name="Bench", last_name="User")
+    return SimpleNamespace(effective_user=user, message=message)
+
+
+def make_context():
+    async def set_message_reaction(**kwargs):
+        return None
+
+    return SimpleNamespace(bot=SimpleNamespace(id=424242, set_message_reaction=set_message_reaction))
+
+
+def create_blocking_handler(webhook_url):
+    """The pre-async handler: requests.post directly inside the coroutine"""
+    async def handle_message(update, context):
+        message = update.message
+        response = requests.post(webhook_url, json={"text": message.text}, timeout=10)
+        if 'reply' in response.json():
+            await message.reply_text(response.json()['reply'])
+
+    return handle_message
+
+
+async def run_burst(handler, updates):
+    context = make_context()
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(update, context) for update in updates))
+    return time.perf_counter() - started
+
+
+async def main(n_updates, delay, webhook_url):
+    updates = [make_update(i) for i in range(n_updates)]
+
+    blocking = await run_burst(create_blocking_handler(webhook_url), updates)
+    pooled = await run_burst(bot.create_message_handler(webhook_url), updates)
+    await bot.n8n_client.aclose()
+
+    print(f"{n_updates} concurrent updates, n8n latency {delay * 1000:.0f} ms")
+    print(f"  blocking requests.post : {blocking:7.3f} s  ({n_updates / blocking:8.1f} updates/s)")
+    print(f"  async pooled forwarder : {pooled:7.3f} s  ({n_updates / pooled:8.1f} updates/s)")
+    print(f"  speedup                : {blocking / pooled:7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=50)
+    parser.add_argument('--delay', type=float, default=0.2)
+    args = parser.parse_args()
+    loop, webhook_url = run_fake_n8n_in_thread(args.delay)
+    asyncio.run(main(args.updates, args.delay, webhook_url))
+    loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,131 @@
+"""Benchmark: per-update cost of building and serialising the n8n payload.
+
+Compares the hand-built dicts serialised the way httpx's json= did it with
+the slotted events from events.py, encoded by the slot writer and, when
+installed, by orjson. Reports time per update and the memory held by one
+payload and allocated while building and encoding it. Every iteration takes
+the next of DATES updates, each sent a second after the previous one, so the
+one-entry timestamp cache in events.py does not flatter the events.
+
+    python benchmarks/bench_payload.py --iterations 200000
+"""
+import os
+import sys
+import json
+import timeit
+import itertools
+import argparse
+import tracemalloc
+
+from telegram import Update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import events
+from events import MessageEvent, DocumentEvent, encode
+
+MESSAGE = {
+    "message_id": 1234, "date": 1760788800,
+    "chat": {"id": 987654321, "type": "private"},
+    "from": {"id": 987654321, "is_bot": False, "first_name": "Ada", "last_name": "Lovelace", "username": "ada"},
+}
+
+# Distinct message dates cycled through by the benchmark
+DATES = 1024
+
+
+def make_updates(**fields):
+    """DATES updates with the same content, a second apart"""
+    return [
+        Update.de_json({"update_id": i, "message": dict(MESSAGE, date=MESSAGE["date"] + i, **fields)}, None)
+        for i in range(DATES)
+    ]
+
+
+def legacy_message(update):
+    user = update.effective_user
+    message = update.message
+    return {
+        "type": "message",
+        "message_id": message.message_id,
+        "text": message.text,
+        "user_id": user.id,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "chat_id": message.chat_id,
+        "timestamp": message.date.isoformat()
+    }
+
+
+def legacy_document(update):
+    user = update.effective_user
+    message = update.message
+    document = message.document
+    return {
+        "type": "document",
+        "message_id": message.message_id,
+        "document_file_id": document.file_id,
+        "document_name": document.file_name,
+        "document_mime_type": document.mime_type,
+        "caption": message.caption,
+        "user_id": user.id,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "chat_id": message.chat_id,
+        "timestamp": message.date.isoformat()
+    }
+
+
+def allocated_per_call(function, calls=1000):
+    """Average peak memory allocated during one call"""
+    function()
+    tracemalloc.start()
+    total = 0
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / calls
+
+
+def retained_size(payload):
+    """Bytes held by the payload container itself"""
+    return sys.getsizeof(payload)
+
+
+def run(name, updates, build_legacy, event_class, iterations):
+    pool = itertools.cycle(updates)
+    variants = {
+        'dict + json.dumps (before)': (lambda: json.dumps(build_legacy(next(pool))).encode(), build_legacy),
+        'event + slot writer': (lambda: event_class.from_update(next(pool)).encode(), event_class.from_update),
+    }
+    if events.orjson is not None:
+        variants['event + orjson'] = (lambda: encode(event_class.from_update(next(pool))), event_class.from_update)
+
+    print(f"{name} payload, {iterations} iterations over {len(updates)} message dates")
+    for label, (build_and_encode, build) in variants.items():
+        seconds = timeit.timeit(build_and_encode, number=iterations)
+        allocated = allocated_per_call(build_and_encode)
+        print(f"  {label:28s}: {seconds / iterations * 1e6:6.2f} us/update, "
+              f"payload {retained_size(build(updates[0])):4d} B, peak allocation {allocated:5.0f} B/update")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    run('message', make_updates(text="Can you check the status of order 1234?"),
+        legacy_message, MessageEvent, args.iterations)
+    run('document', make_updates(caption="Q3 report", document={
+        "file_id": "BQACAgIAAxkBAAIBZ2X", "file_unique_id": "AgADc", "file_name": "report-q3.pdf",
+        "mime_type": "application/pdf",
+    }), legacy_document, DocumentEvent, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
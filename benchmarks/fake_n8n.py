@@ -0,0 +1,48 @@
+"""Local stand-in for an n8n webhook used by the load test.
+
+Answers after a random delay (normally distributed around `latency` with
+`jitter` standard deviation) and fails with 500 at `error_rate`. A fraction
+`reply_rate` of answers carry {"reply": ...}; the rest are empty so the bot
+reacts instead. Batched deliveries (JSON arrays) get one answer per event.
+"""
+import json
+import random
+import asyncio
+
+from http_server import Response
+
+WEBHOOK_PATH = '/webhook/load-test'
+
+
+class FakeN8n:
+    def __init__(self, http_server, latency=0.05, jitter=0.01, error_rate=0.0, reply_rate=0.5, seed=2):
+        self.http_server = http_server
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reply_rate = reply_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    def register(self):
+        self.http_server.add_route('POST', WEBHOOK_PATH, self.handle)
+
+    def _answer(self, event):
+        if self.rng.random() < self.reply_rate:
+            return {"reply": f"ack {event.get('message_id', '')}".strip()}
+        return {}
+
+    async def handle(self, request):
+        self.requests += 1
+        delay = max(0.0, self.rng.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return Response(500, 'Internal Server Error')
+        payload = json.loads(request.body)
+        if isinstance(payload, list):
+            body = [self._answer(event) for event in payload]
+        else:
+            body = self._answer(payload)
+        return Response(200, json.dumps(body), content_type='application/json')
@@ -0,0 +1,156 @@
+"""Local stand-in for the Telegram Bot API used by the load test.
+
+Serves a synthetic getUpdates stream of text, photo, document and /start
+updates in a configurable mix, and records when each update was handed to
+the bot and when the bot answered it (sendMessage or setMessageReaction).
+Every update comes from its own chat so answers can be matched by chat_id.
+"""
+import json
+import time
+import random
+import asyncio
+from urllib.parse import parse_qs
+
+from http_server import Response
+
+UPDATE_TYPES = ('text', 'photo', 'document', 'start')
+BOT_USER = {"id": 424242, "is_bot": True, "first_name": "Load", "username": "load_test_bot"}
+
+
+def parse_mix(spec):
+    """Parse "text=70,photo=10,document=10,start=10" into {type: weight}"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in UPDATE_TYPES:
+            raise ValueError(f"Unknown update type {name!r}; expected one of {UPDATE_TYPES}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def make_update(update_id, kind, date):
+    chat_id = 10_000_000 + update_id
+    message = {
+        "message_id": update_id,
+        "date": date,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Load", "username": f"user{update_id}"},
+    }
+    if kind == 'text':
+        message["text"] = f"load test message {update_id % 50}"
+    elif kind == 'start':
+        message["text"] = "/start"
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+    elif kind == 'photo':
+        message["photo"] = [
+            {"file_id": f"photo-{update_id}-s", "file_unique_id": f"ps{update_id}", "width": 90, "height": 90},
+            {"file_id": f"photo-{update_id}", "file_unique_id": f"p{update_id}", "width": 1280, "height": 960},
+        ]
+        message["caption"] = "load test photo"
+    elif kind == 'document':
+        message["document"] = {
+            "file_id": f"doc-{update_id}", "file_unique_id": f"d{update_id}",
+            "file_name": f"report-{update_id}.pdf", "mime_type": "application/pdf",
+        }
+    return {"update_id": update_id, "message": message}
+
+
+def ok(result):
+    return Response(200, json.dumps({"ok": True, "result": result}), content_type='application/json')
+
+
+class FakeTelegramApi:
+    """Bot API endpoints for one token, feeding `count` updates at `rate` per second (0 = all at once)"""
+
+    def __init__(self, http_server, token, count, mix, rate=0.0, seed=1):
+        self.http_server = http_server
+        self.token = token
+        self.count = count
+        self.rate = rate
+        rng = random.Random(seed)
+        kinds, weights = zip(*mix.items())
+        self.kinds = [rng.choices(kinds, weights)[0] for _ in range(count)]
+        self.started_at = None
+        self.served_at = {}
+        self.answered_at = {}
+        self.answers = {'sendMessage': 0, 'setMessageReaction': 0}
+        self.done = asyncio.Event()
+
+    def register(self):
+        methods = {
+            'getMe': self.get_me,
+            'deleteWebhook': self.delete_webhook,
+            'getUpdates': self.get_updates,
+            'sendMessage': self.send_message,
+            'setMessageReaction': self.set_message_reaction,
+        }
+        for name, handler in methods.items():
+            self.http_server.add_route('POST', f"/bot{self.token}/{name}", handler)
+
+    @staticmethod
+    def _params(request):
+        return {key: values[0] for key, values in parse_qs(request.body.decode()).items()}
+
+    def _available(self):
+        """Number of updates released so far"""
+        if not self.rate:
+            return self.count
+        return min(self.count, int((time.monotonic() - self.started_at) * self.rate) + 1)
+
+    def _answer(self, method, chat_id):
+        update_id = int(chat_id) - 10_000_000
+        if update_id in self.served_at and update_id not in self.answered_at:
+            self.answered_at[update_id] = time.monotonic()
+            self.answers[method] += 1
+            if len(self.answered_at) == self.count:
+                self.done.set()
+
+    async def get_me(self, request):
+        return ok(BOT_USER)
+
+    async def delete_webhook(self, request):
+        return ok(True)
+
+    async def get_updates(self, request):
+        params = self._params(request)
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        timeout = float(params.get('timeout', 0))
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            available = self._available()
+            if offset < available or time.monotonic() >= deadline:
+                break
+            # Long-poll like the real API: wait for the next update or the timeout
+            next_at = self.started_at + offset / self.rate if offset < self.count else deadline
+            await asyncio.sleep(max(0.0, min(next_at, deadline) - time.monotonic()))
+
+        now = time.monotonic()
+        date = int(time.time())
+        updates = []
+        for update_id in range(offset, min(available, offset + limit)):
+            self.served_at.setdefault(update_id, now)
+            updates.append(make_update(update_id, self.kinds[update_id], date))
+        return ok(updates)
+
+    async def send_message(self, request):
+        params = self._params(request)
+        self._answer('sendMessage', params['chat_id'])
+        return ok({
+            "message_id": 1, "date": int(time.time()),
+            "chat": {"id": int(params['chat_id']), "type": "private"},
+            "from": BOT_USER, "text": params.get('text', ''),
+        })
+
+    async def set_message_reaction(self, request):
+        params = self._params(request)
+        self._answer('setMessageReaction', params['chat_id'])
+        return ok(True)
+
+    def latencies(self):
+        """Seconds from getUpdates handing out an update to the bot answering it"""
+        return [self.answered_at[i] - self.served_at[i] for i in self.answered_at]
@@ -0,0 +1,140 @@
+"""Load test: bot.run_bot against a fake Telegram Bot API and a fake n8n, fully offline.
+
+The fakes run in a child process so they do not compete with the bot for the
+event loop or show up in its memory. The bot polls the fake API exactly as it
+would poll Telegram, forwards every update to the fake n8n webhook and answers
+with sendMessage or setMessageReaction. Latency is measured per update from
+getUpdates handing it out to the bot's answer arriving.
+
+    python benchmarks/run_load.py --updates 2000 --concurrency 32 --latency 0.05
+    python benchmarks/run_load.py --updates 1000 --rate 200 --mix text=60,photo=20,document=10,start=10
+
+Settings read by bot.py from the environment (N8N_BATCH_WINDOW_MS,
+REPLY_CACHE_TTL, N8N_OUTBOX_PATH, ...) apply as usual.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'bench')
+os.environ.setdefault('N8N_WEBHOOK_URL', 'http://127.0.0.1/webhook')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN_TVO', 'bench')
+os.environ.setdefault('N8N_WEBHOOK_URL_TVO', 'http://127.0.0.1/webhook')
+
+import logging
+logging.disable(logging.INFO)
+
+from http_server import HttpServer
+from fake_telegram import FakeTelegramApi, parse_mix
+from fake_n8n import FakeN8n, WEBHOOK_PATH
+
+TOKEN = '123456:LOADTEST'
+BOT_NAME = 'Load Test Bot'
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else float('nan')
+
+
+async def serve_fakes(conn, args):
+    server = HttpServer('127.0.0.1', 0)
+    telegram = FakeTelegramApi(server, TOKEN, args.updates, parse_mix(args.mix), args.rate)
+    n8n = FakeN8n(server, args.latency, args.jitter, args.error_rate, args.reply_rate)
+    telegram.register()
+    n8n.register()
+    await server.start()
+    conn.send(server.bound_port)
+
+    try:
+        await asyncio.wait_for(telegram.done.wait(), args.deadline)
+    except asyncio.TimeoutError:
+        pass
+    served = telegram.served_at.values()
+    answered = telegram.answered_at.values()
+    conn.send({
+        'latencies': telegram.latencies(),
+        'elapsed': max(answered) - min(served) if answered else float('nan'),
+        'answers': telegram.answers,
+        'n8n_requests': n8n.requests,
+        'n8n_errors': n8n.errors,
+    })
+    # Keep answering until the bot has shut down cleanly
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    await server.stop()
+
+
+def fakes_process(conn, args):
+    logging.disable(logging.ERROR)
+    asyncio.run(serve_fakes(conn, args))
+
+
+async def drive(conn, port, args):
+    # Imported here so the fakes' process never loads the bot
+    import bot
+
+    base_url = f"http://127.0.0.1:{port}"
+    options = {'api_base_url': base_url, 'concurrent_updates': args.concurrency, 'rate_limit': args.rate_limit}
+    http_server, ingress = await bot.start_services(metrics_port=0)
+    application = await bot.run_bot(TOKEN, base_url + WEBHOOK_PATH, BOT_NAME, options=options)
+    if bot.outbox is not None:
+        bot.outbox.start_replay()
+
+    results = await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    await bot.shutdown({BOT_NAME: application}, http_server)
+    conn.send('stop')
+    return results
+
+
+def report(args, results):
+    latencies = results['latencies']
+    answered = len(latencies)
+    elapsed = results['elapsed']
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"{args.updates} updates ({args.mix}), concurrency {args.concurrency}, "
+          f"n8n latency {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms, error rate {args.error_rate:.0%}")
+    print(f"  answered     : {answered}/{args.updates} "
+          f"({results['answers']['sendMessage']} replies, {results['answers']['setMessageReaction']} reactions)")
+    print(f"  n8n requests : {results['n8n_requests']} ({results['n8n_errors']} failed)")
+    print(f"  throughput   : {answered / elapsed:8.1f} updates/s over {elapsed:.2f} s")
+    for name, q in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+        print(f"  latency {name}  : {percentile(latencies, q) * 1000:8.1f} ms")
+    print(f"  peak RSS     : {peak_rss_mb:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--mix', default='text=70,photo=10,document=10,start=10',
+                        help="weights of text, photo, document and start updates")
+    parser.add_argument('--rate', type=float, default=0.0, help="updates released per second; 0 releases all at once")
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent_updates for the bot")
+    parser.add_argument('--latency', type=float, default=0.05, help="mean fake n8n latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.01, help="standard deviation of the n8n latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of n8n calls answered with 500")
+    parser.add_argument('--reply-rate', type=float, default=0.5, help="fraction of n8n answers carrying a reply")
+    parser.add_argument('--rate-limit', action='store_true',
+                        help="keep Telegram's flood limits on outbound calls; off measures the bridge alone")
+    parser.add_argument('--deadline', type=float, default=120.0, help="give up on unanswered updates after this many seconds")
+    args = parser.parse_args()
+
+    conn, child_conn = multiprocessing.Pipe()
+    fakes = multiprocessing.get_context('spawn').Process(target=fakes_process, args=(child_conn, args), daemon=True)
+    fakes.start()
+    port = conn.recv()
+    started = time.perf_counter()
+    results = asyncio.run(drive(conn, port, args))
+    fakes.join(10)
+    report(args, results)
+    print(f"  wall clock   : {time.perf_counter() - started:8.2f} s")
+
+
+if __name__ == '__main__':
+    main()
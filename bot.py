@@ -1,10 +1,44 @@
 import os
+import time
+import signal
 import logging
-import requests
 import asyncio
+import httpx
+import metrics
+import tracing
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, SimpleUpdateProcessor, filters, ContextTypes
+from n8n_client import N8nClient
+from dispatch import ChatOrderedUpdateProcessor
+from outbox import Outbox
+from batching import WebhookBatcher
+from http_server import HttpServer
+from webhook_server import (
+    TelegramWebhookIngress, BOT_MODE, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_BASE_URL, WEBHOOK_SECRET
+)
+from registry import load_bot_configs, HANDLER_TYPES
+from reply_cache import ReplyCache
+from resilience import ResilientN8nClient
+from events import CommandEvent, MessageEvent, MergedMessageEvent, PhotoEvent, DocumentEvent, AlbumEvent
+from media_relay import MediaRelay, MediaRelayError, RelayPolicy
+from metrics import METRICS_LISTEN, METRICS_PORT
+from albums import ALBUM_WINDOW_MS, ALBUM_MAX_ITEMS
+from coalescer import KeyedCoalescer
+from outbound import OutboundScheduler, TELEGRAM_RATE_LIMIT, REPLY, REACTION
+from admission import AdmissionController, AdmissionPolicy, AdmissionUpdateProcessor
+from streaming import StreamingReply, N8N_STREAM_REPLIES
+from routing import Router, fan_out
+from health import LoopWatchdog, HealthChecks, PollingRequest, HEALTH_LISTEN, HEALTH_PORT
+from chat_context import ChatContext, reply_entry, CHAT_CONTEXT_SIZE
+from profiling import Profiler, ProfilerBusy, PROFILE_ADMIN_IDS, PROFILE_SECONDS, CPU, MEMORY
+from checkpoint import (
+    UpdateCheckpoint, CheckpointedUpdateQueue, CheckpointUpdateProcessor, UPDATE_CHECKPOINT_PATH, bot_id_for,
+    defer_done
+)
+from callbacks import (
+    CallbackRegistry, CALLBACK_PATH, N8N_ASYNC_REPLY, N8N_CALLBACK_LISTEN, N8N_CALLBACK_PORT, N8N_CALLBACK_BASE_URL
+)
 
 load_dotenv()
 
@@ -14,202 +48,676 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Primary bot configuration
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-N8N_WEBHOOK_URL = os.getenv('N8N_WEBHOOK_URL')
-
-# Secondary bot configuration (TVO)
-TELEGRAM_BOT_TOKEN_TVO = os.getenv('TELEGRAM_BOT_TOKEN_TVO')
-N8N_WEBHOOK_URL_TVO = os.getenv('N8N_WEBHOOK_URL_TVO')
-
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
-if not N8N_WEBHOOK_URL:
-    raise ValueError("N8N_WEBHOOK_URL not found in environment variables")
-if not TELEGRAM_BOT_TOKEN_TVO:
-    raise ValueError("TELEGRAM_BOT_TOKEN_TVO not found in environment variables")
-if not N8N_WEBHOOK_URL_TVO:
-    raise ValueError("N8N_WEBHOOK_URL_TVO not found in environment variables")
-
-def send_to_n8n(data, webhook_url):
-    """Send data to n8n webhook"""
+# JSON bot registry; without one, the Primary and TVO bots are read from the environment
+BOT_CONFIG_FILE = os.getenv('BOT_CONFIG_FILE')
+
+DEFAULT_WELCOME_MESSAGE = "Hello! I'm your n8n bridge bot. Send me any message and I'll forward it to your n8n workflow."
+
+# Updates from different chats processed in parallel; 1 keeps the default sequential mode
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '1'))
+
+# Text messages a user sends within this many ms of each other go to n8n as one event; 0 disables it
+MESSAGE_DEBOUNCE_MS = int(os.getenv('MESSAGE_DEBOUNCE_MS', '0'))
+MESSAGE_DEBOUNCE_MAX = int(os.getenv('MESSAGE_DEBOUNCE_MAX', '20'))
+
+# SQLite file that queues events while n8n is unreachable; unset disables the outbox
+N8N_OUTBOX_PATH = os.getenv('N8N_OUTBOX_PATH')
+
+# Micro-batching: events per webhook are posted as one JSON array; a window of 0 disables it
+N8N_BATCH_WINDOW_MS = int(os.getenv('N8N_BATCH_WINDOW_MS', '0'))
+N8N_BATCH_MAX_SIZE = int(os.getenv('N8N_BATCH_MAX_SIZE', '20'))
+
+# Cache of n8n replies to identical text messages; a TTL of 0 disables it
+REPLY_CACHE_TTL = float(os.getenv('REPLY_CACHE_TTL', '0'))
+REPLY_CACHE_MAX_BYTES = int(os.getenv('REPLY_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"BOT_MODE must be 'polling' or 'webhook', got {BOT_MODE!r}")
+
+BOTS = load_bot_configs(BOT_CONFIG_FILE)
+
+# Shared by every bot and handler so connections to each n8n host are reused
+n8n_client = N8nClient()
+
+# Circuit breaker, adaptive timeout and hedging per webhook, in front of the pooled client
+resilient_client = ResilientN8nClient(n8n_client)
+
+batcher = WebhookBatcher(resilient_client, N8N_BATCH_WINDOW_MS / 1000, N8N_BATCH_MAX_SIZE) if N8N_BATCH_WINDOW_MS > 0 else None
+
+# Streams photo and document bytes to n8n for bots with the media_relay option
+media_relay = MediaRelay(resilient_client)
+
+# Photos and documents of one media group, held back until the whole album has arrived
+album_collector = KeyedCoalescer(ALBUM_MAX_ITEMS)
+
+# Bursts of text messages per chat and user, held back until the user pauses
+message_debouncer = KeyedCoalescer(MESSAGE_DEBOUNCE_MAX)
+
+reply_cache = ReplyCache(REPLY_CACHE_TTL, REPLY_CACHE_MAX_BYTES) if REPLY_CACHE_TTL > 0 else None
+
+# Running bots by Telegram id, used to deliver replies to replayed events
+replay_bots = {}
+
+# Bot name of every running Application, to drop its metrics when it stops
+bot_names = {}
+
+# Outbound scheduler of every rate-limited bot, by Telegram id
+outbound_schedulers = {}
+
+# Spans of sampled updates, written to TRACE_PATH
+tracer = tracing.Tracer() if tracing.TRACE_PATH else None
+
+# Compiled "routes" of every bot that has them, by Telegram id
+routers = {}
+
+# Fan-out deliveries still running after another destination answered first
+fanout_tasks = set()
+
+# Recent messages and replies per chat, sent along with every event of bots in chat_context_sizes
+chat_context = ChatContext()
+# Entries kept per chat, by Telegram id of every bot with a context window
+chat_context_sizes = {}
+
+async def with_chat_context(data, bot):
+    """data with the chat's recent context, for bots that keep one; data is remembered in the context"""
+    size = chat_context_sizes.get(bot.id) if bot is not None else None
+    chat_id = data.get('chat_id')
+    if not size or not chat_id or 'context' in data:
+        return data
+    return await chat_context.attach(data, (bot.id, chat_id), size)
+
+async def remember_reply(bot, chat_id, text):
+    """Add a reply sent to the chat to its context"""
+    size = chat_context_sizes.get(bot.id)
+    if size:
+        await chat_context.add((bot.id, chat_id), size, reply_entry(text))
+
+async def deliver_replayed_reply(bot_id, data, n8n_response):
+    """Send the n8n reply for an event whose handler has finished: replayed from the outbox, or a callback"""
+    bot = replay_bots.get(bot_id)
+    if not data.get('chat_id'):
+        return
+    if n8n_response and isinstance(n8n_response, dict) and 'reply' in n8n_response:
+        if bot is None:
+            # The bot stopped, or moved to another supervisor worker, since the event was queued
+            logger.warning(f"Dropping n8n reply for bot {bot_id}: it is not running in this process")
+            return
+        await send_to_telegram(bot, data['chat_id'], 'reply', lambda: bot.send_message(
+            chat_id=data['chat_id'],
+            text=n8n_response['reply'],
+            reply_to_message_id=data.get('message_id')
+        ))
+        await remember_reply(bot, data['chat_id'], n8n_response['reply'])
+
+outbox = Outbox(N8N_OUTBOX_PATH, batcher or resilient_client, on_replayed=deliver_replayed_reply) if N8N_OUTBOX_PATH else None
+
+# Journal of received updates, so each is handled once across restarts
+update_checkpoint = UpdateCheckpoint(UPDATE_CHECKPOINT_PATH) if UPDATE_CHECKPOINT_PATH else None
+
+# Replies n8n posts back later for events of bots in async_reply_bots (Telegram ids)
+callback_registry = CallbackRegistry(deliver_replayed_reply)
+async_reply_bots = set()
+
+# Event loop lag and the /healthz and /readyz checks of every running bot
+watchdog = LoopWatchdog()
+health_checks = HealthChecks(watchdog, resilient_client)
+
+# CPU and memory profiles taken on SIGUSR1/SIGUSR2 or an admin's /profile command
+profiler = Profiler()
+
+# Servers for /metrics and the n8n callback endpoint, by port, when they do not share the webhook server
+local_servers = {}
+
+def routed_url(data, webhook_url, bot):
+    """The first destination the bot's routes pick for data; files and streamed replies go to that one only"""
+    router = routers.get(bot.id)
+    return router.match(data).destinations[0] if router is not None else webhook_url
+
+async def post_to_n8n(data, webhook_url, bot=None):
+    """Deliver data to one webhook, raising httpx.HTTPError unless the outbox takes it"""
+    if outbox is not None:
+        return await outbox.send(webhook_url, data, bot_id=bot.id if bot else None)
+    return await (batcher or resilient_client).request(webhook_url, data)
+
+async def send_to_n8n(data, webhook_url, bot=None):
+    """Send data to n8n webhook, or to the destinations the bot's routes pick for it"""
+    bot_name, handler_type = metrics.current_labels.get()
+    data = await with_chat_context(data, bot)
+    correlation_id = None
+    if bot is not None and bot.id in async_reply_bots and data.get('chat_id'):
+        data = callback_registry.attach(data, bot.id)
+        correlation_id = data['correlation_id']
+    router = routers.get(bot.id) if bot is not None else None
+    route = router.match(data) if router is not None else None
+    with metrics.N8N_LATENCY.time(bot=bot_name, handler=handler_type), \
+            tracing.span('n8n', route=route.name if route else None):
+        if route is not None and len(route.destinations) > 1:
+            n8n_response = await fan_out(route, lambda url: post_to_n8n(data, url, bot), fanout_tasks)
+        else:
+            if route is not None:
+                webhook_url = route.destinations[0]
+            try:
+                n8n_response = await post_to_n8n(data, webhook_url, bot)
+            except httpx.HTTPError as e:
+                logger.error(f"Failed to send data to n8n: {e}")
+                n8n_response = None
+    if correlation_id and isinstance(n8n_response, dict) and 'reply' in n8n_response:
+        # Answered straight away after all; the handler sends it
+        callback_registry.discard(correlation_id)
+    return n8n_response
+
+async def relay_to_n8n(data, webhook_url, bot, policy, file_id, filename, mime_type):
+    """Send data to n8n together with the file, or just the data if the file cannot be relayed"""
+    bot_name, handler_type = metrics.current_labels.get()
+    data = await with_chat_context(data, bot)
+    try:
+        with metrics.N8N_LATENCY.time(bot=bot_name, handler=handler_type), tracing.span('n8n.relay', file=filename):
+            return await media_relay.relay(bot, routed_url(data, webhook_url, bot), data, file_id, filename,
+                                           mime_type, policy.max_bytes)
+    except MediaRelayError as e:
+        logger.warning(f"Not relaying {filename}, sending the file id instead: {e}")
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to relay {filename} to n8n, sending the file id instead: {e}")
+    return await send_to_n8n(data, webhook_url, bot)
+
+async def send_to_telegram(bot, chat_id, kind, call, wait=False):
+    """Queue a reply or reaction on the bot's outbound scheduler, or send it now if it has none
+
+    With wait, a queued call is awaited and its result returned.
+    """
+    bot_name = metrics.current_labels.get()[0]
+    # Queued calls run in the scheduler's task, outside the update's context
+    parent = tracing.current_span.get()
+    submitted = time.monotonic()
+
+    async def timed_call():
+        with metrics.TELEGRAM_LATENCY.time(bot=bot_name, kind=kind), tracing.span(
+                f'telegram.{kind}', parent, queued_ms=round((time.monotonic() - submitted) * 1000, 3)):
+            return await call()
+
+    scheduler = outbound_schedulers.get(bot.id)
+    if scheduler is None:
+        return await timed_call()
+    # A newer reaction in the chat acknowledges the older messages as well
+    if kind == 'reaction':
+        future = scheduler.submit(chat_id, timed_call, REACTION, supersede=True)
+    elif kind == 'busy':
+        # Never superseded: a reaction does not tell the user to slow down, and BUSY_NOTICE_INTERVAL already
+        # allows only one notice per chat at a time
+        future = scheduler.submit(chat_id, timed_call, REACTION)
+    else:
+        future = scheduler.submit(chat_id, timed_call, REPLY)
+    if wait:
+        return await future
+
+async def stream_from_n8n(update, context, data, webhook_url):
+    """Send data to n8n and show its reply while it streams in; returns (n8n response, whether it was shown)"""
+    message = update.message
+    reply = StreamingReply(
+        message, lambda kind, call: send_to_telegram(context.bot, message.chat_id, kind, call, wait=True)
+    )
+    bot_name, handler_type = metrics.current_labels.get()
+    data = await with_chat_context(data, context.bot)
     try:
-        response = requests.post(webhook_url, json=data, timeout=10)
-        response.raise_for_status()
-        logger.info(f"Successfully sent data to n8n: {response.status_code}")
-        return response.json() if response.content else None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send data to n8n: {e}")
-        return None
-
-def create_start_handler(webhook_url):
+        with metrics.N8N_LATENCY.time(bot=bot_name, handler=handler_type), tracing.span('n8n.stream'):
+            await resilient_client.stream(routed_url(data, webhook_url, context.bot), data, reply.update)
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to stream reply from n8n: {e}")
+    await reply.finish()
+    return ({"reply": reply.text} if reply.text else None), reply.started
+
+async def reply_or_react(update, context, n8n_response):
+    """Reply with the n8n answer, or acknowledge the message with a reaction"""
+    message = update.message
+    if n8n_response and isinstance(n8n_response, dict) and 'reply' in n8n_response:
+        await send_to_telegram(context.bot, message.chat_id, 'reply',
+                               lambda: message.reply_text(n8n_response['reply']))
+        await remember_reply(context.bot, message.chat_id, n8n_response['reply'])
+    else:
+        await send_to_telegram(context.bot, message.chat_id, 'reaction', lambda: context.bot.set_message_reaction(
+            chat_id=message.chat_id,
+            message_id=message.message_id,
+            reaction="👍"
+        ))
+
+def collect_album_item(update, context, data, webhook_url, window):
+    """Hold back a photo or document that is part of an album; the album goes to n8n as one event"""
+    message = update.message
+
+    async def send_album(items):
+        first_update, first_context = items[0][0], items[0][1]
+        album = AlbumEvent.from_events(message.media_group_id, [event for _, _, event in items])
+        n8n_response = await send_to_n8n(album, webhook_url, first_context.bot)
+        await reply_or_react(first_update, first_context, n8n_response)
+
+    key = (context.bot.id, message.chat_id, message.media_group_id)
+    # With the update checkpoint on, the item's update is done once its album has been handled
+    defer_done(album_collector.add(key, (update, context, data), window, send_album))
+
+def create_start_handler(webhook_url, welcome_message=DEFAULT_WELCOME_MESSAGE):
     """Create a start command handler with specific webhook URL"""
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
-        user = update.effective_user
-
-        data = {
-            "type": "command",
-            "command": "start",
-            "user_id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "timestamp": update.message.date.isoformat()
-        }
+        with tracing.span('build_payload'):
+            data = CommandEvent.from_update(update, "start")
 
-        n8n_response = send_to_n8n(data, webhook_url)
+        n8n_response = await send_to_n8n(data, webhook_url, context.bot)
 
-        welcome_message = "Hello! I'm your n8n bridge bot. Send me any message and I'll forward it to your n8n workflow."
-        await update.message.reply_text(welcome_message)
+        await send_to_telegram(context.bot, update.message.chat_id, 'reply',
+                               lambda: update.message.reply_text(welcome_message))
 
     return start
 
-def create_message_handler(webhook_url):
+def create_message_handler(webhook_url, reply_cache=None, debounce_window=0, stream_replies=False):
     """Create a message handler with specific webhook URL"""
+    async def send_text(update, context, text, build_event):
+        n8n_response = reply_cache.get(webhook_url, text) if reply_cache is not None else None
+        if n8n_response is None:
+            with tracing.span('build_payload'):
+                data = build_event()
+            replied = False
+            if stream_replies:
+                n8n_response, replied = await stream_from_n8n(update, context, data, webhook_url)
+            else:
+                n8n_response = await send_to_n8n(data, webhook_url, context.bot)
+            if reply_cache is not None:
+                reply_cache.put(webhook_url, text, n8n_response)
+            if replied:
+                await remember_reply(context.bot, update.message.chat_id, n8n_response['reply'])
+                return
+
+        await reply_or_react(update, context, n8n_response)
+
+    async def send_burst(items):
+        last_update, last_context, data = items[-1]
+        if len(items) > 1:
+            data = MergedMessageEvent.from_events([event for _, _, event in items])
+        await send_text(last_update, last_context, data.text, lambda: data)
+
     async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle all text messages"""
-        user = update.effective_user
         message = update.message
+        if debounce_window > 0:
+            key = (context.bot.id, message.chat_id, update.effective_user.id)
+            defer_done(message_debouncer.add(key, (update, context, MessageEvent.from_update(update)),
+                                             debounce_window, send_burst))
+            return
 
-        data = {
-            "type": "message",
-            "message_id": message.message_id,
-            "text": message.text,
-            "user_id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "chat_id": message.chat_id,
-            "timestamp": message.date.isoformat()
-        }
-
-        n8n_response = send_to_n8n(data, webhook_url)
-
-        if n8n_response and isinstance(n8n_response, dict) and 'reply' in n8n_response:
-            await update.message.reply_text(n8n_response['reply'])
-        else:
-            await context.bot.set_message_reaction(
-                chat_id=message.chat_id,
-                message_id=message.message_id,
-                reaction="👍"
-            )
+        await send_text(update, context, message.text, lambda: MessageEvent.from_update(update))
 
     return handle_message
 
-def create_photo_handler(webhook_url):
+def create_photo_handler(webhook_url, relay_policy=None, album_window=0):
     """Create a photo handler with specific webhook URL"""
     async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo messages"""
-        user = update.effective_user
-        message = update.message
-        photo = message.photo[-1]  # Get the highest resolution photo
-
-        data = {
-            "type": "photo",
-            "message_id": message.message_id,
-            "photo_file_id": photo.file_id,
-            "caption": message.caption,
-            "user_id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "chat_id": message.chat_id,
-            "timestamp": message.date.isoformat()
-        }
-
-        n8n_response = send_to_n8n(data, webhook_url)
-
-        if n8n_response and isinstance(n8n_response, dict) and 'reply' in n8n_response:
-            await update.message.reply_text(n8n_response['reply'])
+        photo = update.message.photo[-1]  # Get the highest resolution photo
+        with tracing.span('build_payload'):
+            data = PhotoEvent.from_update(update)
+
+        if album_window and relay_policy is None and update.message.media_group_id:
+            collect_album_item(update, context, data, webhook_url, album_window)
+            return
+        if relay_policy is not None and relay_policy.allows(photo.file_size, 'image/jpeg'):
+            n8n_response = await relay_to_n8n(data, webhook_url, context.bot, relay_policy,
+                                              photo.file_id, f"{photo.file_unique_id}.jpg", 'image/jpeg')
         else:
-            await context.bot.set_message_reaction(
-                chat_id=message.chat_id,
-                message_id=message.message_id,
-                reaction="👍"
-            )
+            n8n_response = await send_to_n8n(data, webhook_url, context.bot)
+
+        await reply_or_react(update, context, n8n_response)
 
     return handle_photo
 
-def create_document_handler(webhook_url):
+def create_document_handler(webhook_url, relay_policy=None, album_window=0):
     """Create a document handler with specific webhook URL"""
     async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle document messages"""
-        user = update.effective_user
-        message = update.message
-        document = message.document
-
-        data = {
-            "type": "document",
-            "message_id": message.message_id,
-            "document_file_id": document.file_id,
-            "document_name": document.file_name,
-            "document_mime_type": document.mime_type,
-            "caption": message.caption,
-            "user_id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "chat_id": message.chat_id,
-            "timestamp": message.date.isoformat()
-        }
-
-        n8n_response = send_to_n8n(data, webhook_url)
-
-        if n8n_response and isinstance(n8n_response, dict) and 'reply' in n8n_response:
-            await update.message.reply_text(n8n_response['reply'])
+        document = update.message.document
+        with tracing.span('build_payload'):
+            data = DocumentEvent.from_update(update)
+
+        if album_window and relay_policy is None and update.message.media_group_id:
+            collect_album_item(update, context, data, webhook_url, album_window)
+            return
+        if relay_policy is not None and relay_policy.allows(document.file_size, document.mime_type):
+            n8n_response = await relay_to_n8n(data, webhook_url, context.bot, relay_policy, document.file_id,
+                                              document.file_name or document.file_unique_id,
+                                              document.mime_type or 'application/octet-stream')
         else:
-            await context.bot.set_message_reaction(
-                chat_id=message.chat_id,
-                message_id=message.message_id,
-                reaction="👍"
-            )
+            n8n_response = await send_to_n8n(data, webhook_url, context.bot)
+
+        await reply_or_react(update, context, n8n_response)
 
     return handle_document
 
-async def run_bot(token, webhook_url, bot_name):
-    """Run a single bot instance"""
-    application = Application.builder().token(token).build()
+def create_profile_handler():
+    """Create the /profile [cpu|memory] [seconds] command handler; run_bot restricts it to admins"""
+    async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /profile command"""
+        message = update.message
+
+        async def reply(text):
+            await send_to_telegram(context.bot, message.chat_id, 'reply', lambda: message.reply_text(text))
+
+        args = context.args or []
+        mode = args[0] if args else CPU
+        try:
+            seconds = float(args[1]) if len(args) > 1 else PROFILE_SECONDS
+            task = profiler.start(mode, seconds)
+        except (ValueError, ProfilerBusy) as e:
+            await reply(f"Cannot profile: {e}")
+            return
+        await reply(f"Profiling {mode} for {min(seconds, profiler.max_seconds):g}s...")
+
+        async def report():
+            try:
+                path = await task
+            except Exception as e:
+                await reply(f"Profile failed: {e}")
+                return
+            await reply(f"Profile written to {path}")
+
+        context.application.create_task(report(), update=update)
+
+    return profile
+
+async def reply_busy(update, busy_message):
+    """Tell a chat whose updates are being shed that the bot is busy"""
+    message = update.effective_message
+    if message is not None:
+        await send_to_telegram(update.get_bot(), message.chat_id, 'busy', lambda: message.reply_text(busy_message))
+
+def instrument(callback, bot_name, handler_type):
+    """Count and time every update a handler callback handles, and trace the sampled ones"""
+    callback = metrics.instrument(callback, bot_name, handler_type)
+    return tracing.instrument(callback, tracer, bot_name, handler_type) if tracer is not None else callback
+
+def pending_updates(application):
+    """Updates received for a bot that no handler has started on yet"""
+    processor = application.update_processor
+    while isinstance(processor, (AdmissionUpdateProcessor, CheckpointUpdateProcessor)):
+        processor = processor.inner
+    queued = processor.queued_updates if isinstance(processor, ChatOrderedUpdateProcessor) else 0
+    return application.update_queue.qsize() + queued
+
+async def run_bot(token, webhook_url, bot_name, ingress=None, options=None):
+    """Run a single bot instance, polling unless a webhook ingress is given"""
+    options = options or {}
+    concurrent_updates = options.get('concurrent_updates', CONCURRENT_UPDATES)
+    router = Router.from_option(options.get('routes'), webhook_url)
+    context_size = options.get('chat_context', CHAT_CONTEXT_SIZE)
+    builder = Application.builder().token(token)
+    polling = None
+    if ingress is None:
+        # Remembers when getUpdates last answered, for /readyz
+        polling = PollingRequest(connection_pool_size=1)
+        builder = builder.get_updates_request(polling)
+    api_base_url = options.get('api_base_url')
+    if api_base_url:
+        # A self-hosted Bot API server, or the fake one used by benchmarks/run_load.py
+        builder = builder.base_url(f"{api_base_url}/bot").base_file_url(f"{api_base_url}/file/bot")
+    processor = ChatOrderedUpdateProcessor(concurrent_updates) if concurrent_updates > 1 else None
+    admission_policy = AdmissionPolicy.from_option(options.get('admission'))
+    if admission_policy is not None:
+        processor = AdmissionUpdateProcessor(processor or SimpleUpdateProcessor(1),
+                                             AdmissionController(admission_policy), bot_name, reply_busy)
+    if update_checkpoint is not None:
+        bot_id = bot_id_for(token)
+        builder = builder.update_queue(CheckpointedUpdateQueue(update_checkpoint, bot_id))
+        processor = CheckpointUpdateProcessor(processor or SimpleUpdateProcessor(1), update_checkpoint, bot_id)
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+    application = builder.build()
 
     # Add handlers with specific webhook URL
-    application.add_handler(CommandHandler("start", create_start_handler(webhook_url)))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, create_message_handler(webhook_url)))
-    application.add_handler(MessageHandler(filters.PHOTO, create_photo_handler(webhook_url)))
-    application.add_handler(MessageHandler(filters.Document.ALL, create_document_handler(webhook_url)))
+    handlers = options.get('handlers', HANDLER_TYPES)
+    if 'start' in handlers:
+        welcome_message = options.get('welcome_message', DEFAULT_WELCOME_MESSAGE)
+        callback = create_start_handler(webhook_url, welcome_message)
+        application.add_handler(CommandHandler("start", instrument(callback, bot_name, 'start')))
+    if 'message' in handlers:
+        # Cached replies are keyed by text alone, which routes by chat or user and chat context would not respect
+        cache = reply_cache if options.get('reply_cache', router is None and not context_size) else None
+        debounce_window = options.get('debounce_ms', MESSAGE_DEBOUNCE_MS) / 1000
+        stream_replies = options.get('stream_replies', N8N_STREAM_REPLIES)
+        callback = create_message_handler(webhook_url, cache, debounce_window, stream_replies)
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(callback, bot_name, 'message')))
+    relay_policy = RelayPolicy.from_option(options.get('media_relay'))
+    album_window = options.get('album_window_ms', ALBUM_WINDOW_MS) / 1000
+    if 'photo' in handlers:
+        callback = create_photo_handler(webhook_url, relay_policy, album_window)
+        application.add_handler(MessageHandler(filters.PHOTO, instrument(callback, bot_name, 'photo')))
+    if 'document' in handlers:
+        callback = create_document_handler(webhook_url, relay_policy, album_window)
+        application.add_handler(MessageHandler(filters.Document.ALL, instrument(callback, bot_name, 'document')))
+    profile_admins = options.get('profile_admins', PROFILE_ADMIN_IDS)
+    if profile_admins:
+        application.add_handler(CommandHandler("profile", create_profile_handler(),
+                                               filters=filters.User(user_id=profile_admins)))
+    bot_names[application] = bot_name
+    metrics.PENDING_UPDATES.set_function(lambda: pending_updates(application), bot=bot_name)
+    scheduler = OutboundScheduler() if options.get('rate_limit', TELEGRAM_RATE_LIMIT) else None
 
     logger.info(f"{bot_name} is starting...")
 
-    # Initialize and start polling
+    # Initialize and start receiving updates
     await application.initialize()
+    replay_bots[application.bot.id] = application.bot
+    if options.get('async_reply', N8N_ASYNC_REPLY):
+        if callback_registry.enabled:
+            async_reply_bots.add(application.bot.id)
+        else:
+            logger.warning(f"{bot_name} wants async replies but N8N_CALLBACK_PORT is not set; n8n must reply inline")
+    if router is not None:
+        routers[application.bot.id] = router
+    if context_size:
+        chat_context_sizes[application.bot.id] = context_size
+    if scheduler is not None:
+        outbound_schedulers[application.bot.id] = scheduler
+        metrics.OUTBOUND_PENDING.set_function(lambda: scheduler.pending, bot=bot_name)
+    if update_checkpoint is not None:
+        # Updates received before a crash or restart but never finished go first
+        for payload in await update_checkpoint.load(bot_id):
+            application.update_queue.put_nowait(Update.de_json(payload, application.bot))
     await application.start()
-    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    if ingress is not None:
+        await ingress.register(application, token, bot_name)
+    else:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    webhook_urls = {webhook_url}
+    if router is not None:
+        webhook_urls.update(url for rule in router.rules for url in rule.route.destinations)
+    health_checks.add_bot(bot_name, application, webhook_urls, polling)
 
     return application
 
-async def main():
-    """Start both bots concurrently"""
+async def stop_receiving(application):
+    """Stop fetching updates and wait for the handlers of those already received"""
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+
+async def stop_bot(application):
+    """Stop a bot started by run_bot"""
+    health_checks.remove_bot(bot_names.get(application))
+    await stop_receiving(application)
+    async_reply_bots.discard(application.bot.id)
+    routers.pop(application.bot.id, None)
+    chat_context_sizes.pop(application.bot.id, None)
+    # Replies queued by the last handlers still go out before the bot shuts down
+    scheduler = outbound_schedulers.pop(application.bot.id, None)
+    if scheduler is not None:
+        await scheduler.aclose()
+    await application.shutdown()
+    bot_name = bot_names.pop(application, None)
+    if bot_name is not None:
+        metrics.PENDING_UPDATES.remove(bot=bot_name)
+        metrics.OUTBOUND_PENDING.remove(bot=bot_name)
+
+async def start_bots(bots, ingress=None):
+    """Start bots concurrently, skipping the ones that fail; returns applications by bot name"""
+    results = await asyncio.gather(
+        *(run_bot(bot.token, bot.webhook_url, bot.name, ingress, bot.options) for bot in bots),
+        return_exceptions=True
+    )
+    applications = {}
+    for bot, result in zip(bots, results):
+        if isinstance(result, BaseException):
+            logger.error(f"{bot.name} failed to start: {result}")
+        else:
+            applications[bot.name] = result
+    return applications
+
+async def add_local_route(http_server, port, listen, method, path, handler):
+    """Serve a route on the webhook server if it listens on port, otherwise on a local server for port"""
+    if http_server is not None and port == WEBHOOK_PORT:
+        http_server.add_route(method, path, handler)
+        return http_server
+    server = local_servers.get(port)
+    if server is None:
+        server = local_servers[port] = HttpServer(listen, port)
+        await server.start()
+    server.add_route(method, path, handler)
+    return server
+
+async def start_services(metrics_port=METRICS_PORT, callback_port=N8N_CALLBACK_PORT, health_port=HEALTH_PORT):
+    """Start the services shared by every bot; returns (http_server, ingress)"""
+    watchdog.start()
+    if outbox is not None:
+        await outbox.open()
+        metrics.OUTBOX_DEPTH.set_function(lambda: outbox.depth)
+    if reply_cache is not None:
+        for stat in reply_cache.stats():
+            metrics.REPLY_CACHE_STATS.set_function(lambda stat=stat: reply_cache.stats()[stat], stat=stat)
+    if update_checkpoint is not None:
+        await update_checkpoint.open()
+    if tracer is not None:
+        tracer.open()
+    await chat_context.open()
+    metrics.CHAT_CONTEXT_BYTES.set_function(lambda: chat_context.size)
+
+    http_server = None
+    ingress = None
+    if BOT_MODE == 'webhook':
+        http_server = HttpServer(WEBHOOK_LISTEN, WEBHOOK_PORT)
+        ingress = TelegramWebhookIngress(http_server, WEBHOOK_BASE_URL, WEBHOOK_SECRET)
+        await http_server.start()
+
+    if metrics_port:
+        await add_local_route(http_server, metrics_port, METRICS_LISTEN, 'GET', '/metrics', metrics.registry.handle)
+    if callback_port:
+        server = await add_local_route(http_server, callback_port, N8N_CALLBACK_LISTEN,
+                                       'POST', CALLBACK_PATH, callback_registry.handle_callback)
+        base_url = N8N_CALLBACK_BASE_URL.format(port=server.bound_port).rstrip('/')
+        callback_registry.callback_url = base_url + CALLBACK_PATH
+    if health_port:
+        await add_local_route(http_server, health_port, HEALTH_LISTEN, 'GET', '/healthz', health_checks.handle_healthz)
+        await add_local_route(http_server, health_port, HEALTH_LISTEN, 'GET', '/readyz', health_checks.handle_readyz)
+    return http_server, ingress
+
+async def stop_services(http_server):
+    """Stop the shared services once every bot has stopped"""
+    for server in local_servers.values():
+        await server.stop()
+    local_servers.clear()
+    callback_registry.callback_url = None
+    if fanout_tasks:
+        # Deliveries to the slower destinations of a route finish before the clients close
+        await asyncio.wait(set(fanout_tasks))
+    if outbox is not None:
+        await outbox.stop()
+    if update_checkpoint is not None:
+        await update_checkpoint.close()
+    if batcher is not None:
+        await batcher.aclose()
+    await media_relay.aclose()
+    await n8n_client.aclose()
+    if tracer is not None:
+        tracer.close()
+    # Chats still in memory are spilled, to be picked up again after a restart
+    await chat_context.close()
+    await watchdog.stop()
+
+async def shutdown(applications, http_server):
+    """Stop every bot, then the shared services"""
+    logger.info("Stopping all bots...")
+    # Properly shutdown every application
+    if http_server is not None:
+        await http_server.stop()
+    # No handler can buffer another album item or message once every bot has stopped receiving
+    await asyncio.gather(*(stop_receiving(application) for application in applications.values()))
+    # Albums and message bursts still waiting for their window are sent while their bots can still reply
+    await album_collector.aclose()
+    await message_debouncer.aclose()
+    # A profile still running is cut short but written
+    await profiler.aclose()
+    await asyncio.gather(*(stop_bot(application) for application in applications.values()))
+    await stop_services(http_server)
+    logger.info("All bots stopped.")
+
+def install_stop_signals(stop_event):
+    """Set stop_event on SIGINT and SIGTERM; returns the signals handled"""
+    loop = asyncio.get_running_loop()
+    handled = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: Ctrl+C cancels main() instead, which still shuts down below
+            continue
+        handled.append(sig)
+    return handled
+
+def start_profile(mode):
+    """Signal handler that starts a profile unless one is running"""
     try:
-        # Create both bot instances
-        primary_app = await run_bot(TELEGRAM_BOT_TOKEN, N8N_WEBHOOK_URL, "Primary Bot")
-        tvo_app = await run_bot(TELEGRAM_BOT_TOKEN_TVO, N8N_WEBHOOK_URL_TVO, "TVO Bot")
-
-        logger.info("Both bots are running. Press Ctrl+C to stop.")
+        profiler.start(mode)
+    except ProfilerBusy as e:
+        logger.warning(f"Not starting a {mode} profile: {e}")
+
+def install_profile_signals():
+    """Profile CPU on SIGUSR1 and memory on SIGUSR2; returns the signals handled"""
+    loop = asyncio.get_running_loop()
+    handled = []
+    for name, mode in (('SIGUSR1', CPU), ('SIGUSR2', MEMORY)):
+        sig = getattr(signal, name, None)
+        if sig is None:
+            # Not on Windows; /profile still works
+            continue
+        loop.add_signal_handler(sig, start_profile, mode)
+        handled.append(sig)
+    return handled
+
+async def main(bots=None, stop_event=None):
+    """Start every configured bot concurrently and run until stop_event is set, or SIGINT/SIGTERM without one"""
+    bots = BOTS if bots is None else bots
+    applications = {}
+    http_server = None
+    signals = []
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        signals = install_stop_signals(stop_event) + install_profile_signals()
+    try:
+        http_server, ingress = await start_services()
 
-        # Keep the bots running
-        await asyncio.Event().wait()
+        applications = await start_bots(bots, ingress)
+        if not applications:
+            raise RuntimeError("No bot could be started")
 
-    except KeyboardInterrupt:
-        logger.info("Stopping both bots...")
-        # Properly shutdown both applications
-        await primary_app.updater.stop()
-        await primary_app.stop()
-        await primary_app.shutdown()
+        if outbox is not None:
+            outbox.start_replay()
 
-        await tvo_app.updater.stop()
-        await tvo_app.stop()
-        await tvo_app.shutdown()
+        logger.info(f"{len(applications)} bots are running. Press Ctrl+C to stop.")
 
-        logger.info("Both bots stopped.")
+        # Keep the bots running
+        await stop_event.wait()
+    finally:
+        # Runs on a signal, on cancellation and when startup fails, so queues and journals are left consistent
+        await shutdown(applications, http_server)
+        loop = asyncio.get_running_loop()
+        for sig in signals:
+            loop.remove_signal_handler(sig)
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
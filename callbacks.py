@@ -0,0 +1,119 @@
+import os
+import hmac
+import json
+import time
+import uuid
+import secrets
+import logging
+from collections import OrderedDict
+
+from events import Event
+from http_server import Response
+
+logger = logging.getLogger(__name__)
+
+# Bots reply through the callback endpoint instead of in the webhook response; bots can override with "async_reply"
+N8N_ASYNC_REPLY = os.getenv('N8N_ASYNC_REPLY', '0').lower() in ('1', 'true', 'yes')
+# Local endpoint n8n posts late replies to; a port of 0 disables it
+N8N_CALLBACK_LISTEN = os.getenv('N8N_CALLBACK_LISTEN', '127.0.0.1')
+N8N_CALLBACK_PORT = int(os.getenv('N8N_CALLBACK_PORT', '0'))
+# Base URL n8n reaches the endpoint on; {port} is replaced with the port actually listened on
+N8N_CALLBACK_BASE_URL = os.getenv('N8N_CALLBACK_BASE_URL', 'http://127.0.0.1:{port}')
+# Seconds a reply is awaited before the correlation is forgotten, and how many may be awaited at once
+N8N_CALLBACK_TTL = float(os.getenv('N8N_CALLBACK_TTL', '3600'))
+N8N_CALLBACK_MAX_PENDING = int(os.getenv('N8N_CALLBACK_MAX_PENDING', '10000'))
+
+CALLBACK_PATH = '/n8n/reply'
+TOKEN_HEADER = 'x-callback-token'
+
+
+class PendingReply:
+    __slots__ = ('bot_id', 'chat_id', 'message_id', 'token', 'expires')
+
+    def __init__(self, bot_id, chat_id, message_id, token, expires):
+        self.bot_id = bot_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.token = token
+        self.expires = expires
+
+
+class CallbackRegistry:
+    """Correlate events sent to n8n with the replies n8n posts back later
+
+    attach() adds correlation_id, callback_url and callback_token to an
+    event. The workflow answers the webhook at once and, when it is done,
+    POSTs {"correlation_id": ..., "reply": ...} to callback_url with the
+    token in the X-Callback-Token header. The reply is handed to
+    on_reply(bot_id, {"chat_id", "message_id"}, {"reply": ...}), the same
+    call the outbox makes for replayed events. Each correlation takes one
+    reply and is forgotten after ttl seconds.
+    """
+
+    def __init__(self, on_reply=None, ttl=N8N_CALLBACK_TTL, max_pending=N8N_CALLBACK_MAX_PENDING):
+        self.on_reply = on_reply
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.callback_url = None
+        self._pending = OrderedDict()
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def enabled(self):
+        return self.callback_url is not None
+
+    def _expire(self, now):
+        # Every entry has the same ttl, so the oldest come first
+        while self._pending:
+            correlation_id, pending = next(iter(self._pending.items()))
+            if pending.expires > now and len(self._pending) <= self.max_pending:
+                break
+            del self._pending[correlation_id]
+            self.expired += 1
+            logger.warning(f"No n8n reply for chat {pending.chat_id} within {self.ttl:.0f}s; giving up on it")
+
+    def attach(self, data, bot_id):
+        """Return data as a dict with the fields n8n needs to reply later"""
+        now = time.monotonic()
+        correlation_id = uuid.uuid4().hex
+        token = secrets.token_urlsafe(24)
+        self._pending[correlation_id] = PendingReply(
+            bot_id, data.get('chat_id'), data.get('message_id'), token, now + self.ttl
+        )
+        self._expire(now)
+        payload = data.to_dict() if isinstance(data, Event) else dict(data)
+        payload.update(correlation_id=correlation_id, callback_url=self.callback_url, callback_token=token)
+        return payload
+
+    def discard(self, correlation_id):
+        """Forget a correlation that was answered in the webhook response after all"""
+        self._pending.pop(correlation_id, None)
+
+    async def handle_callback(self, request):
+        """HttpServer route handler for POST /n8n/reply"""
+        self._expire(time.monotonic())
+        try:
+            body = json.loads(request.body)
+            correlation_id = body['correlation_id']
+            reply = body['reply']
+        except (ValueError, TypeError, KeyError):
+            return Response(400, 'Expected {"correlation_id": ..., "reply": ...}')
+        if not isinstance(correlation_id, str) or not isinstance(reply, str) or not reply:
+            return Response(400, 'correlation_id and reply must be strings')
+        pending = self._pending.get(correlation_id)
+        if pending is None:
+            return Response(404, 'Unknown or expired correlation_id')
+        if not hmac.compare_digest(request.headers.get(TOKEN_HEADER, ''), pending.token):
+            logger.warning(f"Rejected n8n callback for chat {pending.chat_id} with a bad token")
+            return Response(403, 'Forbidden')
+        del self._pending[correlation_id]
+        try:
+            await self.on_reply(pending.bot_id, {'chat_id': pending.chat_id, 'message_id': pending.message_id},
+                                {'reply': reply})
+        except Exception as e:
+            logger.error(f"Failed to deliver n8n callback reply to chat {pending.chat_id}: {e}")
+            return Response(502, 'Reply could not be delivered')
+        return Response(200, 'OK')
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from events import Event
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Messages and replies remembered per chat and sent to n8n as "context"; 0 disables it; bots can override
+# with "chat_context"
+CHAT_CONTEXT_SIZE = int(os.getenv('CHAT_CONTEXT_SIZE', '0'))
+# Memory cap for every chat's context together; the chats idle the longest are evicted first
+CHAT_CONTEXT_MAX_BYTES = int(os.getenv('CHAT_CONTEXT_MAX_BYTES', str(16 * 1024 * 1024)))
+# SQLite file evicted chats are spilled to and reloaded from; unset forgets them
+CHAT_CONTEXT_PATH = os.getenv('CHAT_CONTEXT_PATH')
+# Days a spilled chat is kept without being used
+CHAT_CONTEXT_MAX_AGE_DAYS = float(os.getenv('CHAT_CONTEXT_MAX_AGE_DAYS', '7'))
+
+# Rough per-entry cost of the dict and its keys, and per-chat cost of the deque and OrderedDict slot
+ENTRY_OVERHEAD = 350
+CHAT_OVERHEAD = 700
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    bot_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    entries TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (bot_id, chat_id)
+) WITHOUT ROWID;
+"""
+
+
+def message_entry(data):
+    """Context entry for an event sent to n8n"""
+    entry = {'role': 'user', 'type': data.get('type'), 'message_id': data.get('message_id'),
+             'user_id': data.get('user_id'), 'timestamp': data.get('timestamp')}
+    text = data.get('text')
+    if text is None:
+        text = data.get('caption')
+    if text is not None:
+        entry['text'] = text
+    return entry
+
+
+def reply_entry(text):
+    """Context entry for a reply sent to the chat"""
+    return {'role': 'bot', 'text': text, 'timestamp': datetime.now(timezone.utc).isoformat()}
+
+
+def _entry_size(entry):
+    return ENTRY_OVERHEAD + len(entry.get('text') or '')
+
+
+class _Chat:
+    __slots__ = ('entries', 'size')
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.size = CHAT_OVERHEAD + sum(_entry_size(entry) for entry in entries)
+
+
+class ChatContext(SQLiteStore):
+    """The last messages and replies of every chat, for n8n to read from the payload
+
+    Each chat keeps a ring of its last `size` entries. Once all chats
+    together pass max_bytes, the chats used least recently are evicted;
+    with a path, they are spilled to SQLite and loaded again the next
+    time the chat writes, and every chat still in memory is spilled on
+    close(), so context survives restarts too. Chats are keyed by
+    (bot id, chat id).
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, max_bytes=CHAT_CONTEXT_MAX_BYTES, path=CHAT_CONTEXT_PATH,
+                 max_age=CHAT_CONTEXT_MAX_AGE_DAYS * 86400):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self.evictions = 0
+        self._chats = OrderedDict()
+        self._spilling = {}
+
+    def __len__(self):
+        return len(self._chats)
+
+    def _open(self):
+        conn = super()._open()
+        conn.execute("DELETE FROM chats WHERE updated < ?", (time.time() - self.max_age,))
+        return conn
+
+    def _load(self, key):
+        row = self._conn.execute(
+            "SELECT entries FROM chats WHERE bot_id = ? AND chat_id = ?", (str(key[0]), key[1])
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _spill(self, chats):
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chats (bot_id, chat_id, entries, updated) VALUES (?, ?, ?, ?)",
+            [(str(bot_id), chat_id, json.dumps(entries), now) for (bot_id, chat_id), entries in chats],
+        )
+
+    async def open(self):
+        if self.path:
+            await self._connect()
+
+    async def close(self):
+        """Spill every chat in memory, if there is a spill file, and forget them"""
+        if self._conn is not None:
+            await self._db(self._spill, [(key, list(chat.entries)) for key, chat in self._chats.items()])
+            await self._disconnect()
+        self._chats.clear()
+        self.size = 0
+
+    async def _chat(self, key, size):
+        chat = self._chats.get(key)
+        if chat is None and self._conn is not None:
+            # A chat still being spilled is taken back as it is
+            entries = self._spilling.get(key)
+            if entries is None:
+                entries = await self._db(self._load, key)
+            # Another update of the chat may have loaded it meanwhile
+            chat = self._chats.get(key)
+            if chat is None and entries:
+                chat = self._chats[key] = _Chat(deque(entries, maxlen=size))
+                self.size += chat.size
+        if chat is None:
+            chat = self._chats[key] = _Chat(deque(maxlen=size))
+            self.size += chat.size
+        self._chats.move_to_end(key)
+        return chat
+
+    async def recent(self, key, size):
+        """The chat's last entries, oldest first"""
+        chat = await self._chat(key, size)
+        return list(chat.entries)
+
+    async def add(self, key, size, entry):
+        """Append an entry to the chat, evicting idle chats if the cap is passed"""
+        chat = await self._chat(key, size)
+        if len(chat.entries) == chat.entries.maxlen:
+            chat.size -= _entry_size(chat.entries[0])
+            self.size -= _entry_size(chat.entries[0])
+        chat.entries.append(entry)
+        chat.size += _entry_size(entry)
+        self.size += _entry_size(entry)
+        await self._evict()
+
+    async def attach(self, data, key, size):
+        """Return data as a dict with the chat's context, and remember data as the chat's newest entry"""
+        history = await self.recent(key, size)
+        await self.add(key, size, message_entry(data))
+        payload = data.to_dict() if isinstance(data, Event) else dict(data)
+        payload['context'] = history
+        return payload
+
+    async def _evict(self):
+        evicted = []
+        # The chat written last stays, however large it is
+        while self.size > self.max_bytes and len(self._chats) > 1:
+            key, chat = self._chats.popitem(last=False)
+            self.size -= chat.size
+            self.evictions += 1
+            evicted.append((key, list(chat.entries)))
+        if evicted and self._conn is not None:
+            self._spilling.update(evicted)
+            try:
+                await self._db(self._spill, evicted)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to spill the context of {len(evicted)} chats: {e}")
+            finally:
+                for key, entries in evicted:
+                    if self._spilling.get(key) is entries:
+                        del self._spilling[key]
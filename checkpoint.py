@@ -0,0 +1,299 @@
+import os
+import json
+import asyncio
+import inspect
+import logging
+import contextvars
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# SQLite file with each bot's update checkpoint and journal; unset disables both
+UPDATE_CHECKPOINT_PATH = os.getenv('UPDATE_CHECKPOINT_PATH')
+# Handled update ids remembered per bot to drop redeliveries
+UPDATE_DEDUP_SIZE = int(os.getenv('UPDATE_DEDUP_SIZE', '4096'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates (
+    bot_id TEXT NOT NULL,
+    update_id INTEGER NOT NULL,
+    payload TEXT,
+    PRIMARY KEY (bot_id, update_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checkpoints (
+    bot_id TEXT PRIMARY KEY,
+    update_id INTEGER NOT NULL
+);
+"""
+
+# Futures the running handler has left its update to, so it is done only once they are
+_deferred = contextvars.ContextVar('deferred_done', default=None)
+
+
+def defer_done(future):
+    """Keep the update being handled unfinished until future resolves; for handlers that buffer it
+
+    A cancelled future leaves the update in the journal, to be handled again
+    after a restart. Outside a checkpointed update this does nothing.
+    """
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred.append(future)
+
+
+def bot_id_for(token):
+    """The bot's Telegram id, which is the part of its token before the colon"""
+    return token.split(':', 1)[0]
+
+
+class RecentIds:
+    """Ring buffer of the last `size` ids, with set lookups
+
+    Ids up to `size` below the last one that fell out of the ring, the floor,
+    are reported as seen too: Telegram numbers a bot's updates in increasing
+    order, so those were handled before it. Ids further below are new; after
+    a week without updates, Telegram starts again from a random id.
+    """
+
+    __slots__ = ('size', 'floor', '_ring', '_ids')
+
+    def __init__(self, size, ids=(), floor=-1):
+        self.size = size
+        self.floor = floor
+        self._ring = deque()
+        self._ids = set()
+        for update_id in ids:
+            self.add(update_id)
+
+    def __contains__(self, update_id):
+        return self.floor - self.size < update_id <= self.floor or update_id in self._ids
+
+    def __len__(self):
+        return len(self._ring)
+
+    def add(self, update_id):
+        if update_id in self:
+            return
+        self._ring.append(update_id)
+        self._ids.add(update_id)
+        if len(self._ring) > self.size:
+            evicted = self._ring.popleft()
+            self._ids.discard(evicted)
+            # Ids leave in the order they came, so after a restarted numbering the floor follows the new ids
+            self.floor = evicted
+
+
+class _BotState:
+    __slots__ = ('recent', 'in_progress', 'checkpoint', 'since_prune')
+
+    def __init__(self, recent, in_progress, checkpoint):
+        self.recent = recent
+        self.in_progress = in_progress
+        self.checkpoint = checkpoint
+        self.since_prune = 0
+
+
+class UpdateCheckpoint(SQLiteStore):
+    """Journal of every bot's updates, so each is handled once across restarts and crashes
+
+    An update is written down before it is queued, which is before the
+    Updater confirms it to Telegram (or the webhook answers 200), and
+    marked done once its handlers finish. On start, updates still in the
+    journal are queued again, and redeliveries of updates that are done or
+    in progress are dropped. The newest UPDATE_DEDUP_SIZE done ids per bot
+    are kept for that, together with the highest one, the bot's checkpoint.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path, dedup_size=UPDATE_DEDUP_SIZE):
+        super().__init__(path)
+        self.dedup_size = dedup_size
+        self._bots = {}
+        self.duplicates = 0
+
+    def _load(self, bot_id):
+        done = self._conn.execute(
+            "SELECT update_id FROM updates WHERE bot_id = ? AND payload IS NULL ORDER BY update_id DESC LIMIT ?",
+            (bot_id, self.dedup_size),
+        ).fetchall()
+        journal = self._conn.execute(
+            "SELECT update_id, payload FROM updates WHERE bot_id = ? AND payload IS NOT NULL ORDER BY update_id",
+            (bot_id,),
+        ).fetchall()
+        row = self._conn.execute("SELECT update_id FROM checkpoints WHERE bot_id = ?", (bot_id,)).fetchone()
+        return [update_id for update_id, in reversed(done)], journal, row[0] if row else 0
+
+    def _journal(self, bot_id, update_id, payload):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO updates (bot_id, update_id, payload) VALUES (?, ?, ?)",
+            (bot_id, update_id, payload),
+        )
+
+    def _done(self, bot_id, update_id, checkpoint, prune, restarted=False):
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.execute(
+                "UPDATE updates SET payload = NULL WHERE bot_id = ? AND update_id = ?", (bot_id, update_id)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (bot_id, update_id) VALUES (?, ?)", (bot_id, checkpoint)
+            )
+            if prune is not None:
+                self._conn.execute(
+                    "DELETE FROM updates WHERE bot_id = ? AND payload IS NULL AND update_id <= ?", (bot_id, prune)
+                )
+            if restarted:
+                # Done ids of the old numbering would otherwise be loaded as the newest after a restart
+                self._conn.execute(
+                    "DELETE FROM updates WHERE bot_id = ? AND payload IS NULL AND update_id > ?", (bot_id, update_id)
+                )
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    async def open(self):
+        await self._connect()
+
+    async def load(self, bot_id):
+        """Restore a bot's dedup state; returns the updates it had not finished, as dicts, oldest first"""
+        done, journal, checkpoint = await self._db(self._load, bot_id)
+        floor = done[0] - 1 if len(done) >= self.dedup_size else -1
+        self._bots[bot_id] = _BotState(
+            RecentIds(self.dedup_size, done, floor), {update_id for update_id, _ in journal}, checkpoint
+        )
+        if journal:
+            logger.info(f"Bot {bot_id} has {len(journal)} unfinished updates to handle again "
+                        f"(checkpoint {checkpoint})")
+        return [json.loads(payload) for _, payload in journal]
+
+    def _state(self, bot_id):
+        state = self._bots.get(bot_id)
+        if state is None:
+            state = self._bots[bot_id] = _BotState(RecentIds(self.dedup_size), set(), 0)
+        return state
+
+    def checkpoint(self, bot_id):
+        """Highest update id the bot has finished"""
+        return self._state(bot_id).checkpoint
+
+    async def received(self, bot_id, update):
+        """Journal an update; returns False, without journaling it, if it was already received"""
+        state = self._state(bot_id)
+        update_id = update.update_id
+        if update_id in state.recent or update_id in state.in_progress:
+            self.duplicates += 1
+            return False
+        state.in_progress.add(update_id)
+        await self._db(self._journal, bot_id, update_id, update.to_json())
+        return True
+
+    async def done(self, bot_id, update_id):
+        """Mark an update as handled"""
+        state = self._state(bot_id)
+        state.in_progress.discard(update_id)
+        state.recent.add(update_id)
+        restarted = update_id <= state.checkpoint - self.dedup_size
+        if restarted:
+            logger.info(f"Bot {bot_id} update ids restarted at {update_id}, below checkpoint {state.checkpoint}")
+            state.checkpoint = update_id
+        else:
+            state.checkpoint = max(state.checkpoint, update_id)
+        state.since_prune += 1
+        prune = None
+        # The floor is above the checkpoint while ids of the old numbering are still leaving the ring
+        if (state.since_prune >= max(1, self.dedup_size // 4)
+                and 0 <= state.recent.floor <= state.checkpoint):
+            state.since_prune = 0
+            prune = state.recent.floor
+        await self._db(self._done, bot_id, update_id, state.checkpoint, prune, restarted)
+
+    async def close(self):
+        await self._disconnect()
+
+
+class CheckpointedUpdateQueue(asyncio.Queue):
+    """Application update queue that journals each update before queuing it and drops redeliveries"""
+
+    def __init__(self, checkpoint, bot_id):
+        super().__init__()
+        self.checkpoint = checkpoint
+        self.bot_id = bot_id
+
+    async def put(self, item):
+        if isinstance(item, Update) and not await self.checkpoint.received(self.bot_id, item):
+            logger.info(f"Dropping update {item.update_id} for bot {self.bot_id}: already received")
+            return
+        await super().put(item)
+
+
+class CheckpointUpdateProcessor(BaseUpdateProcessor):
+    """Mark every update done in the UpdateCheckpoint once another update processor has handled it
+
+    Updates the inner processor discards unstarted, such as those shed by
+    admission control, count as done as well. Updates whose handler buffered
+    them, see defer_done(), are done once the buffer has been flushed.
+    """
+
+    __slots__ = ('inner', 'checkpoint', 'bot_id', '_waiting')
+
+    def __init__(self, inner, checkpoint, bot_id):
+        super().__init__(inner.max_concurrent_updates)
+        self.inner = inner
+        self.checkpoint = checkpoint
+        self.bot_id = bot_id
+        self._waiting = set()
+
+    async def _run_tracked(self, update_id, coroutine, started):
+        started.append(True)
+        deferred = []
+        token = _deferred.set(deferred)
+        try:
+            await coroutine
+        finally:
+            _deferred.reset(token)
+            if deferred:
+                # The handler's slot is free again while the buffer waits
+                task = asyncio.create_task(self._done_after(update_id, deferred))
+                self._waiting.add(task)
+                task.add_done_callback(self._waiting.discard)
+            else:
+                await self.checkpoint.done(self.bot_id, update_id)
+
+    async def _done_after(self, update_id, deferred):
+        results = await asyncio.gather(*deferred, return_exceptions=True)
+        if any(isinstance(result, asyncio.CancelledError) for result in results):
+            logger.warning(f"Update {update_id} of bot {self.bot_id} was not flushed; it stays in the journal")
+            return
+        await self.checkpoint.done(self.bot_id, update_id)
+
+    async def process_update(self, update, coroutine):
+        if not isinstance(update, Update):
+            await self.inner.process_update(update, coroutine)
+            return
+        started = []
+        tracked = self._run_tracked(update.update_id, coroutine, started)
+        try:
+            await self.inner.process_update(update, tracked)
+        finally:
+            if not started and inspect.getcoroutinestate(tracked) == inspect.CORO_CLOSED:
+                coroutine.close()
+                await self.checkpoint.done(self.bot_id, update.update_id)
+
+    async def do_process_update(self, update, coroutine):
+        await self.inner.do_process_update(update, coroutine)
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        # Buffers are flushed before the application shuts down; their updates are marked done here
+        if self._waiting:
+            await asyncio.gather(*self._waiting, return_exceptions=True)
+        await self.inner.shutdown()
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedCoalescer:
+    """Buffer items under a key and hand each key's items over together
+
+    Used for the items of an album and for a user's burst of messages. A
+    key is flushed once `window` seconds pass without a new item, or as soon
+    as it holds `max_items`. Flushing runs in a background task, so the
+    handler that added an item returns at once and does not hold up its chat
+    while later items under the same key are still arriving.
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._pending = {}
+        self._timers = {}
+        self._callbacks = {}
+        self._flushed = {}
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, key, item, window, on_flush):
+        """Add item under key; on_flush(items) is awaited once the key is flushed
+
+        Returns a future that resolves once on_flush has returned or failed, or
+        is cancelled if the flush was.
+        """
+        items = self._pending.setdefault(key, [])
+        items.append(item)
+        self._callbacks.setdefault(key, on_flush)
+        flushed = self._flushed.get(key)
+        if flushed is None:
+            flushed = self._flushed[key] = asyncio.get_running_loop().create_future()
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        if len(items) >= self.max_items:
+            self._flush(key)
+        else:
+            self._timers[key] = asyncio.get_running_loop().call_later(window, self._flush, key)
+        return flushed
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        items = self._pending.pop(key, None)
+        on_flush = self._callbacks.pop(key, None)
+        flushed = self._flushed.pop(key, None)
+        if items:
+            task = asyncio.create_task(self._deliver(key, items, on_flush, flushed))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _deliver(key, items, on_flush, flushed):
+        try:
+            await on_flush(items)
+        except Exception as e:
+            logger.error(f"Failed to handle the items buffered under {key}: {e}")
+        except asyncio.CancelledError:
+            flushed.cancel()
+            raise
+        flushed.set_result(None)
+
+    async def aclose(self):
+        """Hand over every key still waiting for its window"""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,7 @@
+import os
+
+# bot.py reads its bots from the environment on import; tests mock every call to Telegram and n8n
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'test')
+os.environ.setdefault('N8N_WEBHOOK_URL', 'http://localhost:5678/webhook/test')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN_TVO', 'test')
+os.environ.setdefault('N8N_WEBHOOK_URL_TVO', 'http://localhost:5678/webhook/test')
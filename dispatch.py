@@ -0,0 +1,73 @@
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently, strictly in order within a chat
+
+    Only one update per chat runs at a time. Updates arriving for a chat that is
+    already busy are queued behind it and run by the same task, so a flooded chat
+    holds a single concurrency slot instead of all of them.
+    """
+
+    __slots__ = ("_pending",)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._pending = {}
+
+    @staticmethod
+    def ordering_key(update):
+        """Return the key updates are serialised on, or None for unordered updates"""
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return ("chat", update.effective_chat.id)
+            if update.effective_user:
+                return ("user", update.effective_user.id)
+        return None
+
+    @property
+    def busy_chats(self):
+        """Number of chats with an update currently being processed"""
+        return len(self._pending)
+
+    @property
+    def queued_updates(self):
+        """Number of updates waiting behind the one running for their chat"""
+        return sum(len(pending) - 1 for pending in self._pending.values())
+
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            # The running task for this chat picks it up next; free our slot now
+            pending.append(coroutine)
+            return
+
+        pending = self._pending[key] = deque([coroutine])
+        try:
+            while pending:
+                try:
+                    await pending[0]
+                except Exception as e:
+                    logger.error(f"Update processing failed for {key}: {e}")
+                pending.popleft()
+        finally:
+            for leftover in pending:
+                leftover.close()
+            del self._pending[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,242 @@
+import json
+from json.encoder import encode_basestring
+
+try:
+    import orjson
+except ImportError:  # optional faster JSON backend
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, Event):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=_default)
+
+# One-entry cache: updates arriving in a burst mostly share the same second
+_last_date = None
+_last_timestamp = None
+
+
+def isoformat(date):
+    """date.isoformat(), reusing the previous result for the same date"""
+    global _last_date, _last_timestamp
+    if date != _last_date:
+        _last_timestamp = date.isoformat()
+        _last_date = date
+    return _last_timestamp
+
+
+class Event:
+    """Base class for the payloads forwarded to n8n
+
+    Subclasses list their wire fields, in wire order, in FIELDS. Events
+    support read-only mapping access (event['chat_id'], event.get('type'))
+    so the outbox, batcher and resilience layers treat them like the dicts
+    they replace.
+    """
+
+    __slots__ = ('user_id', 'username', 'first_name', 'last_name', 'timestamp')
+
+    type = None
+    FIELDS = ()
+
+    def _set_user(self, user, date):
+        self.user_id = user.id
+        self.username = user.username
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.timestamp = isoformat(date)
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    def encode(self):
+        """Wire JSON as UTF-8 bytes, written straight from the slots"""
+        prefixes = _PREFIXES[self.__class__]
+        parts = []
+        for prefix, field in zip(prefixes, self.FIELDS):
+            value = getattr(self, field)
+            parts.append(prefix)
+            if value is None:
+                parts.append('null')
+            elif value.__class__ is str:
+                parts.append(encode_basestring(value))
+            elif value.__class__ is int:
+                parts.append(str(value))
+            else:
+                parts.append(_encoder.encode(value))
+        parts.append('}')
+        return ''.join(parts).encode()
+
+
+class CommandEvent(Event):
+    __slots__ = ('command',)
+
+    type = 'command'
+    FIELDS = ('type', 'command', 'user_id', 'username', 'first_name', 'last_name', 'timestamp')
+
+    @classmethod
+    def from_update(cls, update, command):
+        event = cls()
+        event.command = command
+        event._set_user(update.effective_user, update.message.date)
+        return event
+
+
+class MessageEvent(Event):
+    __slots__ = ('message_id', 'text', 'chat_id')
+
+    type = 'message'
+    FIELDS = ('type', 'message_id', 'text', 'user_id', 'username', 'first_name', 'last_name',
+              'chat_id', 'timestamp')
+
+    @classmethod
+    def from_update(cls, update):
+        message = update.message
+        event = cls()
+        event.message_id = message.message_id
+        event.text = message.text
+        event.chat_id = message.chat_id
+        event._set_user(update.effective_user, message.date)
+        return event
+
+
+class MergedMessageEvent(MessageEvent):
+    """Consecutive text messages from one user, debounced into one event
+
+    `text` joins the texts with newlines and `message_ids` lists the
+    originals in order; message_id, the sender and the timestamp are those
+    of the last message, the one the bot replies to.
+    """
+
+    __slots__ = ('message_ids',)
+
+    FIELDS = ('type', 'message_id', 'message_ids', 'text', 'user_id', 'username', 'first_name', 'last_name',
+              'chat_id', 'timestamp')
+
+    @classmethod
+    def from_events(cls, events):
+        last = events[-1]
+        event = cls()
+        event.message_id = last.message_id
+        event.message_ids = [e.message_id for e in events]
+        event.text = '\n'.join(e.text for e in events if e.text)
+        event.chat_id = last.chat_id
+        event.user_id = last.user_id
+        event.username = last.username
+        event.first_name = last.first_name
+        event.last_name = last.last_name
+        event.timestamp = last.timestamp
+        return event
+
+
+class PhotoEvent(Event):
+    __slots__ = ('message_id', 'photo_file_id', 'caption', 'chat_id')
+
+    type = 'photo'
+    FIELDS = ('type', 'message_id', 'photo_file_id', 'caption', 'user_id', 'username', 'first_name',
+              'last_name', 'chat_id', 'timestamp')
+
+    @classmethod
+    def from_update(cls, update):
+        message = update.message
+        event = cls()
+        event.message_id = message.message_id
+        event.photo_file_id = message.photo[-1].file_id  # Highest resolution
+        event.caption = message.caption
+        event.chat_id = message.chat_id
+        event._set_user(update.effective_user, message.date)
+        return event
+
+
+class DocumentEvent(Event):
+    __slots__ = ('message_id', 'document_file_id', 'document_name', 'document_mime_type', 'caption', 'chat_id')
+
+    type = 'document'
+    FIELDS = ('type', 'message_id', 'document_file_id', 'document_name', 'document_mime_type', 'caption',
+              'user_id', 'username', 'first_name', 'last_name', 'chat_id', 'timestamp')
+
+    @classmethod
+    def from_update(cls, update):
+        message = update.message
+        document = message.document
+        event = cls()
+        event.message_id = message.message_id
+        event.document_file_id = document.file_id
+        event.document_name = document.file_name
+        event.document_mime_type = document.mime_type
+        event.caption = message.caption
+        event.chat_id = message.chat_id
+        event._set_user(update.effective_user, message.date)
+        return event
+
+
+class AlbumEvent(Event):
+    """Photos and documents sent together as one media group
+
+    `items` holds each member's own fields (type, message_id, file id,
+    caption, ...) in the order Telegram delivered them; the sender, chat and
+    timestamp are those of the first item, whose message_id is also the
+    album's.
+    """
+
+    __slots__ = ('media_group_id', 'message_id', 'caption', 'items', 'chat_id')
+
+    type = 'album'
+    FIELDS = ('type', 'media_group_id', 'message_id', 'caption', 'items', 'user_id', 'username', 'first_name',
+              'last_name', 'chat_id', 'timestamp')
+    SHARED_FIELDS = frozenset(('user_id', 'username', 'first_name', 'last_name', 'chat_id', 'timestamp'))
+
+    @classmethod
+    def from_events(cls, media_group_id, events):
+        first = events[0]
+        event = cls()
+        event.media_group_id = media_group_id
+        event.message_id = first.message_id
+        event.caption = next((e.caption for e in events if e.caption), None)
+        event.items = [
+            {field: getattr(e, field) for field in e.FIELDS if field not in cls.SHARED_FIELDS} for e in events
+        ]
+        event.chat_id = first.chat_id
+        event.user_id = first.user_id
+        event.username = first.username
+        event.first_name = first.first_name
+        event.last_name = first.last_name
+        event.timestamp = first.timestamp
+        return event
+
+
+# '{"type":' / ',"message_id":' ... per event class, encoded once
+_PREFIXES = {
+    cls: tuple(('{' if i == 0 else ',') + encode_basestring(field) + ':' for i, field in enumerate(cls.FIELDS))
+    for cls in (CommandEvent, MessageEvent, MergedMessageEvent, PhotoEvent, DocumentEvent, AlbumEvent)
+}
+
+
+def encode(data):
+    """Serialise an event, dict or list of them to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    if isinstance(data, Event):
+        return data.encode()
+    return _encoder.encode(data).encode()
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+from telegram.request import HTTPXRequest
+
+import metrics
+from http_server import Response
+
+logger = logging.getLogger(__name__)
+
+# Address of the /healthz and /readyz endpoints; a port of 0 disables them
+HEALTH_LISTEN = os.getenv('HEALTH_LISTEN', '127.0.0.1')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '0'))
+# Seconds between event loop checks, and the lag at which the blocking code's stack is logged; 0 disables the watchdog
+LOOP_CHECK_INTERVAL = float(os.getenv('LOOP_CHECK_INTERVAL', '0.1'))
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.5'))
+# Lag in seconds at which /healthz fails
+LOOP_LAG_UNHEALTHY = float(os.getenv('LOOP_LAG_UNHEALTHY', '5'))
+# Seconds without a getUpdates answer after which a polling bot is not ready
+HEALTH_MAX_POLL_AGE = float(os.getenv('HEALTH_MAX_POLL_AGE', '60'))
+
+JSON_CONTENT_TYPE = 'application/json'
+
+
+class LoopWatchdog:
+    """Measure event loop lag and log the code that blocks the loop
+
+    A task sleeps for interval and records how much later than that it
+    wakes up: the loop's lag. A thread watches the task's heartbeat; once
+    it is threshold seconds overdue, the loop is stuck in synchronous code,
+    and the thread logs the stack of the loop's thread while it still is.
+    Each stall is logged once.
+    """
+
+    def __init__(self, threshold=LOOP_LAG_THRESHOLD, interval=LOOP_CHECK_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def current_lag(self):
+        """The last measured lag, or how long the loop has been blocked if that is longer"""
+        return max(self.lag, time.monotonic() - self._heartbeat - self.interval)
+
+    def start(self):
+        if self.threshold <= 0 or self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._stop.set()
+        await asyncio.to_thread(self._thread.join)
+
+    async def _tick(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - started - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            self._heartbeat = now
+            metrics.EVENT_LOOP_LAG.set(self.lag)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            self.stalls += 1
+            metrics.EVENT_LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else '  (stack unavailable)\n'
+            logger.warning(f"Event loop blocked for {blocked * 1000:.0f} ms so far, in:\n{stack.rstrip()}")
+
+
+class PollingRequest(HTTPXRequest):
+    """Request used for getUpdates that remembers when Telegram last answered it"""
+
+    __slots__ = ('last_answer',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_answer = None
+
+    async def do_request(self, *args, **kwargs):
+        code, payload = await super().do_request(*args, **kwargs)
+        if 200 <= code < 300:
+            self.last_answer = time.monotonic()
+        return code, payload
+
+
+class _BotHealth:
+    __slots__ = ('application', 'webhook_urls', 'polling')
+
+    def __init__(self, application, webhook_urls, polling):
+        self.application = application
+        self.webhook_urls = webhook_urls
+        self.polling = polling
+
+
+class HealthChecks:
+    """The /healthz and /readyz endpoints
+
+    /healthz fails when the event loop lags by more than max_lag. /readyz
+    also fails until a bot is registered, and while any registered bot is
+    stopped, is polling but has had no getUpdates answer for max_poll_age
+    seconds, or sends to an n8n webhook whose circuit is open.
+    """
+
+    def __init__(self, watchdog, n8n_client, max_lag=LOOP_LAG_UNHEALTHY, max_poll_age=HEALTH_MAX_POLL_AGE):
+        self.watchdog = watchdog
+        self.n8n_client = n8n_client
+        self.max_lag = max_lag
+        self.max_poll_age = max_poll_age
+        self._bots = {}
+
+    def add_bot(self, name, application, webhook_urls, polling=None):
+        """Check a started bot; polling is its PollingRequest when it polls for updates"""
+        self._bots[name] = _BotHealth(application, tuple(webhook_urls), polling)
+
+    def remove_bot(self, name):
+        self._bots.pop(name, None)
+
+    def liveness(self):
+        """(healthy, details) for the process itself"""
+        lag = self.watchdog.current_lag if self.watchdog.running else 0.0
+        details = {'loop_lag_ms': round(lag * 1000, 1), 'loop_max_lag_ms': round(self.watchdog.max_lag * 1000, 1),
+                   'loop_stalls': self.watchdog.stalls}
+        if lag > self.max_lag:
+            details['error'] = "event loop is blocked"
+        return 'error' not in details, details
+
+    def _bot_problems(self, bot):
+        problems = []
+        if not bot.application.running:
+            problems.append("not running")
+        if bot.polling is not None:
+            if bot.polling.last_answer is None:
+                problems.append("no getUpdates answer yet")
+            elif time.monotonic() - bot.polling.last_answer > self.max_poll_age:
+                problems.append(f"no getUpdates answer for {time.monotonic() - bot.polling.last_answer:.0f}s")
+        for url in bot.webhook_urls:
+            if not self.n8n_client.reachable(url):
+                problems.append(f"n8n circuit open for {url}")
+        return problems
+
+    def readiness(self):
+        """(ready, details) for the process and every registered bot"""
+        ready, details = self.liveness()
+        bots = {name: self._bot_problems(bot) for name, bot in self._bots.items()}
+        details['bots'] = {name: problems or 'ok' for name, problems in bots.items()}
+        if not bots:
+            details.setdefault('error', "no bot is running")
+        return ready and bool(bots) and not any(bots.values()), details
+
+    @staticmethod
+    def _response(ok, details):
+        details = {'status': 'ok' if ok else 'unavailable', **details}
+        return Response(200 if ok else 503, json.dumps(details), content_type=JSON_CONTENT_TYPE)
+
+    async def handle_healthz(self, request):
+        """HttpServer route handler for GET /healthz"""
+        return self._response(*self.liveness())
+
+    async def handle_readyz(self, request):
+        """HttpServer route handler for GET /readyz"""
+        return self._response(*self.readiness())
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class Request:
+    """An HTTP request received by HttpServer"""
+
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    """An HTTP response returned by a route handler"""
+
+    __slots__ = ('status', 'body', 'content_type', 'headers')
+
+    def __init__(self, status=200, body=b'', content_type='text/plain; charset=utf-8', headers=None):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+class HttpError(Exception):
+    """Raised while reading a request that cannot be served"""
+
+    def __init__(self, status):
+        super().__init__(HTTPStatus(status).phrase)
+        self.status = status
+
+
+class HttpServer:
+    """Minimal asyncio HTTP/1.1 server for the bot's local endpoints
+
+    Routes are exact (method, path) matches registered with add_route; a
+    handler is an async callable taking a Request and returning a Response.
+    Connections are kept alive unless the client asks otherwise.
+    """
+
+    def __init__(self, host, port, max_body_size=MAX_BODY_SIZE):
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self._routes = {}
+        self._server = None
+
+    def add_route(self, method, path, handler):
+        """Serve handler for method requests to path"""
+        self._routes[(method.upper(), path)] = handler
+
+    def remove_route(self, method, path):
+        self._routes.pop((method.upper(), path), None)
+
+    @property
+    def bound_port(self):
+        """The port actually listened on, useful when port 0 was requested"""
+        return self._server.sockets[0].getsockname()[1] if self._server else None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.bound_port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_body(self, reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            size = 0
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                length = int(line.split(b';', 1)[0], 16)
+                if length == 0:
+                    await reader.readuntil(b'\r\n')
+                    return b''.join(chunks)
+                size += length
+                if size > self.max_body_size:
+                    raise HttpError(413)
+                chunks.append(await reader.readexactly(length))
+                await reader.readexactly(2)
+        length = int(headers.get('content-length', '0'))
+        if length > self.max_body_size:
+            raise HttpError(413)
+        return await reader.readexactly(length) if length else b''
+
+    async def _read_request(self, reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HttpError(400)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        body = await self._read_body(reader, headers)
+        url = urlsplit(target)
+        request = Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        return request, keep_alive
+
+    async def _dispatch(self, request):
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return Response(405, 'Method Not Allowed')
+            return Response(404, 'Not Found')
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return Response(500, 'Internal Server Error')
+
+    def _write_response(self, writer, response, keep_alive):
+        headers = {
+            'Content-Type': response.content_type,
+            'Content-Length': str(len(response.body)),
+            'Connection': 'keep-alive' if keep_alive else 'close',
+        }
+        headers.update(response.headers)
+        head = f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}\r\n"
+        head += ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode('latin-1') + b'\r\n' + response.body)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request, keep_alive = await self._read_request(reader)
+                except HttpError as e:
+                    self._write_response(writer, Response(e.status, str(e)), False)
+                    break
+                except ValueError:
+                    self._write_response(writer, Response(400, 'Bad Request'), False)
+                    break
+                response = await self._dispatch(request)
+                self._write_response(writer, response, keep_alive)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,136 @@
+import os
+import json
+import uuid
+from fnmatch import fnmatch
+
+import httpx
+
+# Relay photo/document bytes to n8n instead of only their file ids; bots can override with "media_relay"
+MEDIA_RELAY = os.getenv('MEDIA_RELAY', '0').lower() in ('1', 'true', 'yes')
+# The Bot API serves downloads up to 20 MB
+MEDIA_RELAY_MAX_BYTES = int(os.getenv('MEDIA_RELAY_MAX_BYTES', str(20 * 1024 * 1024)))
+MEDIA_RELAY_MIME_TYPES = tuple(
+    t.strip() for t in os.getenv('MEDIA_RELAY_MIME_TYPES', 'image/*,application/pdf').split(',') if t.strip()
+)
+MEDIA_RELAY_CHUNK_SIZE = 64 * 1024
+
+
+class MediaRelayError(Exception):
+    """The file cannot be relayed; the event should be sent without it"""
+
+
+class RelayPolicy:
+    """Which files a bot relays: a size cap and a MIME allow-list of fnmatch patterns"""
+
+    __slots__ = ('max_bytes', 'mime_types')
+
+    def __init__(self, max_bytes=MEDIA_RELAY_MAX_BYTES, mime_types=MEDIA_RELAY_MIME_TYPES):
+        self.max_bytes = max_bytes
+        self.mime_types = tuple(mime_types)
+
+    @classmethod
+    def from_option(cls, option=None):
+        """Build the policy for a bot's "media_relay" option: true, false or {"max_bytes", "mime_types"}"""
+        if option is None:
+            option = MEDIA_RELAY
+        if option is True:
+            return cls()
+        if not option:
+            return None
+        return cls(option.get('max_bytes', MEDIA_RELAY_MAX_BYTES), option.get('mime_types', MEDIA_RELAY_MIME_TYPES))
+
+    def allows(self, size, mime_type):
+        if size is not None and size > self.max_bytes:
+            return False
+        return any(fnmatch(mime_type or '', pattern) for pattern in self.mime_types)
+
+
+def _quote(value):
+    return str(value).replace('\\', '\\\\').replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+
+class MediaRelay:
+    """Stream a Telegram file into a multipart/form-data POST to n8n, chunk by chunk
+
+    Every event field becomes a form field of the same name and the file is
+    the "file" part, so a workflow reads the same fields as before plus the
+    binary. Only one chunk of the file is held in memory at a time; the
+    download is read as fast as n8n accepts the upload. The file URL contains
+    the bot token and never leaves this process.
+    """
+
+    def __init__(self, n8n_client, chunk_size=MEDIA_RELAY_CHUNK_SIZE, timeout=30.0):
+        self.n8n_client = n8n_client
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._client = None
+
+    def _download_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    def _form_head(self, boundary, event, filename, mime_type):
+        parts = []
+        for field in event.keys():
+            value = event.get(field)
+            if value is None:
+                continue
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value)
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"\r\n\r\n{value}\r\n')
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{_quote(filename)}"\r\n'
+                     f'Content-Type: {mime_type}\r\n\r\n')
+        return ''.join(parts).encode()
+
+    async def _body(self, boundary, head, download, max_bytes):
+        yield head
+        size = 0
+        try:
+            async for chunk in download.aiter_bytes(self.chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise MediaRelayError(f"File grew past the {max_bytes} byte cap while streaming")
+                yield chunk
+        except httpx.HTTPError as e:
+            # Not n8n's fault: keep it away from the circuit breaker
+            raise MediaRelayError(f"File download failed: {e.__class__.__name__}") from None
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    async def relay(self, bot, webhook_url, event, file_id, filename, mime_type, max_bytes):
+        """Send the event with the file to n8n and return the n8n response
+
+        Raises MediaRelayError if the file cannot be fetched or is too large,
+        and httpx.HTTPError if n8n fails.
+        """
+        try:
+            telegram_file = await bot.get_file(file_id)
+        except Exception as e:
+            raise MediaRelayError(f"getFile failed: {e}") from e
+        if telegram_file.file_size and telegram_file.file_size > max_bytes:
+            raise MediaRelayError(f"File is {telegram_file.file_size} bytes, over the {max_bytes} byte cap")
+        if not (telegram_file.file_path or '').startswith(('http://', 'https://')):
+            raise MediaRelayError("File is not downloadable over HTTP")
+
+        # Error messages name the status or exception class only: the URL contains the token
+        client = self._download_client()
+        try:
+            download = await client.send(client.build_request('GET', telegram_file.file_path), stream=True)
+        except httpx.HTTPError as e:
+            raise MediaRelayError(f"File download failed: {e.__class__.__name__}") from None
+        try:
+            if download.status_code != 200:
+                raise MediaRelayError(f"File download failed with {download.status_code}")
+            boundary = uuid.uuid4().hex
+            head = self._form_head(boundary, event, filename, mime_type)
+            return await self.n8n_client.upload(
+                webhook_url, self._body(boundary, head, download, max_bytes),
+                f'multipart/form-data; boundary={boundary}'
+            )
+        finally:
+            await download.aclose()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,245 @@
+import os
+import time
+import bisect
+import functools
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from http_server import Response
+
+logger = logging.getLogger(__name__)
+
+# Address of the Prometheus /metrics endpoint; a port of 0 disables it
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (bot, handler) of the update being handled, for metrics recorded deeper in the call stack
+current_labels = contextvars.ContextVar('metrics_labels', default=('', ''))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """Base class for a metric family with a fixed set of label names"""
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """Forget the series with these label values"""
+        self._values.pop(self._key(labels), None)
+
+    def samples(self):
+        """Yield (suffix, label pairs, value) for every series"""
+        for key, value in self._values.items():
+            yield '', list(zip(self.labelnames, key)), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, pairs, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from a callback at scrape time"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """Report function() as this series' value whenever metrics are scraped"""
+        self._functions[self._key(labels)] = function
+
+    def remove(self, **labels):
+        key = self._key(labels)
+        self._values.pop(key, None)
+        self._functions.pop(key, None)
+
+    def samples(self):
+        yield from super().samples()
+        for key, function in self._functions.items():
+            try:
+                value = function()
+            except Exception as e:
+                # One broken callback must not take the whole scrape down
+                logger.error(f"Failed to read {self.name}{key}: {e}")
+                continue
+            yield '', list(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # Per-bucket (non-cumulative) counts, the +Inf count last, then the sum
+            series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, series in self._values.items():
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                yield '_bucket', pairs + [('le', _format_value(bound))], cumulative
+            yield '_sum', pairs, series[-1]
+            yield '_count', pairs, cumulative
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def handle(self, request):
+        """HttpServer route handler for GET /metrics"""
+        return Response(200, self.render(), content_type=CONTENT_TYPE)
+
+
+registry = MetricsRegistry()
+
+UPDATES = registry.counter(
+    'telegram_updates_total', 'Updates handled, by bot and handler type', ('bot', 'handler'))
+UPDATE_ERRORS = registry.counter(
+    'telegram_update_errors_total', 'Updates whose handler raised an exception', ('bot', 'handler'))
+HANDLER_LATENCY = registry.histogram(
+    'telegram_handler_duration_seconds', 'End-to-end handler latency', ('bot', 'handler'))
+N8N_LATENCY = registry.histogram(
+    'n8n_request_duration_seconds', 'Round-trip time of n8n webhook calls made by handlers', ('bot', 'handler'))
+TELEGRAM_LATENCY = registry.histogram(
+    'telegram_send_duration_seconds', 'Latency of replies and reactions sent to Telegram', ('bot', 'kind'))
+UPDATES_SHED = registry.counter(
+    'telegram_updates_shed_total', 'Updates refused by admission control, by reason', ('bot', 'reason'))
+UPDATES_DELAYED = registry.counter(
+    'telegram_updates_delayed_total', 'Updates held back by admission control before being handled', ('bot',))
+IN_FLIGHT = registry.gauge(
+    'telegram_updates_in_flight', 'Updates currently being handled', ('bot',))
+PENDING_UPDATES = registry.gauge(
+    'telegram_updates_pending', 'Updates received but not yet handled', ('bot',))
+OUTBOUND_PENDING = registry.gauge(
+    'telegram_outbound_pending', 'Replies and reactions waiting for the outbound rate limiter', ('bot',))
+N8N_CIRCUIT_STATE = registry.gauge(
+    'n8n_circuit_state', 'Circuit breaker state per webhook: 0 closed, 1 half open, 2 open', ('webhook',))
+N8N_CIRCUIT_REJECTED = registry.counter(
+    'n8n_circuit_rejected_total', 'Requests shed because the webhook\'s circuit was open', ('webhook',))
+REPLY_CACHE_STATS = registry.gauge(
+    'n8n_reply_cache', 'Reply cache hits, misses and evictions since start, and its entries and bytes', ('stat',))
+OUTBOX_DEPTH = registry.gauge(
+    'n8n_outbox_depth', 'Events waiting in the outbox for n8n')
+CHAT_CONTEXT_BYTES = registry.gauge(
+    'chat_context_bytes', 'Estimated memory held by the chat context windows')
+EVENT_LOOP_LAG = registry.gauge(
+    'event_loop_lag_seconds', 'How late the event loop last ran a timer')
+EVENT_LOOP_STALLS = registry.counter(
+    'event_loop_stalls_total', 'Times the event loop was blocked for longer than LOOP_LAG_THRESHOLD')
+
+
+def instrument(callback, bot_name, handler_type):
+    """Wrap a handler callback so every update it handles is counted and timed"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = current_labels.set((bot_name, handler_type))
+        IN_FLIGHT.inc(bot=bot_name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            UPDATE_ERRORS.inc(bot=bot_name, handler=handler_type)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, bot=bot_name, handler=handler_type)
+            UPDATES.inc(bot=bot_name, handler=handler_type)
+            IN_FLIGHT.dec(bot=bot_name)
+            current_labels.reset(token)
+
+    return wrapper
@@ -0,0 +1,173 @@
+import os
+import json
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+from events import encode
+from tracing import trace_headers
+
+logger = logging.getLogger(__name__)
+
+N8N_TIMEOUT = float(os.getenv('N8N_TIMEOUT', '10'))
+N8N_CONNECT_TIMEOUT = float(os.getenv('N8N_CONNECT_TIMEOUT', '5'))
+N8N_POOL_SIZE = int(os.getenv('N8N_POOL_SIZE', '20'))
+N8N_KEEPALIVE_EXPIRY = float(os.getenv('N8N_KEEPALIVE_EXPIRY', '30'))
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Streamed replies: NDJSON as n8n's streaming response mode sends it, chunked plain text, or a whole JSON body
+STREAM_HEADERS = {**JSON_HEADERS, 'Accept': 'application/x-ndjson, text/plain;q=0.9, application/json;q=0.8'}
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+
+# Client errors that will never succeed on retry; everything else is retried
+RETRYABLE_STATUS = {408, 425, 429}
+
+
+def is_retryable(error):
+    """Return True if a failed n8n call may succeed when retried later"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status in RETRYABLE_STATUS
+    return True
+
+
+def _ndjson_text(text, line):
+    """The reply text after one NDJSON line; lines without text leave it unchanged"""
+    line = line.strip()
+    if not line:
+        return text
+    try:
+        item = json.loads(line)
+    except ValueError:
+        logger.warning(f"Skipping unreadable NDJSON line from n8n: {line[:80]!r}")
+        return text
+    if not isinstance(item, dict):
+        return text
+    if isinstance(item.get('reply'), str):
+        return item['reply']
+    fragment = item.get('content') if item.get('type', 'item') == 'item' else None
+    if fragment is None:
+        fragment = item.get('delta')
+    if isinstance(fragment, str) and fragment:
+        return (text or '') + fragment
+    return text
+
+
+def _traced(headers):
+    """headers plus the trace context of the update being handled, if it is traced"""
+    trace = trace_headers()
+    if trace is None:
+        return headers
+    return {**trace, **headers} if headers else trace
+
+
+class N8nClient:
+    """Async n8n forwarder with one keep-alive connection pool per webhook host"""
+
+    def __init__(self, pool_size=N8N_POOL_SIZE, timeout=N8N_TIMEOUT,
+                 connect_timeout=N8N_CONNECT_TIMEOUT, keepalive_expiry=N8N_KEEPALIVE_EXPIRY):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self._clients = {}
+
+    def _client_for(self, webhook_url):
+        """Return the pooled client for the webhook's scheme and host"""
+        parts = urlsplit(webhook_url)
+        key = (parts.scheme, parts.netloc)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            )
+            self._clients[key] = client
+        return client
+
+    async def request(self, webhook_url, data, headers=None, timeout=None):
+        """Send data to n8n webhook, raising httpx.HTTPError on failure"""
+        headers = _traced(headers)
+        kwargs = {'content': encode(data), 'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS}
+        if timeout is not None:
+            kwargs['timeout'] = httpx.Timeout(timeout, connect=min(timeout, self.connect_timeout))
+        response = await self._client_for(webhook_url).post(webhook_url, **kwargs)
+        return self._reply(response)
+
+    async def upload(self, webhook_url, body, content_type, headers=None):
+        """Stream body, an async iterable of bytes, to n8n; raises httpx.HTTPError on failure"""
+        headers = {**(_traced(headers) or {}), 'Content-Type': content_type}
+        response = await self._client_for(webhook_url).post(webhook_url, content=body, headers=headers)
+        return self._reply(response)
+
+    async def stream(self, webhook_url, data, on_text, headers=None):
+        """Send data to n8n and await on_text(text) each time the streamed reply grows
+
+        text is the whole reply so far. NDJSON lines may carry a fragment as
+        {"type": "item", "content": ...} (n8n's streaming format) or
+        {"delta": ...}, or the full text as {"reply": ...}; text/plain is
+        read chunk by chunk; any other body is read whole like request()
+        does. Returns the final text, or None if n8n sent no reply; raises
+        httpx.HTTPError on failure.
+        """
+        headers = _traced(headers)
+        headers = {**STREAM_HEADERS, **headers} if headers else STREAM_HEADERS
+        client = self._client_for(webhook_url)
+        async with client.stream('POST', webhook_url, content=encode(data), headers=headers) as response:
+            content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+            if response.is_success and content_type in NDJSON_TYPES:
+                text = None
+                async for line in response.aiter_lines():
+                    grown = _ndjson_text(text, line)
+                    if grown != text:
+                        text = grown
+                        await on_text(text)
+            elif response.is_success and content_type == 'text/plain':
+                text = ''
+                async for chunk in response.aiter_text():
+                    if chunk:
+                        text += chunk
+                        await on_text(text)
+                text = text or None
+            else:
+                await response.aread()
+                reply = self._reply(response)
+                text = reply['reply'] if isinstance(reply, dict) and reply.get('reply') else None
+                if text:
+                    await on_text(text)
+            logger.info(f"Streamed n8n reply finished: {response.status_code}")
+            return text
+
+    @staticmethod
+    def _reply(response):
+        """Parsed JSON body of a successful n8n response, or None"""
+        response.raise_for_status()
+        logger.info(f"Successfully sent data to n8n: {response.status_code}")
+        if not response.content:
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            # n8n accepted the event; an unreadable body just means there is no reply
+            logger.warning(f"Ignoring non-JSON n8n response: {e}")
+            return None
+
+    async def post(self, webhook_url, data, headers=None):
+        """Send data to n8n webhook"""
+        try:
+            return await self.request(webhook_url, data, headers)
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to send data to n8n: {e}")
+            return None
+
+    async def aclose(self):
+        """Close every pooled connection"""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
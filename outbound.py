@@ -0,0 +1,234 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque, OrderedDict
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Queue replies and reactions per bot within Telegram's flood limits; bots can override with "rate_limit"
+TELEGRAM_RATE_LIMIT = os.getenv('TELEGRAM_RATE_LIMIT', '1').lower() in ('1', 'true', 'yes')
+# Telegram's documented limits: about 30 messages a second per bot, one a second per chat, 20 a minute per group
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE_PER_MINUTE', '20')) / 60
+# How often one call is retried after a 429 before it is given up
+TELEGRAM_MAX_RETRIES = 3
+
+# Lanes, in the order they are served
+REPLY = 0
+REACTION = 1
+
+
+class TokenBucket:
+    """`rate` tokens a second, holding at most `capacity`"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('chat_id', 'lane', 'call', 'future', 'key', 'attempts')
+
+    def __init__(self, chat_id, lane, call, future, key):
+        self.chat_id = chat_id
+        self.lane = lane
+        self.call = call
+        self.future = future
+        self.key = key
+        self.attempts = 0
+
+
+def _retrieve(future):
+    # Failures are logged here; callers that never await the future should not get a warning too
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundScheduler:
+    """Send one bot's Telegram calls within the bot-wide and per-chat flood limits
+
+    Calls wait in priority lanes, so replies go out before reactions, and
+    chats are served round-robin within a lane. Calls to one chat keep their
+    order within a lane and never overlap. A supersedable call replaces the
+    unsent one queued before it for the same chat and lane; the replaced
+    call's future resolves to None. A 429 pauses the chat for the retry_after
+    Telegram asks for and the call goes out first once the pause is over.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 group_rate=TELEGRAM_GROUP_RATE, max_retries=TELEGRAM_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, max(1.0, global_rate), time.monotonic())
+        self._lanes = (OrderedDict(), OrderedDict())
+        self._buckets = {}
+        self._paused_until = {}
+        self._busy = set()
+        self._supersedable = {}
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.pending = 0
+        self.dropped = 0
+        self.retried = 0
+
+    def submit(self, chat_id, call, lane=REPLY, supersede=False):
+        """Queue call(), a coroutine function, for chat_id; returns a future with its result"""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve)
+        key = (lane, chat_id) if supersede else None
+        job = _Job(chat_id, lane, call, future, key)
+        if key is not None:
+            previous = self._supersedable.pop(key, None)
+            if previous is not None:
+                self._drop(previous)
+            self._supersedable[key] = job
+        self._lanes[lane].setdefault(chat_id, deque()).append(job)
+        self.pending += 1
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return future
+
+    def _drop(self, job):
+        jobs = self._lanes[job.lane].get(job.chat_id)
+        if jobs is None or job not in jobs:
+            return
+        jobs.remove(job)
+        if not jobs:
+            del self._lanes[job.lane][job.chat_id]
+        self.pending -= 1
+        self.dropped += 1
+        job.future.set_result(None)
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Group and channel ids are negative
+            rate = self.group_rate if chat_id is not None and chat_id < 0 else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, 1.0, now)
+        return bucket
+
+    def _next_job(self, now):
+        """The next job allowed to go out, or (None, seconds to wait; None for nothing queued)"""
+        wait = self._global.wait_time(now)
+        if wait > 0:
+            return None, wait
+        earliest = None
+        for lane in self._lanes:
+            for chat_id, jobs in lane.items():
+                if chat_id in self._busy:
+                    continue
+                wait = max(self._paused_until.get(chat_id, 0) - now, self._bucket(chat_id, now).wait_time(now))
+                if wait <= 0:
+                    job = jobs.popleft()
+                    if jobs:
+                        lane.move_to_end(chat_id)
+                    else:
+                        del lane[chat_id]
+                    return job, 0
+                earliest = wait if earliest is None else min(earliest, wait)
+        return None, earliest
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            job, wait = self._next_job(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._global.take(now)
+            self._bucket(job.chat_id, now).take(now)
+            self._paused_until.pop(job.chat_id, None)
+            if job.key is not None and self._supersedable.get(job.key) is job:
+                del self._supersedable[job.key]
+            self._busy.add(job.chat_id)
+            task = asyncio.create_task(self._send(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            if len(self._buckets) > 10000:
+                self._prune(now)
+
+    async def _send(self, job):
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            job.attempts += 1
+            if job.attempts <= self.max_retries:
+                self.retried += 1
+                logger.warning(f"Telegram flood control for chat {job.chat_id}, retrying in {e.retry_after}s")
+                self._paused_until[job.chat_id] = time.monotonic() + float(e.retry_after)
+                lane = self._lanes[job.lane]
+                lane.setdefault(job.chat_id, deque()).appendleft(job)
+                lane.move_to_end(job.chat_id, last=False)
+                return
+            self.pending -= 1
+            logger.error(f"Giving up on a Telegram call to chat {job.chat_id} after {job.attempts} attempts")
+            job.future.set_exception(e)
+        except Exception as e:
+            self.pending -= 1
+            logger.error(f"Telegram call to chat {job.chat_id} failed: {e}")
+            job.future.set_exception(e)
+        else:
+            self.pending -= 1
+            job.future.set_result(result)
+        finally:
+            self._busy.discard(job.chat_id)
+            self._wakeup.set()
+
+    def _prune(self, now):
+        idle = [chat_id for chat_id, bucket in self._buckets.items()
+                if chat_id not in self._busy and bucket.full(now)
+                and not any(chat_id in lane for lane in self._lanes)]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+
+    async def aclose(self, timeout=10.0):
+        """Send what is queued, waiting up to timeout seconds, then stop"""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for lane in self._lanes:
+            for jobs in lane.values():
+                for job in jobs:
+                    job.future.cancel()
+            lane.clear()
+        if self.pending:
+            logger.warning(f"Dropped {self.pending} Telegram calls still queued at shutdown")
+        self.pending = 0
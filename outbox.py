@@ -0,0 +1,200 @@
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+
+import httpx
+
+from n8n_client import is_retryable
+from sqlite_store import SQLiteStore
+from events import encode
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL UNIQUE,
+    webhook_url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    bot_id INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_webhook ON outbox (webhook_url, id);
+"""
+
+class Outbox(SQLiteStore):
+    """SQLite write-ahead queue between the handlers and the n8n webhooks
+
+    Every event is committed locally before it is sent. A row is removed only
+    once n8n has accepted it, so events queued while n8n is down survive a
+    restart and are replayed in order, with exponential backoff per webhook.
+    Each event carries a stable X-Idempotency-Key so n8n can discard the rare
+    duplicate caused by a crash between delivery and checkpoint.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path, n8n_client, on_replayed=None, base_delay=1.0,
+                 max_delay=300.0, poll_interval=1.0, batch_size=50):
+        super().__init__(path)
+        self.n8n_client = n8n_client
+        self.on_replayed = on_replayed
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._backlog = {}
+        self._failures = {}
+        self._retry_at = {}
+        self._in_flight = set()
+        self._wakeup = None
+        self._task = None
+
+    def _load_backlog(self):
+        rows = self._conn.execute("SELECT webhook_url, COUNT(*) FROM outbox GROUP BY webhook_url")
+        return dict(rows.fetchall())
+
+    def _insert(self, event_id, webhook_url, payload, bot_id):
+        self._conn.execute(
+            "INSERT INTO outbox (event_id, webhook_url, payload, bot_id, created_at) VALUES (?, ?, ?, ?, ?)",
+            (event_id, webhook_url, payload, bot_id, time.time()),
+        )
+
+    def _delete(self, event_id):
+        self._conn.execute("DELETE FROM outbox WHERE event_id = ?", (event_id,))
+
+    def _record_attempt(self, event_id):
+        self._conn.execute("UPDATE outbox SET attempts = attempts + 1 WHERE event_id = ?", (event_id,))
+
+    def _pending_for(self, webhook_url):
+        rows = self._conn.execute(
+            "SELECT event_id, payload, bot_id FROM outbox WHERE webhook_url = ? ORDER BY id LIMIT ?",
+            (webhook_url, self.batch_size),
+        )
+        return rows.fetchall()
+
+    @property
+    def depth(self):
+        """Number of events waiting for delivery"""
+        return sum(self._backlog.values())
+
+    async def open(self):
+        """Open the queue; events can be sent from here on"""
+        await self._connect()
+        self._backlog = await self._db(self._load_backlog)
+        self._wakeup = asyncio.Event()
+        if self._backlog:
+            logger.info(f"Outbox has {self.depth} undelivered events to replay")
+
+    def start_replay(self):
+        """Start replaying queued events in the background"""
+        self._task = asyncio.create_task(self._replay_loop())
+
+    async def stop(self):
+        """Stop replaying and close the database"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+
+    def _mark_failed(self, webhook_url):
+        failures = self._failures.get(webhook_url, 0) + 1
+        self._failures[webhook_url] = failures
+        delay = min(self.max_delay, self.base_delay * (2 ** (failures - 1)))
+        self._retry_at[webhook_url] = time.monotonic() + delay * random.uniform(0.5, 1.0)
+
+    def _mark_delivered(self, webhook_url):
+        self._failures.pop(webhook_url, None)
+        self._retry_at.pop(webhook_url, None)
+
+    async def _remove(self, event_id, webhook_url):
+        await self._db(self._delete, event_id)
+        self._backlog[webhook_url] -= 1
+        if not self._backlog[webhook_url]:
+            del self._backlog[webhook_url]
+
+    async def _deliver(self, event_id, webhook_url, data):
+        """Deliver one queued event; returns (delivered, response)"""
+        headers = {'X-Idempotency-Key': event_id}
+        try:
+            response = await self.n8n_client.request(webhook_url, data, headers)
+        except httpx.HTTPError as e:
+            if not is_retryable(e):
+                logger.error(f"n8n rejected event {event_id}, dropping it: {e}")
+                await self._remove(event_id, webhook_url)
+                return True, None
+            self._mark_failed(webhook_url)
+            await self._db(self._record_attempt, event_id)
+            logger.warning(f"Failed to send data to n8n, queued for replay: {e}")
+            return False, None
+        await self._remove(event_id, webhook_url)
+        self._mark_delivered(webhook_url)
+        return True, response
+
+    async def send(self, webhook_url, data, bot_id=None):
+        """Queue data for webhook_url and try to deliver it right away
+
+        Returns the n8n response when delivered immediately, or None when the
+        event was queued for background replay.
+        """
+        event_id = uuid.uuid4().hex
+        has_backlog = webhook_url in self._backlog
+        payload = encode(data).decode()
+        # Immediate delivery owns the row until it returns, so the replayer skips it
+        self._in_flight.add(event_id)
+        try:
+            await self._db(self._insert, event_id, webhook_url, payload, bot_id)
+            self._backlog[webhook_url] = self._backlog.get(webhook_url, 0) + 1
+            if has_backlog:
+                # Keep per-webhook order: older events go first
+                self._wakeup.set()
+                return None
+            delivered, response = await self._deliver(event_id, webhook_url, data)
+            return response
+        finally:
+            self._in_flight.discard(event_id)
+
+    async def _replay_loop(self):
+        while True:
+            try:
+                for webhook_url in list(self._backlog):
+                    if self._retry_at.get(webhook_url, 0) <= time.monotonic():
+                        await self._replay(webhook_url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox replay failed: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _replay(self, webhook_url):
+        """Replay queued events for one webhook in order, stopping at the first failure"""
+        for event_id, payload, bot_id in await self._db(self._pending_for, webhook_url):
+            if event_id in self._in_flight:
+                # An immediate send is still deciding this event's fate; keep order behind it
+                return
+            data = json.loads(payload)
+            self._in_flight.add(event_id)
+            try:
+                delivered, response = await self._deliver(event_id, webhook_url, data)
+            finally:
+                self._in_flight.discard(event_id)
+            if not delivered:
+                return
+            logger.info(f"Replayed queued event {event_id} to n8n")
+            if self.on_replayed:
+                try:
+                    await self.on_replayed(bot_id, data, response)
+                except Exception as e:
+                    logger.error(f"Failed to deliver replayed n8n response: {e}")
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Directory profiles are written to
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# Default and longest profiling run in seconds, and the CPU sampling interval
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '30'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+# Comma-separated Telegram user ids allowed to run /profile; bots can override with "profile_admins"
+PROFILE_ADMIN_IDS = tuple(int(user_id) for user_id in os.getenv('PROFILE_ADMIN_IDS', '').split(',') if user_id.strip())
+# Lines listed in a memory report
+PROFILE_TOP_ALLOCATIONS = int(os.getenv('PROFILE_TOP_ALLOCATIONS', '25'))
+
+CPU = 'cpu'
+MEMORY = 'memory'
+PROFILE_MODES = (CPU, MEMORY)
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is requested while another one is running"""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval, stop):
+    """Sample every other thread's stack until seconds pass or stop is set
+
+    Returns a Counter of folded stacks: thread name, then frames outermost
+    first, joined with ';'.
+    """
+    own = threading.get_ident()
+    names = {}
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not stop.is_set():
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            if thread_id not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            samples[';'.join(reversed(stack))] += 1
+        stop.wait(interval)
+    return samples
+
+
+def write_folded(path, samples):
+    """Write stacks in the folded format flamegraph.pl, speedscope and inferno read"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack.replace(chr(10), ' ')} {count}\n")
+
+
+def write_memory_report(path, before, after, seconds, limit=PROFILE_TOP_ALLOCATIONS):
+    """Write the lines that allocated the most during the run, and those holding the most memory at its end"""
+    growth = after.compare_to(before, 'lineno')
+    current = after.statistics('lineno')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"Memory traced over {seconds:.0f}s: {sum(stat.size for stat in current) / 1024:.1f} KiB "
+                f"in {sum(stat.count for stat in current)} blocks at the end\n\n")
+        f.write(f"Top {limit} allocation growth by line\n")
+        for stat in growth[:limit]:
+            f.write(f"  {stat}\n")
+        f.write(f"\nTop {limit} allocations by line\n")
+        for stat in current[:limit]:
+            f.write(f"  {stat}\n")
+
+
+class Profiler:
+    """Profile the running process on demand, one run at a time
+
+    cpu samples every thread's stack each interval and writes the counts
+    as folded stacks, ready for a flamegraph. memory turns tracemalloc on
+    for the run, unless it already is, and writes the lines that allocated
+    the most and those holding the most memory at the end. Sampling and
+    writing run in threads; the event loop keeps handling updates.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, interval=PROFILE_INTERVAL_MS / 1000, max_seconds=PROFILE_MAX_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._task = None
+        self._stop = threading.Event()
+
+    @property
+    def busy(self):
+        return self._task is not None and not self._task.done()
+
+    def _path(self, mode):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        extension = 'folded' if mode == CPU else 'txt'
+        return os.path.join(self.directory, f"{mode}-{stamp}-{os.getpid()}.{extension}")
+
+    def start(self, mode=CPU, seconds=PROFILE_SECONDS):
+        """Start a profiling run; returns the task, whose result is the profile's path"""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Profile mode must be one of {', '.join(PROFILE_MODES)}, got {mode!r}")
+        if self.busy:
+            raise ProfilerBusy("A profile is already running")
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run(mode, seconds))
+        return self._task
+
+    async def run(self, mode=CPU, seconds=PROFILE_SECONDS):
+        """Profile for seconds and return the path written"""
+        return await self.start(mode, seconds)
+
+    async def _run(self, mode, seconds):
+        path = self._path(mode)
+        logger.info(f"Profiling {mode} for {seconds:.0f}s into {path}")
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+        started = time.monotonic()
+        if mode == CPU:
+            samples = await asyncio.to_thread(sample_stacks, seconds, self.interval, self._stop)
+            await asyncio.to_thread(write_folded, path, samples)
+        else:
+            was_tracing = tracemalloc.is_tracing()
+            if not was_tracing:
+                tracemalloc.start()
+            try:
+                before = await asyncio.to_thread(tracemalloc.take_snapshot)
+                await asyncio.to_thread(self._stop.wait, seconds)
+                after = await asyncio.to_thread(tracemalloc.take_snapshot)
+            finally:
+                if not was_tracing:
+                    tracemalloc.stop()
+            await asyncio.to_thread(write_memory_report, path, before, after, time.monotonic() - started)
+        logger.info(f"Wrote {mode} profile of {time.monotonic() - started:.1f}s to {path}")
+        return path
+
+    async def aclose(self):
+        """End a running profile early; what was collected is still written"""
+        if self.busy:
+            self._stop.set()
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"Profile failed: {e}")
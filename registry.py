@@ -0,0 +1,104 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+HANDLER_TYPES = ('start', 'message', 'photo', 'document')
+
+# The two bots bot.py has always run, described by their environment variables
+LEGACY_BOTS = (
+    ("Primary Bot", 'TELEGRAM_BOT_TOKEN', 'N8N_WEBHOOK_URL'),
+    ("TVO Bot", 'TELEGRAM_BOT_TOKEN_TVO', 'N8N_WEBHOOK_URL_TVO'),
+)
+
+
+class BotConfig:
+    """One bot from the registry: its token, n8n webhook and handler options"""
+
+    __slots__ = ('name', 'token', 'webhook_url', 'options')
+
+    def __init__(self, name, token, webhook_url, options=None):
+        self.name = name
+        self.token = token
+        self.webhook_url = webhook_url
+        self.options = options or {}
+
+    @property
+    def handlers(self):
+        """Handler types enabled for this bot"""
+        return self.options.get('handlers', HANDLER_TYPES)
+
+    def __repr__(self):
+        return f"BotConfig(name={self.name!r}, webhook_url={self.webhook_url!r})"
+
+
+def _resolve(entry, key, name):
+    """Read key from a bot entry, either inline or via the environment variable in key_env"""
+    value = entry.get(key)
+    env_name = entry.get(f'{key}_env')
+    if value is None and env_name:
+        value = os.getenv(env_name)
+        if not value:
+            raise ValueError(f"{env_name} not found in environment variables")
+    if not value:
+        raise ValueError(f"{name}: '{key}' or '{key}_env' is required")
+    return value
+
+
+def parse_bot_configs(config):
+    """Build BotConfigs from a parsed registry document
+
+    The document looks like::
+
+        {
+            "defaults": {"welcome_message": "..."},
+            "bots": [
+                {"name": "Primary Bot", "token_env": "TELEGRAM_BOT_TOKEN", "webhook_url": "https://..."},
+                ...
+            ]
+        }
+
+    Keys other than name, token(_env) and webhook_url(_env) are handler
+    options; they override the same keys in "defaults".
+    """
+    defaults = config.get('defaults', {})
+    entries = config.get('bots')
+    if not entries:
+        raise ValueError("Bot registry defines no bots")
+
+    bots = []
+    names = set()
+    for index, entry in enumerate(entries):
+        name = entry.get('name') or f"Bot {index + 1}"
+        if name in names:
+            raise ValueError(f"Duplicate bot name in registry: {name}")
+        names.add(name)
+        options = dict(defaults)
+        options.update({k: v for k, v in entry.items()
+                        if k not in ('name', 'token', 'token_env', 'webhook_url', 'webhook_url_env')})
+        unknown = set(options.get('handlers', ())) - set(HANDLER_TYPES)
+        if unknown:
+            raise ValueError(f"{name}: unknown handlers {sorted(unknown)}")
+        bots.append(BotConfig(name, _resolve(entry, 'token', name), _resolve(entry, 'webhook_url', name), options))
+    return bots
+
+
+def load_bot_configs(path=None):
+    """Load the bot registry from a JSON file, or the legacy environment variables if no file is given"""
+    if path:
+        with open(path, encoding='utf-8') as f:
+            bots = parse_bot_configs(json.load(f))
+        logger.info(f"Loaded {len(bots)} bots from {path}")
+        return bots
+
+    bots = []
+    for name, token_env, webhook_env in LEGACY_BOTS:
+        token = os.getenv(token_env)
+        webhook_url = os.getenv(webhook_env)
+        if not token:
+            raise ValueError(f"{token_env} not found in environment variables")
+        if not webhook_url:
+            raise ValueError(f"{webhook_env} not found in environment variables")
+        bots.append(BotConfig(name, token, webhook_url))
+    return bots
@@ -0,0 +1,85 @@
+import json
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry cost of the key tuple, OrderedDict slot and entry tuple
+ENTRY_OVERHEAD = 200
+
+
+class ReplyCache:
+    """In-process cache of n8n replies keyed on webhook URL and normalised message text
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the estimated size exceeds `max_bytes`. n8n controls caching
+    per response: ``"no_cache": true`` skips it and ``"cache_ttl": seconds``
+    overrides the default TTL (0 also skips it). Only responses carrying a
+    ``reply`` are cached.
+    """
+
+    def __init__(self, ttl=300.0, max_bytes=8 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def normalize(text):
+        """Case- and whitespace-insensitive form of a message"""
+        return ' '.join(text.casefold().split())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        expires_at, size, response = self._entries.pop(key)
+        self.size -= size
+
+    def get(self, webhook_url, text):
+        """Return the cached n8n response for this message, or None"""
+        key = (webhook_url, self.normalize(text))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, webhook_url, text, response):
+        """Cache an n8n response for this message, honouring its cache directives"""
+        if not isinstance(response, dict) or 'reply' not in response or response.get('no_cache'):
+            return
+        ttl = response.get('cache_ttl', self.ttl)
+        if not isinstance(ttl, (int, float)) or ttl <= 0:
+            return
+
+        key = (webhook_url, self.normalize(text))
+        size = ENTRY_OVERHEAD + len(webhook_url) + len(key[1]) + len(json.dumps(response))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + ttl, size, response)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        """Counters for logging and metrics"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.size,
+        }
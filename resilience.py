@@ -0,0 +1,272 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+
+import httpx
+
+import metrics
+from events import Event
+from n8n_client import N8N_TIMEOUT, is_retryable
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures that open a webhook's circuit, and how long it stays open
+N8N_BREAKER_THRESHOLD = int(os.getenv('N8N_BREAKER_THRESHOLD', '5'))
+N8N_BREAKER_RESET = float(os.getenv('N8N_BREAKER_RESET', '30'))
+# The adaptive timeout is p99 latency times the multiplier, kept within [N8N_TIMEOUT_MIN, N8N_TIMEOUT]
+N8N_TIMEOUT_MIN = float(os.getenv('N8N_TIMEOUT_MIN', '2'))
+N8N_TIMEOUT_MULTIPLIER = float(os.getenv('N8N_TIMEOUT_MULTIPLIER', '1.5'))
+# Comma-separated event types that are safe to send twice, e.g. "command,message"
+N8N_HEDGE_TYPES = frozenset(t.strip() for t in os.getenv('N8N_HEDGE_TYPES', '').split(',') if t.strip())
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised instead of calling a webhook whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Fail fast on a webhook after repeated failures, probing it again after a cool-down"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    # Value of the n8n_circuit_state gauge for each state
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold=N8N_BREAKER_THRESHOLD, reset_timeout=N8N_BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self.opened_at = 0.0
+        self._probing = False
+        metrics.N8N_CIRCUIT_STATE.set(0, webhook=name)
+
+    def _set_state(self, state):
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+            logger.warning(f"Circuit for {self.name} opened after {self.failures} failures; "
+                           f"shedding requests for {self.reset_timeout:.0f}s")
+        elif state == self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+        self.state = state
+        metrics.N8N_CIRCUIT_STATE.set(self.STATE_VALUES[state], webhook=self.name)
+
+    def allow(self):
+        """Return True if a request may be sent now"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                metrics.N8N_CIRCUIT_REJECTED.inc(webhook=self.name)
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            # Exactly one probe at a time decides whether the webhook is back
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self._probing = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def release_probe(self):
+        """Forget an in-flight probe whose outcome will never be known"""
+        self._probing = False
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self._set_state(self.OPEN)
+
+
+class LatencyTracker:
+    """Rolling window of round-trip times for quantile estimates"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def quantile(self, q):
+        """Return the q-quantile of recent latencies, or None until there are enough samples"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class WebhookState:
+    __slots__ = ('breaker', 'latency', 'hedges')
+
+    def __init__(self, breaker, latency):
+        self.breaker = breaker
+        self.latency = latency
+        self.hedges = 0
+
+
+class ResilientN8nClient:
+    """Per-webhook circuit breaker, adaptive timeout and hedged requests around N8nClient
+
+    Exposes the same request()/post() interface as N8nClient. A request to a
+    webhook with an open circuit raises CircuitOpenError without touching the
+    network. Timeouts follow observed p99 latency but never exceed the
+    client's configured timeout. Events whose type is in `hedge_types` get a
+    second, identical request (same X-Idempotency-Key) once the first has
+    taken longer than p95; the first answer wins.
+    """
+
+    def __init__(self, n8n_client, failure_threshold=N8N_BREAKER_THRESHOLD, reset_timeout=N8N_BREAKER_RESET,
+                 min_timeout=N8N_TIMEOUT_MIN, max_timeout=N8N_TIMEOUT, timeout_multiplier=N8N_TIMEOUT_MULTIPLIER,
+                 hedge_types=N8N_HEDGE_TYPES):
+        self.n8n_client = n8n_client
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge_types = hedge_types
+        self._webhooks = {}
+
+    def _state(self, webhook_url):
+        state = self._webhooks.get(webhook_url)
+        if state is None:
+            breaker = CircuitBreaker(webhook_url, self.failure_threshold, self.reset_timeout)
+            state = self._webhooks[webhook_url] = WebhookState(breaker, LatencyTracker())
+        return state
+
+    def timeout_for(self, webhook_url):
+        """Current request timeout for a webhook"""
+        p99 = self._state(webhook_url).latency.quantile(0.99)
+        if p99 is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, p99 * self.timeout_multiplier))
+
+    def _hedgeable(self, data):
+        if not self.hedge_types:
+            return False
+        items = data if isinstance(data, list) else [data]
+        # Handlers send Event objects; replays and payloads with context or a correlation id are dicts
+        return all(isinstance(item, (dict, Event)) and item.get('type') in self.hedge_types for item in items)
+
+    async def _timed(self, state, webhook_url, data, headers, timeout):
+        started = time.monotonic()
+        # Leave the client's own timeout in place until latency data says otherwise
+        override = timeout if timeout < self.max_timeout else None
+        try:
+            response = await self.n8n_client.request(webhook_url, data, headers, timeout=override)
+        except httpx.TimeoutException:
+            # Count the timeout itself as a sample so a slower n8n raises the timeout again
+            state.latency.record(timeout)
+            raise
+        state.latency.record(time.monotonic() - started)
+        return response
+
+    async def _hedged(self, state, webhook_url, data, headers, timeout):
+        delay = state.latency.quantile(0.95)
+        if delay is None or delay >= timeout:
+            return await self._timed(state, webhook_url, data, headers, timeout)
+
+        headers = dict(headers or {})
+        headers.setdefault('X-Idempotency-Key', uuid.uuid4().hex)
+        pending = {asyncio.create_task(self._timed(state, webhook_url, data, headers, timeout))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                state.hedges += 1
+                pending.add(asyncio.create_task(self._timed(state, webhook_url, data, headers, timeout)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _guarded(self, webhook_url, send):
+        """Run send(state) behind the webhook's circuit breaker"""
+        state = self._state(webhook_url)
+        if not state.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {webhook_url}")
+        try:
+            response = await send(state)
+        except httpx.HTTPError as e:
+            if is_retryable(e):
+                state.breaker.record_failure()
+            else:
+                # n8n answered, it just rejected this event
+                state.breaker.record_success()
+            raise
+        except BaseException:
+            # Cancelled, or failed before n8n was involved: release a half-open probe without judging the webhook
+            state.breaker.release_probe()
+            raise
+        state.breaker.record_success()
+        return response
+
+    async def request(self, webhook_url, data, headers=None):
+        """Send data to n8n webhook, raising httpx.HTTPError on failure"""
+        async def send(state):
+            timeout = self.timeout_for(webhook_url)
+            if self._hedgeable(data):
+                return await self._hedged(state, webhook_url, data, headers, timeout)
+            return await self._timed(state, webhook_url, data, headers, timeout)
+
+        return await self._guarded(webhook_url, send)
+
+    async def upload(self, webhook_url, body, content_type, headers=None):
+        """Stream a request body to n8n behind the circuit breaker; uploads are never hedged"""
+        return await self._guarded(
+            webhook_url, lambda state: self.n8n_client.upload(webhook_url, body, content_type, headers)
+        )
+
+    async def stream(self, webhook_url, data, on_text, headers=None):
+        """Stream n8n's reply behind the circuit breaker; see N8nClient.stream. Never hedged"""
+        return await self._guarded(
+            webhook_url, lambda state: self.n8n_client.stream(webhook_url, data, on_text, headers)
+        )
+
+    async def post(self, webhook_url, data, headers=None):
+        """Send data to n8n webhook"""
+        try:
+            return await self.request(webhook_url, data, headers)
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to send data to n8n: {e}")
+            return None
+
+    def reachable(self, webhook_url):
+        """False while webhook_url's circuit is open and its cool-down has not passed"""
+        state = self._webhooks.get(webhook_url)
+        if state is None:
+            return True
+        breaker = state.breaker
+        return breaker.state != breaker.OPEN or time.monotonic() - breaker.opened_at >= breaker.reset_timeout
+
+    def snapshot(self):
+        """Breaker state, timeout and hedge count for every webhook seen so far"""
+        return {
+            url: {
+                'state': state.breaker.state,
+                'failures': state.breaker.failures,
+                'rejected': state.breaker.rejected,
+                'timeout': round(self.timeout_for(url), 3),
+                'hedges': state.hedges,
+            }
+            for url, state in self._webhooks.items()
+        }
@@ -0,0 +1,222 @@
+import os
+import re
+import asyncio
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# How a route with several destinations answers: the first reply wins, or every destination must acknowledge
+N8N_ROUTE_POLICY = os.getenv('N8N_ROUTE_POLICY', 'first_reply')
+
+FIRST_REPLY = 'first_reply'
+ALL_ACK = 'all_ack'
+ROUTE_POLICIES = (FIRST_REPLY, ALL_ACK)
+
+# Stands for the bot's own webhook_url in a rule's destinations
+DEFAULT_DESTINATION = 'default'
+
+
+class Route:
+    """Where an event goes: one or more webhook URLs and how their answers are combined"""
+
+    __slots__ = ('name', 'destinations', 'policy')
+
+    def __init__(self, name, destinations, policy=FIRST_REPLY):
+        if policy not in ROUTE_POLICIES:
+            raise ValueError(f"Route policy must be one of {', '.join(ROUTE_POLICIES)}, got {policy!r}")
+        self.name = name
+        self.destinations = destinations
+        self.policy = policy
+
+    def __repr__(self):
+        return f"Route({self.name!r}, {self.destinations!r}, {self.policy!r})"
+
+
+class Rule:
+    """One entry of a bot's "routes" option; an empty condition matches everything"""
+
+    __slots__ = ('types', 'chat_ids', 'user_ids', 'text', 'pattern', 'route')
+
+    def __init__(self, route, types=(), chat_ids=(), user_ids=(), text=None, ignore_case=False):
+        self.route = route
+        self.types = frozenset(types)
+        self.chat_ids = frozenset(chat_ids)
+        self.user_ids = frozenset(user_ids)
+        self.text = None
+        self.pattern = None
+        if text is not None:
+            self.text = f"(?i:{text})" if ignore_case else text
+            try:
+                self.pattern = re.compile(self.text)
+            except re.error as e:
+                raise ValueError(f"Route {route.name}: invalid text pattern {text!r}: {e}") from None
+
+    @classmethod
+    def from_option(cls, index, option, default_url, policy=N8N_ROUTE_POLICY):
+        destinations = option.get('webhook_urls') or [option.get('webhook_url') or DEFAULT_DESTINATION]
+        destinations = tuple(default_url if url == DEFAULT_DESTINATION else url for url in destinations)
+        route = Route(option.get('name') or f"rule {index + 1}", destinations, option.get('policy', policy))
+        return cls(route, option.get('types', ()), option.get('chat_ids', ()), option.get('user_ids', ()),
+                   option.get('text'), option.get('ignore_case', False))
+
+
+def event_text(data):
+    """Text a rule's pattern is matched against: message text, caption, or /command"""
+    text = data.get('text')
+    if text is None:
+        text = data.get('caption')
+    if text is None and data.get('command') is not None:
+        text = f"/{data.get('command')}"
+    return text
+
+
+class Router:
+    """A bot's routing rules, compiled once when the bot starts
+
+    Rules are tried in order and the first that matches decides the route;
+    events no rule matches go to the bot's webhook_url. Each rule lands in
+    a table keyed by (chat id, event type), with None standing for "any",
+    so an update only looks at the rules that can apply to its chat and
+    type. Each entry also has the text patterns of its rules joined into
+    one regex: a single search() rules all of them out for most text, and
+    only on a hit are the rules' own patterns tried in order.
+    """
+
+    def __init__(self, rules, default_route):
+        self.rules = tuple(rules)
+        self.default_route = default_route
+        self._chats = frozenset(chat_id for rule in self.rules for chat_id in rule.chat_ids)
+        self._types = frozenset(event_type for rule in self.rules for event_type in rule.types)
+        self._table = self._compile_table()
+
+    @classmethod
+    def from_option(cls, option, webhook_url):
+        """Build the router for a bot's "routes" option, or None if it has no rules
+
+        The option is a list of rules, or {"policy": ..., "rules": [...]}
+        to change the default policy. A rule looks like::
+
+            {"name": "ingest", "types": ["document", "photo"], "chat_ids": [...], "user_ids": [...],
+             "text": "^invoice", "ignore_case": true,
+             "webhook_urls": ["https://...", "default"], "policy": "all_ack"}
+
+        "default" in webhook_urls is the bot's own webhook_url.
+        """
+        if not option:
+            return None
+        policy = N8N_ROUTE_POLICY
+        if isinstance(option, dict):
+            policy = option.get('policy', policy)
+            option = option.get('rules', ())
+        rules = [Rule.from_option(index, rule, webhook_url, policy) for index, rule in enumerate(option)]
+        return cls(rules, Route(DEFAULT_DESTINATION, (webhook_url,), policy)) if rules else None
+
+    def _compile_table(self):
+        combined = {}
+        table = {}
+        for chat_id in (None, *self._chats):
+            for event_type in (None, *self._types):
+                candidates = tuple(
+                    rule for rule in self.rules
+                    # The "any" entries only hold rules without that condition
+                    if (rule.chat_ids and chat_id in rule.chat_ids or not rule.chat_ids)
+                    and (rule.types and event_type in rule.types or not rule.types)
+                )
+                texts = tuple(rule.text for rule in candidates if rule.text is not None)
+                if texts not in combined:
+                    combined[texts] = self._combine(texts)
+                table[chat_id, event_type] = (candidates, combined[texts])
+        return table
+
+    @staticmethod
+    def _combine(texts):
+        if len(texts) < 2:
+            return None
+        try:
+            return re.compile('|'.join(f"(?:{text})" for text in texts))
+        except re.error:
+            # Group names or numbered backreferences that clash once joined; try each pattern instead
+            return None
+
+    def match(self, data):
+        """The route for an event: that of the first matching rule, or the default route"""
+        chat_id = data.get('chat_id')
+        event_type = data.get('type')
+        candidates, combined = self._table[
+            chat_id if chat_id in self._chats else None,
+            event_type if event_type in self._types else None,
+        ]
+        user_id = data.get('user_id')
+        text = None
+        for rule in candidates:
+            if rule.user_ids and user_id not in rule.user_ids:
+                continue
+            if rule.pattern is not None:
+                if text is None:
+                    text = event_text(data)
+                    if text is None or (combined is not None and combined.search(text) is None):
+                        text = False
+                if text is False or rule.pattern.search(text) is None:
+                    continue
+            return rule.route
+        return self.default_route
+
+
+def _has_reply(response):
+    return isinstance(response, dict) and 'reply' in response
+
+
+async def fan_out(route, send, background):
+    """Send an event to every destination of route at once and combine their answers
+
+    send(webhook_url) returns the n8n response and raises httpx.HTTPError
+    when the destination does not acknowledge the event.
+
+    first_reply returns the first response with a reply, as soon as it
+    arrives; deliveries still running carry on in tasks added to
+    background. all_ack waits for every destination and returns the first
+    reply in destination order, or None if any destination failed.
+    """
+    tasks = {asyncio.ensure_future(send(url)): url for url in route.destinations}
+    response = None
+    if route.policy == FIRST_REPLY:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    result = task.result()
+                except httpx.HTTPError as e:
+                    logger.error(f"Route {route.name}: failed to send data to {tasks[task]}: {e}")
+                    continue
+                if response is None or (_has_reply(result) and not _has_reply(response)):
+                    response = result
+            if _has_reply(response):
+                break
+        for task in pending:
+            background.add(task)
+            task.add_done_callback(background.discard)
+            task.add_done_callback(lambda task, url=tasks[task]: _log_late_failure(route, url, task))
+        return response
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    failed = []
+    for url, result in zip(route.destinations, results):
+        if isinstance(result, httpx.HTTPError):
+            failed.append(url)
+            logger.error(f"Route {route.name}: failed to send data to {url}: {result}")
+        elif isinstance(result, BaseException):
+            raise result
+        elif response is None or (_has_reply(result) and not _has_reply(response)):
+            response = result
+    if failed:
+        logger.error(f"Route {route.name}: {len(failed)} of {len(tasks)} destinations did not acknowledge the event")
+        return None
+    return response
+
+
+def _log_late_failure(route, url, task):
+    if not task.cancelled() and isinstance(task.exception(), httpx.HTTPError):
+        logger.error(f"Route {route.name}: failed to send data to {url}: {task.exception()}")
@@ -0,0 +1,41 @@
+import asyncio
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """Base for state kept in a SQLite file and used from the event loop
+
+    The connection is opened in WAL mode with the subclass's `schema`. Every
+    call goes through _db(), which runs it in a worker thread, one at a time.
+    """
+
+    schema = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    async def _db(self, fn, *args):
+        """Run a database call off the event loop"""
+        def call():
+            with self._lock:
+                return fn(*args)
+        return await asyncio.to_thread(call)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL with WAL survives process crashes; only an OS crash can lose the last commits
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.schema)
+        return conn
+
+    async def _connect(self):
+        self._conn = await asyncio.to_thread(self._open)
+
+    async def _disconnect(self):
+        if self._conn:
+            await self._db(self._conn.close)
+            self._conn = None
@@ -0,0 +1,78 @@
+import os
+import time
+import logging
+
+from telegram.constants import MessageLimit
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Ask n8n for a streamed reply and show it while it is written; bots can override with "stream_replies"
+N8N_STREAM_REPLIES = os.getenv('N8N_STREAM_REPLIES', '0').lower() in ('1', 'true', 'yes')
+# Minimum seconds between edits of a streaming reply; Telegram allows about one message a second per
+# chat and 20 a minute per group
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+STREAM_GROUP_EDIT_INTERVAL = float(os.getenv('STREAM_GROUP_EDIT_INTERVAL', '3.0'))
+
+
+async def _send_now(kind, call):
+    return await call()
+
+
+class StreamingReply:
+    """A reply to message that grows while n8n streams it
+
+    The first text is sent as soon as it arrives; later text edits that
+    message, at most once per interval, so the chat stays within Telegram's
+    edit limits. Text past Telegram's message length continues in a new
+    message. send(kind, call) awaits call() and returns its result; bot.py
+    passes one that goes through the outbound scheduler.
+    """
+
+    def __init__(self, message, send=_send_now, interval=None):
+        self.message = message
+        self.send = send
+        if interval is None:
+            interval = STREAM_GROUP_EDIT_INTERVAL if message.chat_id < 0 else STREAM_EDIT_INTERVAL
+        self.interval = interval
+        self.text = None
+        self._messages = []
+        self._shown = []
+        self._last_shown = 0.0
+
+    @property
+    def started(self):
+        """Whether any of the reply has been sent"""
+        return bool(self._messages)
+
+    async def update(self, text):
+        """Show text, the whole reply so far, unless the last edit was too recent"""
+        self.text = text
+        now = time.monotonic()
+        if self._messages and now - self._last_shown < self.interval:
+            return
+        self._last_shown = now
+        await self._show(text)
+
+    async def finish(self):
+        """Show the final text if the last update was held back"""
+        if self.text is not None:
+            await self._show(self.text)
+
+    async def _show(self, text):
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        segments = [text[i:i + limit] for i in range(0, len(text), limit)]
+        for index, segment in enumerate(segments):
+            if index == len(self._messages):
+                sent = await self.send('reply', lambda: self.message.reply_text(segment))
+                self._messages.append(sent)
+                self._shown.append(segment)
+            elif self._shown[index] != segment:
+                sent = self._messages[index]
+                try:
+                    await self.send('edit', lambda: sent.edit_text(segment))
+                except TelegramError as e:
+                    # The next edit carries the whole text again
+                    logger.warning(f"Failed to edit streaming reply in chat {self.message.chat_id}: {e}")
+                    continue
+                self._shown[index] = segment
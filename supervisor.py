@@ -0,0 +1,398 @@
+"""Run the bot registry across several worker processes.
+
+    python supervisor.py --workers 4
+
+Bots are split across workers by consistent hashing on their name, so
+changing the worker count only moves the bots that must move. A bot can be
+pinned with a "worker" option in the registry. Crashed workers are restarted
+with backoff. SIGTERM/SIGINT drains every worker. SIGHUP reloads the registry
+and rebalances: workers start and stop individual bots without restarting.
+Unix only (signals and pipe readers on the event loop).
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import signal
+import hashlib
+import asyncio
+import logging
+import argparse
+import resource
+import multiprocessing
+
+from dotenv import load_dotenv
+
+from registry import load_bot_configs
+
+logger = logging.getLogger(__name__)
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', str(os.cpu_count() or 1)))
+WORKER_REPORT_INTERVAL = float(os.getenv('WORKER_REPORT_INTERVAL', '10'))
+WORKER_DRAIN_TIMEOUT = float(os.getenv('WORKER_DRAIN_TIMEOUT', '30'))
+# Optional JSON file rewritten with the latest load report of every worker
+SUPERVISOR_STATUS_FILE = os.getenv('SUPERVISOR_STATUS_FILE')
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes"""
+
+    def __init__(self, nodes, replicas=128):
+        self._ring = sorted((self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big')
+
+    def node_for(self, key):
+        if not self._ring:
+            raise ValueError("Hash ring has no nodes")
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+
+def assign_bots(bots, worker_count):
+    """Split bots across worker ids 0..worker_count-1"""
+    ring = HashRing(range(worker_count))
+    assignments = {worker_id: [] for worker_id in range(worker_count)}
+    for bot in bots:
+        pinned = bot.options.get('worker')
+        worker_id = pinned % worker_count if pinned is not None else ring.node_for(bot.name)
+        assignments[worker_id].append(bot)
+    return assignments
+
+
+def config_key(bot):
+    """Everything that requires restarting a bot when it changes"""
+    return (bot.token, bot.webhook_url, json.dumps(bot.options, sort_keys=True))
+
+
+def worker_path(path, worker_id):
+    """path with the worker id before its extension, for files a worker must not share"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.worker{worker_id}{extension}"
+
+
+def configure_worker(worker_id):
+    """Point the worker's settings at its own files before bot.py reads them"""
+    # Workers sharing one outbox would each replay every queued event, and the other workers' bots are not
+    # there to take n8n's replies
+    outbox_path = os.getenv('N8N_OUTBOX_PATH')
+    if outbox_path:
+        os.environ['N8N_OUTBOX_PATH'] = worker_path(outbox_path, worker_id)
+
+
+def worker_process(worker_id, bots, control, status, report_interval):
+    """Entry point of a worker process: run the assigned bots until told to stop"""
+    configure_worker(worker_id)
+    asyncio.run(run_worker(worker_id, bots, control, status, report_interval))
+
+
+async def run_worker(worker_id, bots, control, status, report_interval):
+    # Imported here so every worker builds its own clients on its own loop
+    import bot as bot_module
+
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    # kill -USR1 / -USR2 <worker pid> profiles that worker
+    bot_module.install_profile_signals()
+
+    # Each worker serves its own /metrics, n8n callbacks and health checks on the configured port + worker id
+    metrics_port = bot_module.METRICS_PORT + worker_id if bot_module.METRICS_PORT else 0
+    callback_port = bot_module.N8N_CALLBACK_PORT + worker_id if bot_module.N8N_CALLBACK_PORT else 0
+    health_port = bot_module.HEALTH_PORT + worker_id if bot_module.HEALTH_PORT else 0
+    http_server, ingress = await bot_module.start_services(metrics_port, callback_port, health_port)
+    applications = {}
+    configs = {}
+    lock = asyncio.Lock()
+
+    async def assign(new_bots):
+        async with lock:
+            wanted = {bot.name: bot for bot in new_bots}
+            leaving = [name for name in applications
+                       if name not in wanted or config_key(wanted[name]) != configs[name]]
+            await asyncio.gather(*(bot_module.stop_bot(applications.pop(name)) for name in leaving))
+            joining = [bot for name, bot in wanted.items() if name not in applications]
+            applications.update(await bot_module.start_bots(joining, ingress))
+            configs.clear()
+            configs.update({name: config_key(wanted[name]) for name in applications})
+            logger.info(f"Worker {worker_id} is running {len(applications)} bots")
+            status.send({'worker': worker_id, 'assigned': sorted(wanted)})
+
+    def on_control():
+        try:
+            message = control.recv()
+        except EOFError:
+            # The supervisor is gone; nobody will restart us, so drain
+            loop.remove_reader(control.fileno())
+            stop_event.set()
+            return
+        if message[0] == 'assign':
+            asyncio.ensure_future(assign(message[1]))
+        elif message[0] == 'stop':
+            stop_event.set()
+
+    async def report():
+        last_wall, last_cpu = time.monotonic(), time.process_time()
+        while True:
+            await asyncio.sleep(report_interval)
+            wall, cpu = time.monotonic(), time.process_time()
+            status.send({
+                'worker': worker_id,
+                'pid': os.getpid(),
+                'cpu_percent': round(100 * (cpu - last_cpu) / (wall - last_wall), 1),
+                'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                'pending_updates': {name: bot_module.pending_updates(app) for name, app in applications.items()},
+                'outbox_depth': bot_module.outbox.depth if bot_module.outbox is not None else 0,
+                'reply_cache': bot_module.reply_cache.stats() if bot_module.reply_cache is not None else None,
+                'webhooks': bot_module.resilient_client.snapshot(),
+            })
+            last_wall, last_cpu = wall, cpu
+
+    await assign(bots)
+    if bot_module.outbox is not None:
+        bot_module.outbox.start_replay()
+    loop.add_reader(control.fileno(), on_control)
+    reporter = asyncio.create_task(report())
+    try:
+        await stop_event.wait()
+    finally:
+        loop.remove_reader(control.fileno())
+        reporter.cancel()
+        async with lock:
+            await bot_module.shutdown(applications, http_server)
+
+
+class Worker:
+    """Supervisor-side state of one worker process"""
+
+    __slots__ = ('id', 'bots', 'process', 'control', 'status', 'started_at',
+                 'failures', 'restart_at', 'retiring', 'assigned')
+
+    def __init__(self, worker_id, bots):
+        self.id = worker_id
+        self.bots = bots
+        self.process = None
+        self.control = None
+        self.status = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = None
+        self.retiring = False
+        self.assigned = None
+
+
+class Supervisor:
+    """Run bots across worker processes, restarting crashed workers and draining on shutdown"""
+
+    def __init__(self, bots, worker_count, report_interval=WORKER_REPORT_INTERVAL,
+                 drain_timeout=WORKER_DRAIN_TIMEOUT, status_file=SUPERVISOR_STATUS_FILE,
+                 loader=None, target=worker_process, base_backoff=1.0, max_backoff=60.0,
+                 stable_after=60.0):
+        if worker_count < 1:
+            raise ValueError("worker_count must be a positive integer")
+        self.bots = bots
+        self.worker_count = worker_count
+        self.report_interval = report_interval
+        self.drain_timeout = drain_timeout
+        self.status_file = status_file
+        self.loader = loader
+        self.target = target
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.workers = {}
+        self.load = {}
+        self._ctx = multiprocessing.get_context('spawn')
+        self._loop = None
+        self._stop = None
+
+    def _spawn(self, worker):
+        control_recv, control_send = self._ctx.Pipe(duplex=False)
+        status_recv, status_send = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(
+            target=self.target,
+            args=(worker.id, worker.bots, control_recv, status_send, self.report_interval),
+            name=f"bot-worker-{worker.id}",
+        )
+        process.start()
+        control_recv.close()
+        status_send.close()
+        worker.process, worker.control, worker.status = process, control_send, status_recv
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        worker.assigned = None
+        self._loop.add_reader(status_recv.fileno(), self._on_status, worker)
+        logger.info(f"Started worker {worker.id} (pid {process.pid}) with {len(worker.bots)} bots")
+
+    def _close_pipes(self, worker):
+        if worker.status is not None:
+            self._loop.remove_reader(worker.status.fileno())
+            worker.status.close()
+            worker.control.close()
+            worker.status = worker.control = None
+
+    def _on_status(self, worker):
+        try:
+            report = worker.status.recv()
+        except (EOFError, OSError):
+            self._loop.remove_reader(worker.status.fileno())
+            return
+        if 'assigned' in report:
+            worker.assigned = report['assigned']
+            return
+        self.load[worker.id] = report
+        logger.debug(f"Worker {worker.id} load: {report}")
+        if self.status_file:
+            tmp = self.status_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({str(k): v for k, v in sorted(self.load.items())}, f, indent=2)
+            os.replace(tmp, self.status_file)
+
+    def _send(self, worker, message):
+        try:
+            worker.control.send(message)
+        except (OSError, AttributeError):
+            # Dead worker; it picks up worker.bots when it is restarted
+            pass
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            if worker.process is not None and not worker.process.is_alive():
+                exitcode = worker.process.exitcode
+                worker.process.join()
+                self._close_pipes(worker)
+                worker.process = None
+                self.load.pop(worker.id, None)
+                if worker.retiring:
+                    logger.info(f"Worker {worker.id} retired")
+                    del self.workers[worker.id]
+                    continue
+                # A worker that ran for a while before dying starts its backoff over
+                if now - worker.started_at > self.stable_after:
+                    worker.failures = 0
+                worker.failures += 1
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (worker.failures - 1))
+                worker.restart_at = now + delay
+                logger.error(f"Worker {worker.id} exited with code {exitcode}; restarting in {delay:.1f}s")
+            if worker.process is None and worker.restart_at is not None and worker.restart_at <= now:
+                self._spawn(worker)
+
+    async def _wait_assigned(self, workers, timeout):
+        """Wait until the given workers report they applied their assignment"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(w.process is None or w.assigned == sorted(b.name for b in w.bots) for w in workers):
+                return
+            await asyncio.sleep(0.1)
+
+    async def rebalance(self, bots, worker_count):
+        """Move bots to match a new registry or worker count, restarting no worker"""
+        self.bots = bots
+        self.worker_count = worker_count
+        assignments = assign_bots(bots, worker_count)
+
+        # First stop bots that are leaving a worker, so a token never polls from two processes
+        shrinking = []
+        for worker_id, worker in self.workers.items():
+            keep = {b.name for b in assignments.get(worker_id, [])}
+            current = [b for b in worker.bots if b.name in keep]
+            if len(current) != len(worker.bots):
+                worker.bots = current
+                self._send(worker, ('assign', current))
+                shrinking.append(worker)
+        await self._wait_assigned(shrinking, self.drain_timeout)
+
+        for worker_id, assigned in assignments.items():
+            worker = self.workers.get(worker_id)
+            if worker is None:
+                worker = self.workers[worker_id] = Worker(worker_id, assigned)
+                self._spawn(worker)
+            else:
+                worker.bots = assigned
+                self._send(worker, ('assign', assigned))
+        for worker_id in set(self.workers) - set(assignments):
+            worker = self.workers[worker_id]
+            worker.retiring = True
+            self._send(worker, ('stop',))
+        logger.info(f"Rebalanced {len(bots)} bots across {worker_count} workers")
+
+    async def _reload(self):
+        if self.loader is None:
+            return
+        try:
+            bots = self.loader()
+        except Exception as e:
+            logger.error(f"Failed to reload bot registry: {e}")
+            return
+        await self.rebalance(bots, self.worker_count)
+
+    async def drain(self):
+        """Ask every worker to stop gracefully, then terminate the ones that don't"""
+        for worker in self.workers.values():
+            if worker.process is not None:
+                self._send(worker, ('stop',))
+        deadline = time.monotonic() + self.drain_timeout
+        while time.monotonic() < deadline and any(
+                w.process is not None and w.process.is_alive() for w in self.workers.values()):
+            await asyncio.sleep(0.1)
+        for worker in self.workers.values():
+            if worker.process is not None:
+                if worker.process.is_alive():
+                    logger.warning(f"Worker {worker.id} did not drain in time; terminating")
+                    worker.process.terminate()
+                worker.process.join()
+                self._close_pipes(worker)
+                worker.process = None
+        logger.info("All workers stopped.")
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        """Start the workers and supervise them until stopped"""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self._loop.add_signal_handler(sig, self._stop.set)
+        self._loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self._reload()))
+
+        for worker_id, assigned in assign_bots(self.bots, self.worker_count).items():
+            worker = self.workers[worker_id] = Worker(worker_id, assigned)
+            self._spawn(worker)
+
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+            self._check_workers()
+        await self.drain()
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(processName)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Run the bot registry across worker processes")
+    parser.add_argument('--workers', type=int, default=BOT_WORKERS)
+    args = parser.parse_args()
+
+    if os.getenv('BOT_MODE', 'polling').lower() != 'polling':
+        sys.exit("The supervisor only supports BOT_MODE=polling; workers cannot share one webhook port")
+
+    config_file = os.getenv('BOT_CONFIG_FILE')
+    bots = load_bot_configs(config_file)
+    supervisor = Supervisor(bots, min(args.workers, len(bots)), loader=lambda: load_bot_configs(config_file))
+    asyncio.run(supervisor.run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import time
+import unittest
+import asyncio
+from unittest.mock import AsyncMock
+
+from telegram import Update
+from telegram.ext import SimpleUpdateProcessor
+
+import metrics
+from admission import AdmissionController, AdmissionPolicy, AdmissionUpdateProcessor
+from dispatch import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id, user_id=1, chat_id=1):
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 1760788800, "text": "hi",
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+    }}, None)
+
+
+class TestAdmission(unittest.TestCase):
+    def run_updates(self, policy, updates, work=0.0, inner=None, notify_busy=None, spacing=0.0):
+        handled = []
+
+        async def handle(update):
+            handled.append(update.update_id)
+            await asyncio.sleep(work)
+
+        async def run_test():
+            processor = AdmissionUpdateProcessor(inner or ChatOrderedUpdateProcessor(8),
+                                                 AdmissionController(policy), 'test-bot', notify_busy)
+            tasks = []
+            for update in updates:
+                tasks.append(asyncio.create_task(processor.process_update(update, handle(update))))
+                await asyncio.sleep(spacing)
+            await asyncio.gather(*tasks)
+            return processor.controller.in_flight
+
+        self.assertEqual(asyncio.run(run_test()), 0)
+        return handled
+
+    def shed(self, reason):
+        return metrics.UPDATES_SHED._values.get(metrics.UPDATES_SHED._key({'bot': 'test-bot', 'reason': reason}), 0)
+
+    def test_user_quota_drops_only_the_noisy_user(self):
+        """Test that one user over their quota is shed while another user gets through"""
+        before = self.shed('user')
+        policy = AdmissionPolicy(user_per_minute=1, user_burst=2)
+        updates = [make_update(i, user_id=1, chat_id=-10) for i in range(5)] + [make_update(9, user_id=2, chat_id=-10)]
+        self.assertEqual(self.run_updates(policy, updates), [0, 1, 9])
+        self.assertEqual(self.shed('user') - before, 3)
+
+    def test_max_in_flight(self):
+        """Test that updates beyond the in-flight limit are shed, including those queued behind a chat"""
+        before = self.shed('in_flight')
+        policy = AdmissionPolicy(max_in_flight=2)
+        updates = [make_update(i, user_id=i, chat_id=7) for i in range(4)]
+        self.assertEqual(self.run_updates(policy, updates, work=0.05), [0, 1])
+        self.assertEqual(self.shed('in_flight') - before, 2)
+
+    def test_delay_keeps_order(self):
+        """Test that the delay policy holds updates over quota back instead of dropping them"""
+        policy = AdmissionPolicy(chat_per_minute=600, chat_burst=1, shed='delay', max_delay=1)
+        started = time.monotonic()
+        handled = self.run_updates(policy, [make_update(i) for i in range(4)], inner=SimpleUpdateProcessor(4))
+        self.assertEqual(handled, [0, 1, 2, 3])
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+    def test_busy_reply_once_per_chat(self):
+        """Test that the busy policy tells a flooding chat once, not once per shed update"""
+        notify_busy = AsyncMock()
+        policy = AdmissionPolicy(chat_per_minute=1, chat_burst=1, shed='busy', busy_message="Busy!")
+        handled = self.run_updates(policy, [make_update(i, chat_id=5) for i in range(4)], notify_busy=notify_busy)
+        self.assertEqual(handled, [0])
+        notify_busy.assert_awaited_once()
+        self.assertEqual(notify_busy.call_args[0][1], "Busy!")
+
+    def test_policy_from_option(self):
+        """Test that the option only enables admission control when it sets a limit"""
+        self.assertIsNone(AdmissionPolicy.from_option(None))
+        self.assertIsNone(AdmissionPolicy.from_option(False))
+        self.assertEqual(AdmissionPolicy.from_option({"max_in_flight": 50}).max_in_flight, 50)
+        with self.assertRaises(ValueError):
+            AdmissionPolicy(shed='ignore')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+import bot
+from events import AlbumEvent, PhotoEvent, encode
+
+
+def make_photo_update(message_id, caption=None, media_group_id='album-1', chat_id=100):
+    message = Mock()
+    message.message_id = message_id
+    message.chat_id = chat_id
+    message.caption = caption
+    message.media_group_id = media_group_id
+    message.photo = [Mock(file_id=f"small-{message_id}"), Mock(file_id=f"photo-{message_id}", file_size=1000)]
+    message.date.isoformat.return_value = "2025-10-18T12:00:00+00:00"
+    message.reply_text = AsyncMock()
+    update = Mock()
+    update.message = message
+    update.effective_user = Mock(id=7, username="ann", first_name="Ann", last_name=None)
+    return update
+
+
+class TestAlbumEvent(unittest.TestCase):
+    def test_album_event(self):
+        """Test that an album lists each item's own fields once and shares the sender fields"""
+        photos = [PhotoEvent.from_update(make_photo_update(i, caption="trip" if i == 2 else None)) for i in (1, 2)]
+        album = AlbumEvent.from_events('album-1', photos)
+        payload = json.loads(encode(album))
+        self.assertEqual(payload['type'], 'album')
+        self.assertEqual((payload['message_id'], payload['caption'], payload['chat_id']), (1, "trip", 100))
+        self.assertEqual(payload['items'], [
+            {"type": "photo", "message_id": 1, "photo_file_id": "photo-1", "caption": None},
+            {"type": "photo", "message_id": 2, "photo_file_id": "photo-2", "caption": "trip"},
+        ])
+        self.assertEqual(album.encode(), encode(album.to_dict()))
+
+
+class TestAlbumHandler(unittest.TestCase):
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
+    def test_album_sent_once_with_single_reply(self, mock_send_to_n8n):
+        """Test that an album of photos becomes one n8n event and one reply"""
+        mock_send_to_n8n.return_value = {"reply": "Nice album"}
+        handler = bot.create_photo_handler('http://n8n/hook', album_window=0.05)
+        context = Mock()
+        updates = [make_photo_update(i) for i in range(1, 4)]
+
+        async def run_test():
+            for update in updates:
+                await handler(update, context)
+            mock_send_to_n8n.assert_not_called()
+            await asyncio.sleep(0.3)
+
+        asyncio.run(run_test())
+        mock_send_to_n8n.assert_called_once()
+        album = mock_send_to_n8n.call_args[0][0]
+        self.assertEqual(album['type'], 'album')
+        self.assertEqual([item['photo_file_id'] for item in album['items']], ['photo-1', 'photo-2', 'photo-3'])
+        updates[0].message.reply_text.assert_called_once_with("Nice album")
+        updates[1].message.reply_text.assert_not_called()
+
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
+    def test_single_photo_not_delayed(self, mock_send_to_n8n):
+        """Test that a photo outside any album is sent straight away"""
+        mock_send_to_n8n.return_value = None
+        handler = bot.create_photo_handler('http://n8n/hook', album_window=10)
+        context = Mock()
+        context.bot.set_message_reaction = AsyncMock()
+
+        asyncio.run(handler(make_photo_update(1, media_group_id=None), context))
+        mock_send_to_n8n.assert_called_once()
+        self.assertEqual(mock_send_to_n8n.call_args[0][0]['type'], 'photo')
+
+
+if __name__ == '__main__':
+    unittest.main()
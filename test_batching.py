@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import Mock, AsyncMock
+import asyncio
+import httpx
+from batching import WebhookBatcher, split_batch_response
+
+
+WEBHOOK_URL = 'http://localhost:5678/webhook/test'
+
+
+class TestSplitBatchResponse(unittest.TestCase):
+    def test_match_by_message_id(self):
+        """Test that replies are matched by chat and message id regardless of order"""
+        payloads = [
+            {"chat_id": 1, "message_id": 10},
+            {"chat_id": 2, "message_id": 10},
+            {"chat_id": 1, "message_id": 11},
+        ]
+        response = [
+            {"chat_id": 1, "message_id": 11, "reply": "c"},
+            {"chat_id": 2, "message_id": 10, "reply": "b"},
+        ]
+        replies = split_batch_response(payloads, response)
+        self.assertIsNone(replies[0])
+        self.assertEqual(replies[1]["reply"], "b")
+        self.assertEqual(replies[2]["reply"], "c")
+
+    def test_positional_and_wrapped(self):
+        """Test that an unkeyed list is matched by position, also inside {"replies": [...]}"""
+        payloads = [{"type": "command"}, {"type": "command"}]
+        response = {"replies": [{"reply": "a"}, None]}
+        self.assertEqual(split_batch_response(payloads, response), [{"reply": "a"}, None])
+
+    def test_unmatched_response(self):
+        """Test that an ambiguous response gives no reply to anyone"""
+        payloads = [{"message_id": 1}, {"message_id": 2}]
+        self.assertEqual(split_batch_response(payloads, {"status": "ok"}), [None, None])
+        self.assertEqual(split_batch_response(payloads, [{"reply": "x"}]), [None, None])
+
+
+class TestWebhookBatcher(unittest.TestCase):
+    def test_groups_by_window_and_url(self):
+        """Test that payloads within one window become one POST per webhook"""
+        client = Mock()
+
+        async def respond(webhook_url, payloads, headers=None):
+            return [{"message_id": p["message_id"], "reply": f"r{p['message_id']}"} for p in payloads]
+
+        client.request = AsyncMock(side_effect=respond)
+
+        async def run_test():
+            batcher = WebhookBatcher(client, window=0.02, max_size=10)
+            return await asyncio.gather(
+                batcher.post(WEBHOOK_URL, {"message_id": 1}),
+                batcher.post(WEBHOOK_URL, {"message_id": 2}),
+                batcher.post('http://localhost:5678/webhook/other', {"message_id": 3}),
+            )
+
+        replies = asyncio.run(run_test())
+        self.assertEqual([r["reply"] for r in replies], ["r1", "r2", "r3"])
+        self.assertEqual(client.request.call_count, 2)
+        first = client.request.call_args_list[0][0]
+        self.assertEqual(first[1], [{"message_id": 1}, {"message_id": 2}])
+
+    def test_flush_at_max_size(self):
+        """Test that a full batch is sent without waiting for the window"""
+        client = Mock()
+        client.request = AsyncMock(return_value=None)
+
+        async def run_test():
+            batcher = WebhookBatcher(client, window=60, max_size=2)
+            return await asyncio.wait_for(asyncio.gather(
+                batcher.post(WEBHOOK_URL, {"message_id": 1}),
+                batcher.post(WEBHOOK_URL, {"message_id": 2}),
+            ), timeout=1)
+
+        self.assertEqual(asyncio.run(run_test()), [None, None])
+
+    def test_failure_reaches_every_caller(self):
+        """Test that a failed batch raises for request() and returns None for post()"""
+        client = Mock()
+        client.request = AsyncMock(side_effect=httpx.ConnectError("down"))
+
+        async def run_test():
+            batcher = WebhookBatcher(client, window=0.01, max_size=10)
+            posted = batcher.post(WEBHOOK_URL, {"message_id": 1})
+            requested = batcher.request(WEBHOOK_URL, {"message_id": 2}, {'X-Idempotency-Key': 'k'})
+            return await asyncio.gather(posted, requested, return_exceptions=True)
+
+        posted, requested = asyncio.run(run_test())
+        self.assertIsNone(posted)
+        self.assertIsInstance(requested, httpx.ConnectError)
+
+
+if __name__ == '__main__':
+    unittest.main()
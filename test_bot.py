@@ -4,9 +4,14 @@ import asyncio
 import json
 import os
 from datetime import datetime
+import httpx
 from telegram import Update, Message, User, Chat, Document, PhotoSize
 from telegram.ext import ContextTypes
 import bot
+from registry import BotConfig
+
+
+WEBHOOK_URL = 'http://localhost:5678/webhook/test'
 
 
 class TestTelegramBot(unittest.TestCase):
@@ -44,7 +49,7 @@ class TestTelegramBot(unittest.TestCase):
                 importlib.reload(bot)
             self.assertIn("TELEGRAM_BOT_TOKEN", str(cm.exception))
 
-    @patch('bot.requests.post')
+    @patch('n8n_client.httpx.AsyncClient.post', new_callable=AsyncMock)
     def test_send_to_n8n_success(self, mock_post):
         """Test successful n8n webhook call"""
         mock_response = Mock()
@@ -55,18 +60,21 @@ class TestTelegramBot(unittest.TestCase):
         mock_post.return_value = mock_response
         
         test_data = {"test": "data"}
-        result = bot.send_to_n8n(test_data)
+        webhook_url = 'http://localhost:5678/webhook/test'
+        result = asyncio.run(bot.send_to_n8n(test_data, webhook_url))
         
-        mock_post.assert_called_once_with(bot.N8N_WEBHOOK_URL, json=test_data, timeout=10)
+        mock_post.assert_called_once_with(
+            webhook_url, content=b'{"test":"data"}', headers={'Content-Type': 'application/json'}
+        )
         self.assertEqual(result, {"status": "success"})
 
-    @patch('bot.requests.post')
+    @patch('n8n_client.httpx.AsyncClient.post', new_callable=AsyncMock)
     def test_send_to_n8n_failure(self, mock_post):
         """Test failed n8n webhook call"""
-        mock_post.side_effect = Exception("Connection error")
+        mock_post.side_effect = httpx.ConnectError("Connection error")
         
         test_data = {"test": "data"}
-        result = bot.send_to_n8n(test_data)
+        result = asyncio.run(bot.send_to_n8n(test_data, 'http://localhost:5678/webhook/test'))
         
         self.assertIsNone(result)
 
@@ -97,13 +105,13 @@ class TestBotHandlers(unittest.TestCase):
         self.mock_context.bot = Mock()
         self.mock_context.bot.set_message_reaction = AsyncMock()
 
-    @patch('bot.send_to_n8n')
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
     def test_start_command_handler(self, mock_send_to_n8n):
         """Test /start command handler"""
         mock_send_to_n8n.return_value = {"status": "success"}
         
         async def run_test():
-            await bot.start(self.mock_update, self.mock_context)
+            await bot.create_start_handler(WEBHOOK_URL)(self.mock_update, self.mock_context)
             
             # Check that n8n was called with correct data
             mock_send_to_n8n.assert_called_once()
@@ -121,14 +129,14 @@ class TestBotHandlers(unittest.TestCase):
         
         asyncio.run(run_test())
 
-    @patch('bot.send_to_n8n')
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
     def test_handle_message_with_reply(self, mock_send_to_n8n):
         """Test message handler when n8n returns a reply"""
         self.mock_message.text = "Test message"
         mock_send_to_n8n.return_value = {"reply": "Bot response"}
         
         async def run_test():
-            await bot.handle_message(self.mock_update, self.mock_context)
+            await bot.create_message_handler(WEBHOOK_URL)(self.mock_update, self.mock_context)
             
             # Check that n8n was called with correct data
             mock_send_to_n8n.assert_called_once()
@@ -143,14 +151,14 @@ class TestBotHandlers(unittest.TestCase):
         
         asyncio.run(run_test())
 
-    @patch('bot.send_to_n8n')
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
     def test_handle_message_with_reaction(self, mock_send_to_n8n):
         """Test message handler when n8n doesn't return a reply"""
         self.mock_message.text = "Test message"
         mock_send_to_n8n.return_value = {"status": "received"}
         
         async def run_test():
-            await bot.handle_message(self.mock_update, self.mock_context)
+            await bot.create_message_handler(WEBHOOK_URL)(self.mock_update, self.mock_context)
             
             # Check that reaction was set instead of reply
             self.mock_context.bot.set_message_reaction.assert_called_once_with(
@@ -162,7 +170,66 @@ class TestBotHandlers(unittest.TestCase):
         
         asyncio.run(run_test())
 
-    @patch('bot.send_to_n8n')
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
+    def test_handle_message_cached_reply(self, mock_send_to_n8n):
+        """Test that a cached reply is sent without calling n8n again"""
+        self.mock_message.text = "Opening hours?"
+        mock_send_to_n8n.return_value = {"reply": "9 to 5"}
+        handler = bot.create_message_handler(WEBHOOK_URL, bot.ReplyCache(ttl=60))
+        
+        async def run_test():
+            await handler(self.mock_update, self.mock_context)
+            await handler(self.mock_update, self.mock_context)
+        
+        asyncio.run(run_test())
+        mock_send_to_n8n.assert_called_once()
+        self.assertEqual(self.mock_message.reply_text.call_count, 2)
+        self.mock_message.reply_text.assert_called_with("9 to 5")
+
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
+    def test_handle_message_debounced(self, mock_send_to_n8n):
+        """Test that a quick burst of messages becomes one event and one reply to the last message"""
+        mock_send_to_n8n.return_value = {"reply": "Got all three"}
+        handler = bot.create_message_handler(WEBHOOK_URL, debounce_window=0.1)
+        updates = []
+        for message_id, text in enumerate(["so", "about my order", "it never arrived"], start=1):
+            message = Mock(spec=Message, message_id=message_id, chat_id=self.mock_chat.id, text=text,
+                           date=self.mock_message.date, reply_text=AsyncMock())
+            updates.append(Mock(spec=Update, effective_user=self.mock_user, message=message))
+
+        async def run_test():
+            for update in updates:
+                await handler(update, self.mock_context)
+                await asyncio.sleep(0.02)
+            mock_send_to_n8n.assert_not_called()
+            await asyncio.sleep(0.3)
+
+        asyncio.run(run_test())
+        mock_send_to_n8n.assert_called_once()
+        payload = mock_send_to_n8n.call_args[0][0]
+        self.assertEqual(payload["type"], "message")
+        self.assertEqual(payload["message_ids"], [1, 2, 3])
+        self.assertEqual(payload["message_id"], 3)
+        self.assertEqual(payload["text"], "so\nabout my order\nit never arrived")
+        updates[2].message.reply_text.assert_called_once_with("Got all three")
+        updates[0].message.reply_text.assert_not_called()
+
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
+    def test_handle_message_debounced_single(self, mock_send_to_n8n):
+        """Test that a lone message in the window is sent as a plain message event"""
+        self.mock_message.text = "Hi"
+        mock_send_to_n8n.return_value = {"reply": "Hello"}
+        handler = bot.create_message_handler(WEBHOOK_URL, debounce_window=0.01)
+
+        async def run_test():
+            await handler(self.mock_update, self.mock_context)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run_test())
+        self.assertNotIn("message_ids", mock_send_to_n8n.call_args[0][0])
+        self.mock_message.reply_text.assert_called_once_with("Hello")
+
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
     def test_handle_photo(self, mock_send_to_n8n):
         """Test photo handler"""
         mock_photo = Mock(spec=PhotoSize)
@@ -173,7 +240,7 @@ class TestBotHandlers(unittest.TestCase):
         mock_send_to_n8n.return_value = {"status": "received"}
         
         async def run_test():
-            await bot.handle_photo(self.mock_update, self.mock_context)
+            await bot.create_photo_handler(WEBHOOK_URL)(self.mock_update, self.mock_context)
             
             # Check that n8n was called with correct data
             mock_send_to_n8n.assert_called_once()
@@ -188,7 +255,7 @@ class TestBotHandlers(unittest.TestCase):
         
         asyncio.run(run_test())
 
-    @patch('bot.send_to_n8n')
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
     def test_handle_document(self, mock_send_to_n8n):
         """Test document handler"""
         mock_document = Mock(spec=Document)
@@ -202,7 +269,7 @@ class TestBotHandlers(unittest.TestCase):
         mock_send_to_n8n.return_value = {"reply": "Document received"}
         
         async def run_test():
-            await bot.handle_document(self.mock_update, self.mock_context)
+            await bot.create_document_handler(WEBHOOK_URL)(self.mock_update, self.mock_context)
             
             # Check that n8n was called with correct data
             mock_send_to_n8n.assert_called_once()
@@ -222,24 +289,87 @@ class TestBotHandlers(unittest.TestCase):
 class TestBotIntegration(unittest.TestCase):
     """Integration tests for the bot"""
     
-    @patch('bot.TELEGRAM_BOT_TOKEN', 'test_token')
-    @patch('bot.N8N_WEBHOOK_URL', 'http://test.webhook')
     @patch('bot.Application')
-    def test_main_function_setup(self, mock_application_class):
-        """Test that main function sets up the bot correctly"""
+    def test_run_bot_setup(self, mock_application_class):
+        """Test that run_bot sets up the bot correctly"""
         mock_app = Mock()
-        mock_application_class.builder.return_value.token.return_value.build.return_value = mock_app
+        mock_application_class.builder.return_value.token.return_value.get_updates_request.return_value.build.return_value = mock_app
         
-        # Mock the run_polling method to avoid actually starting the bot
-        mock_app.run_polling = Mock()
+        # Mock the startup coroutines to avoid actually starting the bot
+        mock_app.initialize = AsyncMock()
+        mock_app.start = AsyncMock()
+        mock_app.updater.start_polling = AsyncMock()
         
-        bot.main()
+        asyncio.run(bot.run_bot('test_token', WEBHOOK_URL, "Test Bot"))
         
         # Check that handlers were added
         self.assertEqual(mock_app.add_handler.call_count, 4)
         
-        # Check that bot starts polling
-        mock_app.run_polling.assert_called_once()
+        # Check that bot starts polling, with a getUpdates request the readiness check can watch
+        mock_app.updater.start_polling.assert_called_once()
+        polling = mock_application_class.builder.return_value.token.return_value.get_updates_request.call_args[0][0]
+        self.assertIsInstance(polling, bot.PollingRequest)
+
+
+    @patch('bot.CONCURRENT_UPDATES', 16)
+    @patch('bot.Application')
+    def test_run_bot_concurrent_updates(self, mock_application_class):
+        """Test that run_bot installs the per-chat ordered processor when enabled"""
+        builder = mock_application_class.builder.return_value.token.return_value.get_updates_request.return_value
+        mock_app = builder.concurrent_updates.return_value.build.return_value
+        mock_app.initialize = AsyncMock()
+        mock_app.start = AsyncMock()
+        mock_app.updater.start_polling = AsyncMock()
+        
+        asyncio.run(bot.run_bot('test_token', WEBHOOK_URL, "Test Bot"))
+        
+        processor = builder.concurrent_updates.call_args[0][0]
+        self.assertIsInstance(processor, bot.ChatOrderedUpdateProcessor)
+        self.assertEqual(processor.max_concurrent_updates, 16)
+        self.assertEqual(mock_app.add_handler.call_count, 4)
+
+    @patch('bot.Application')
+    def test_run_bot_admission(self, mock_application_class):
+        """Test that the admission option wraps the update processor, even in sequential mode"""
+        builder = mock_application_class.builder.return_value.token.return_value.get_updates_request.return_value
+        mock_app = builder.concurrent_updates.return_value.build.return_value
+        mock_app.initialize = AsyncMock()
+        mock_app.start = AsyncMock()
+        mock_app.updater.start_polling = AsyncMock()
+        
+        options = {"admission": {"user_per_minute": 20, "shed": "busy"}}
+        asyncio.run(bot.run_bot('test_token', WEBHOOK_URL, "Test Bot", options=options))
+        
+        processor = builder.concurrent_updates.call_args[0][0]
+        self.assertIsInstance(processor, bot.AdmissionUpdateProcessor)
+        self.assertEqual(processor.max_concurrent_updates, 1)
+        self.assertEqual(processor.controller.policy.shed, "busy")
+
+
+    @patch('bot.Application')
+    def test_run_bot_handler_options(self, mock_application_class):
+        """Test that per-bot options select handlers and the welcome message"""
+        mock_app = Mock()
+        mock_application_class.builder.return_value.token.return_value.get_updates_request.return_value.build.return_value = mock_app
+        mock_app.initialize = AsyncMock()
+        mock_app.start = AsyncMock()
+        mock_app.updater.start_polling = AsyncMock()
+        
+        options = {"handlers": ["start", "document"], "welcome_message": "Hi there"}
+        asyncio.run(bot.run_bot('test_token', WEBHOOK_URL, "Test Bot", options=options))
+        
+        self.assertEqual(mock_app.add_handler.call_count, 2)
+
+    @patch('bot.run_bot', new_callable=AsyncMock)
+    def test_start_bots_concurrently(self, mock_run_bot):
+        """Test that every configured bot is started and failures don't stop the others"""
+        configs = [BotConfig(f"Bot {i}", f"token{i}", WEBHOOK_URL) for i in range(3)]
+        mock_run_bot.side_effect = ["app0", ValueError("bad token"), "app2"]
+        
+        applications = asyncio.run(bot.start_bots(configs))
+        
+        self.assertEqual(applications, {"Bot 0": "app0", "Bot 2": "app2"})
+        self.assertEqual(mock_run_bot.call_count, 3)
 
 
 def run_tests():
@@ -247,6 +377,8 @@ def run_tests():
     # Set environment variables for testing
     os.environ['TELEGRAM_BOT_TOKEN'] = 'test_token_123'
     os.environ['N8N_WEBHOOK_URL'] = 'http://localhost:5678/webhook/test'
+    os.environ['TELEGRAM_BOT_TOKEN_TVO'] = 'test_token_456'
+    os.environ['N8N_WEBHOOK_URL_TVO'] = 'http://localhost:5678/webhook/tvo'
     
     # Create test suite
     loader = unittest.TestLoader()
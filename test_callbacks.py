@@ -0,0 +1,108 @@
+import json
+import socket
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+
+import httpx
+
+import bot
+from callbacks import CallbackRegistry, CALLBACK_PATH
+from events import MessageEvent
+from http_server import Request
+
+
+def make_event(chat_id=55, message_id=9):
+    event = MessageEvent()
+    event.message_id = message_id
+    event.text = "long job"
+    event.chat_id = chat_id
+    event.user_id = 1
+    event.username = event.first_name = event.last_name = None
+    event.timestamp = "2025-10-18T12:00:00+00:00"
+    return event
+
+
+def callback_request(correlation_id, reply="Done", token=''):
+    body = json.dumps({"correlation_id": correlation_id, "reply": reply}).encode()
+    return Request('POST', CALLBACK_PATH, {}, {'x-callback-token': token}, body)
+
+
+class TestCallbackRegistry(unittest.TestCase):
+    def test_reply_delivered_once_with_valid_token(self):
+        """Test that a callback with the right token delivers the reply to the original message, once"""
+        on_reply = AsyncMock()
+        registry = CallbackRegistry(on_reply)
+        registry.callback_url = 'http://bot:8444' + CALLBACK_PATH
+        payload = registry.attach(make_event(), bot_id=7)
+        self.assertEqual((payload['text'], payload['callback_url']), ("long job", 'http://bot:8444/n8n/reply'))
+        correlation_id, token = payload['correlation_id'], payload['callback_token']
+
+        async def run_test():
+            bad = await registry.handle_callback(callback_request(correlation_id, token='guess'))
+            good = await registry.handle_callback(callback_request(correlation_id, token=token))
+            again = await registry.handle_callback(callback_request(correlation_id, token=token))
+            malformed = await registry.handle_callback(Request('POST', CALLBACK_PATH, {}, {}, b'{"reply": 1}'))
+            return bad.status, good.status, again.status, malformed.status
+
+        self.assertEqual(asyncio.run(run_test()), (403, 200, 404, 400))
+        on_reply.assert_awaited_once_with(7, {'chat_id': 55, 'message_id': 9}, {'reply': "Done"})
+
+    def test_correlations_expire(self):
+        """Test that correlations are forgotten after the ttl and beyond the pending limit"""
+        registry = CallbackRegistry(AsyncMock(), ttl=0.05, max_pending=2)
+        first = registry.attach({'chat_id': 1, 'message_id': 1}, bot_id=7)
+        registry.attach({'chat_id': 2, 'message_id': 2}, bot_id=7)
+        registry.attach({'chat_id': 3, 'message_id': 3}, bot_id=7)
+        self.assertEqual((len(registry), registry.expired), (2, 1))
+
+        async def run_test():
+            await asyncio.sleep(0.1)
+            return await registry.handle_callback(callback_request(first['correlation_id'], token=first['callback_token']))
+
+        self.assertEqual(asyncio.run(run_test()).status, 404)
+        self.assertEqual((len(registry), registry.expired), (0, 3))
+
+
+class TestAsyncReplyBot(unittest.TestCase):
+    def test_event_posted_with_correlation_and_reply_delivered(self):
+        """Test the round trip: the event carries a callback, n8n posts the reply and the bot sends it"""
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        telegram_bot = Mock(id=4242)
+        telegram_bot.send_message = AsyncMock()
+        posted = []
+
+        async def fake_request(webhook_url, data, headers=None):
+            posted.append(data)
+            return {"status": "accepted"}
+
+        async def run_test():
+            await bot.start_services(metrics_port=0, callback_port=port)
+            bot.async_reply_bots.add(telegram_bot.id)
+            bot.replay_bots[telegram_bot.id] = telegram_bot
+            try:
+                with patch.object(bot.resilient_client, 'request', side_effect=fake_request):
+                    response = await bot.send_to_n8n(make_event(), 'http://n8n/hook', telegram_bot)
+                self.assertEqual(response, {"status": "accepted"})
+                payload = posted[0]
+                async with httpx.AsyncClient() as client:
+                    callback = await client.post(payload['callback_url'], headers={
+                        'X-Callback-Token': payload['callback_token']
+                    }, json={"correlation_id": payload['correlation_id'], "reply": "Report ready"})
+                return payload, callback.status_code
+            finally:
+                bot.async_reply_bots.discard(telegram_bot.id)
+                del bot.replay_bots[telegram_bot.id]
+                await bot.stop_services(None)
+
+        payload, status = asyncio.run(run_test())
+        self.assertEqual(payload['callback_url'], f'http://127.0.0.1:{port}/n8n/reply')
+        self.assertEqual(status, 200)
+        telegram_bot.send_message.assert_awaited_once_with(chat_id=55, text="Report ready", reply_to_message_id=9)
+        self.assertEqual(len(bot.callback_registry), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+
+import bot
+from chat_context import ChatContext, reply_entry
+from events import MessageEvent
+
+
+def make_event(text, message_id=1, chat_id=1):
+    event = MessageEvent()
+    event.message_id = message_id
+    event.chat_id = chat_id
+    event.user_id = 7
+    event.username = event.first_name = event.last_name = None
+    event.timestamp = "2025-10-18T12:00:00+00:00"
+    event.text = text
+    return event
+
+
+class TestChatContext(unittest.TestCase):
+    def test_context_is_history_before_the_message(self):
+        """Test that each payload carries the chat's earlier entries, at most size of them"""
+        context = ChatContext()
+
+        async def run_test():
+            payloads = []
+            for i in range(4):
+                payloads.append(await context.attach(make_event(f"m{i}", message_id=i), (1, 1), 3))
+                await context.add((1, 1), 3, reply_entry(f"r{i}"))
+            other = await context.attach(make_event("elsewhere", chat_id=2), (1, 2), 3)
+            return payloads, other
+
+        payloads, other = asyncio.run(run_test())
+        self.assertEqual(payloads[0]['context'], [])
+        self.assertEqual(payloads[0]['text'], "m0")
+        self.assertEqual([entry['text'] for entry in payloads[1]['context']], ["m0", "r0"])
+        self.assertEqual([entry['text'] for entry in payloads[3]['context']], ["r1", "m2", "r2"])
+        self.assertEqual([entry['role'] for entry in payloads[3]['context']], ['bot', 'user', 'bot'])
+        self.assertEqual(other['context'], [])
+
+    def test_idle_chats_evicted_past_the_cap(self):
+        """Test that the chats used least recently are dropped once the memory cap is passed"""
+        context = ChatContext(max_bytes=4000)
+
+        async def run_test():
+            for chat_id in (1, 2, 3):
+                await context.add((1, chat_id), 5, reply_entry("x" * 200))
+            # Chat 1 is used again, so chat 2 is now the idlest
+            await context.recent((1, 1), 5)
+            await context.add((1, 4), 5, reply_entry("x" * 200))
+            size, kept = context.size, sorted(context._chats)
+            return size, kept, await context.recent((1, 2), 5)
+
+        size, kept, forgotten = asyncio.run(run_test())
+        self.assertLessEqual(size, 4000)
+        self.assertEqual(kept, [(1, 1), (1, 3), (1, 4)])
+        self.assertEqual(forgotten, [])
+        self.assertEqual(context.evictions, 1)
+
+    def test_evicted_chats_spill_to_disk(self):
+        """Test that evicted chats and those left at close are loaded again from the spill file"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'context.db')
+
+        async def run_test():
+            context = ChatContext(max_bytes=2000, path=path)
+            await context.open()
+            await context.add((1, 1), 5, reply_entry("first"))
+            await context.add((1, 2), 5, reply_entry("second"))
+            await context.add((1, 3), 5, reply_entry("third"))
+            evicted = (1, 1) not in context._chats
+            reloaded = await context.recent((1, 1), 5)
+            await context.close()
+
+            restarted = ChatContext(max_bytes=2000, path=path)
+            await restarted.open()
+            try:
+                return evicted, reloaded, await restarted.recent((1, 3), 5)
+            finally:
+                await restarted.close()
+
+        evicted, reloaded, after_restart = asyncio.run(run_test())
+        self.assertTrue(evicted)
+        self.assertEqual([entry['text'] for entry in reloaded], ["first"])
+        self.assertEqual([entry['text'] for entry in after_restart], ["third"])
+
+
+class TestBotChatContext(unittest.TestCase):
+    def test_payload_has_context_and_replies_are_remembered(self):
+        """Test that a bot with a context window sends the chat's history and records n8n's replies"""
+        telegram_bot = Mock(id=6161)
+        update = Mock()
+        update.message.chat_id = 1
+        update.message.reply_text = AsyncMock()
+        context = Mock(bot=telegram_bot)
+        sent = []
+
+        async def fake_request(webhook_url, data, headers=None):
+            sent.append(data)
+            return {"reply": f"echo {data['text']}"}
+
+        async def run_test():
+            bot.chat_context_sizes[telegram_bot.id] = 10
+            try:
+                with patch.object(bot.resilient_client, 'request', side_effect=fake_request):
+                    for text in ("hello", "again"):
+                        response = await bot.send_to_n8n(make_event(text), 'http://n8n/main', telegram_bot)
+                        await bot.reply_or_react(update, context, response)
+                    # Bots without a window send the event as it is
+                    await bot.send_to_n8n(make_event("plain"), 'http://n8n/main', Mock(id=1))
+            finally:
+                del bot.chat_context_sizes[telegram_bot.id]
+
+        with patch('bot.chat_context', ChatContext()):
+            asyncio.run(run_test())
+        self.assertEqual(sent[0]['context'], [])
+        self.assertEqual([(entry['role'], entry['text']) for entry in sent[1]['context']],
+                         [('user', "hello"), ('bot', "echo hello")])
+        self.assertNotIn('context', sent[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
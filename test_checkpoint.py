@@ -0,0 +1,225 @@
+import os
+import signal
+import tempfile
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+
+from telegram import Update
+from telegram.ext import SimpleUpdateProcessor
+
+import bot
+from admission import AdmissionController, AdmissionPolicy, AdmissionUpdateProcessor
+from coalescer import KeyedCoalescer
+from checkpoint import (
+    RecentIds, UpdateCheckpoint, CheckpointedUpdateQueue, CheckpointUpdateProcessor, bot_id_for, defer_done
+)
+
+
+def make_update(update_id, chat_id=1):
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 1760788800, "text": f"message {update_id}",
+        "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "U"},
+    }}, None)
+
+
+class TestRecentIds(unittest.TestCase):
+    def test_ring_is_bounded(self):
+        """Test that the ring keeps the last ids and treats anything older as seen"""
+        recent = RecentIds(3, [10, 12, 11])
+        recent.add(14)
+        self.assertEqual(len(recent), 3)
+        self.assertEqual(recent.floor, 10)
+        self.assertIn(9, recent)
+        self.assertIn(11, recent)
+        self.assertNotIn(13, recent)
+        self.assertNotIn(0, RecentIds(3))
+
+    def test_much_lower_ids_are_new(self):
+        """Test that ids far below the floor, as after Telegram restarts a bot's numbering, are not seen"""
+        recent = RecentIds(4, range(1000, 1010))
+        self.assertIn(1003, recent)
+        self.assertNotIn(500, recent)
+        for update_id in range(500, 505):
+            recent.add(update_id)
+        # The old ids have left the ring, and the floor follows the new ones
+        self.assertEqual(recent.floor, 500)
+        self.assertIn(500, recent)
+        self.assertNotIn(1009, recent)
+
+
+class TestUpdateCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'updates.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unfinished_updates_survive_restart(self):
+        """Test that a restart replays unfinished updates and drops redeliveries of every known update"""
+        async def first_run():
+            checkpoint = UpdateCheckpoint(self.path)
+            await checkpoint.open()
+            await checkpoint.load('42')
+            for update_id in (1, 2, 3):
+                self.assertTrue(await checkpoint.received('42', make_update(update_id)))
+            self.assertFalse(await checkpoint.received('42', make_update(2)))
+            await checkpoint.done('42', 1)
+            await checkpoint.done('42', 3)
+            await checkpoint.close()
+
+        async def second_run():
+            checkpoint = UpdateCheckpoint(self.path)
+            await checkpoint.open()
+            unfinished = await checkpoint.load('42')
+            redelivered = [await checkpoint.received('42', make_update(i)) for i in (1, 2, 3, 4)]
+            other_bot = await checkpoint.received('43', make_update(1))
+            result = unfinished, redelivered, other_bot, checkpoint.checkpoint('42')
+            await checkpoint.close()
+            return result
+
+        asyncio.run(first_run())
+        unfinished, redelivered, other_bot, last = asyncio.run(second_run())
+        self.assertEqual([payload['update_id'] for payload in unfinished], [2])
+        self.assertEqual(unfinished[0]['message']['text'], "message 2")
+        self.assertEqual(redelivered, [False, False, False, True])
+        self.assertTrue(other_bot)
+        self.assertEqual(last, 3)
+
+    def test_restarted_numbering_accepted(self):
+        """Test that updates with ids far below the checkpoint are handled and become the new checkpoint"""
+        async def run_test():
+            checkpoint = UpdateCheckpoint(self.path, dedup_size=4)
+            await checkpoint.open()
+            await checkpoint.load('42')
+            for update_id in range(1000, 1010):
+                await checkpoint.received('42', make_update(update_id))
+                await checkpoint.done('42', update_id)
+            accepted = [await checkpoint.received('42', make_update(update_id)) for update_id in (500, 501)]
+            for update_id in (500, 501):
+                await checkpoint.done('42', update_id)
+            redelivered = await checkpoint.received('42', make_update(501))
+            await checkpoint.close()
+
+            restarted = UpdateCheckpoint(self.path, dedup_size=4)
+            await restarted.open()
+            await restarted.load('42')
+            result = accepted, redelivered, restarted.checkpoint('42'), await restarted.received('42', make_update(501))
+            await restarted.close()
+            return result
+
+        accepted, redelivered, last, after_restart = asyncio.run(run_test())
+        self.assertEqual(accepted, [True, True])
+        self.assertFalse(redelivered)
+        self.assertEqual(last, 501)
+        self.assertFalse(after_restart)
+
+    def test_processor_marks_handled_and_shed_updates_done(self):
+        """Test that updates are done once handled, and shed updates are done without being handled"""
+        handled = []
+
+        async def handle(update):
+            handled.append(update.update_id)
+
+        async def run_test():
+            checkpoint = UpdateCheckpoint(self.path, dedup_size=8)
+            await checkpoint.open()
+            await checkpoint.load('42')
+            queue = CheckpointedUpdateQueue(checkpoint, '42')
+            admission = AdmissionUpdateProcessor(
+                SimpleUpdateProcessor(1), AdmissionController(AdmissionPolicy(user_per_minute=1, user_burst=1))
+            )
+            processor = CheckpointUpdateProcessor(admission, checkpoint, '42')
+            for update_id in (5, 6, 5):
+                await queue.put(make_update(update_id))
+            while not queue.empty():
+                update = await queue.get()
+                await processor.process_update(update, handle(update))
+            unfinished = await checkpoint.load('42')
+            await checkpoint.close()
+            return unfinished, checkpoint.duplicates
+
+        unfinished, duplicates = asyncio.run(run_test())
+        self.assertEqual(handled, [5])
+        self.assertEqual((unfinished, duplicates), ([], 1))
+
+    def test_buffered_updates_done_after_flush(self):
+        """Test that updates a handler buffers stay in the journal until the buffer is flushed"""
+        collector = KeyedCoalescer(10)
+        flushed = []
+
+        async def on_flush(items):
+            flushed.extend(items)
+
+        async def handle(update):
+            defer_done(collector.add('album', update.update_id, 60, on_flush))
+
+        async def run_test():
+            checkpoint = UpdateCheckpoint(self.path)
+            await checkpoint.open()
+            await checkpoint.load('42')
+            processor = CheckpointUpdateProcessor(SimpleUpdateProcessor(1), checkpoint, '42')
+            for update_id in (7, 8):
+                update = make_update(update_id)
+                await checkpoint.received('42', update)
+                await processor.process_update(update, handle(update))
+            buffered = checkpoint.checkpoint('42')
+            await collector.aclose()
+            await processor.shutdown()
+            result = buffered, checkpoint.checkpoint('42'), await checkpoint.load('42')
+            await checkpoint.close()
+            return result
+
+        buffered, after_flush, unfinished = asyncio.run(run_test())
+        self.assertEqual(flushed, [7, 8])
+        self.assertEqual((buffered, after_flush, unfinished), (0, 8, []))
+
+    def test_bot_id_for(self):
+        self.assertEqual(bot_id_for('123456:ABC-def'), '123456')
+
+
+class TestCleanShutdown(unittest.TestCase):
+    @patch('bot.shutdown', new_callable=AsyncMock)
+    @patch('bot.start_bots', new_callable=AsyncMock)
+    @patch('bot.start_services', new_callable=AsyncMock)
+    def test_sigterm_shuts_down(self, mock_start_services, mock_start_bots, mock_shutdown):
+        """Test that SIGTERM ends main() through the regular shutdown"""
+        mock_start_services.return_value = (None, None)
+        mock_start_bots.return_value = {"Test Bot": Mock()}
+
+        async def run_test():
+            asyncio.get_running_loop().call_later(0.05, os.kill, os.getpid(), signal.SIGTERM)
+            await asyncio.wait_for(bot.main(bots=[Mock()]), 5)
+
+        asyncio.run(run_test())
+        mock_shutdown.assert_awaited_once_with({"Test Bot": mock_start_bots.return_value["Test Bot"]}, None)
+
+
+    @patch('bot.stop_services', new_callable=AsyncMock)
+    def test_updates_stop_before_buffers_flush(self, mock_stop_services):
+        """Test that shutdown stops receiving updates before flushing albums and bursts, then stops the bots"""
+        calls = []
+        application = Mock(running=True)
+        application.updater.running = True
+
+        def stopped(target, name):
+            target.running = False
+            calls.append(name)
+
+        application.updater.stop = AsyncMock(side_effect=lambda: stopped(application.updater, 'updater.stop'))
+        application.stop = AsyncMock(side_effect=lambda: stopped(application, 'application.stop'))
+        application.shutdown = AsyncMock(side_effect=lambda: calls.append('application.shutdown'))
+        album_close = AsyncMock(side_effect=lambda: calls.append('albums'))
+
+        async def stop_bot(application):
+            await bot.stop_receiving(application)
+            await application.shutdown()
+
+        with patch.object(bot.album_collector, 'aclose', album_close), patch('bot.stop_bot', side_effect=stop_bot):
+            asyncio.run(bot.shutdown({"Test Bot": application}, None))
+        self.assertEqual(calls, ['updater.stop', 'application.stop', 'albums', 'application.shutdown'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import asyncio
+from coalescer import KeyedCoalescer
+
+
+class TestKeyedCoalescer(unittest.TestCase):
+    def test_flushes_after_quiet_window_and_at_max_items(self):
+        """Test that items are handed over after the window, or at once when the key is full"""
+        flushed = []
+
+        async def on_flush(items):
+            flushed.append(items)
+
+        async def run_test():
+            coalescer = KeyedCoalescer(max_items=3)
+            coalescer.add('a', 1, 0.2, on_flush)
+            await asyncio.sleep(0.12)
+            coalescer.add('a', 2, 0.2, on_flush)
+            coalescer.add('b', 10, 0.2, on_flush)
+            # The window restarts with every item, so 'a' is still open here
+            await asyncio.sleep(0.12)
+            self.assertEqual(flushed, [])
+            coalescer.add('c', 20, 10, on_flush)
+            coalescer.add('c', 21, 10, on_flush)
+            coalescer.add('c', 22, 10, on_flush)
+            await asyncio.sleep(0.05)
+            coalescer.add('d', 30, 10, on_flush)
+            await coalescer.aclose()
+            return len(coalescer)
+
+        self.assertEqual(asyncio.run(run_test()), 0)
+        self.assertEqual(flushed, [[20, 21, 22], [1, 2], [10], [30]])
+
+    def test_callback_errors_are_contained(self):
+        """Test that a failing flush callback does not break the coalescer"""
+        async def broken(items):
+            raise RuntimeError("boom")
+
+        async def run_test():
+            coalescer = KeyedCoalescer(10)
+            coalescer.add('a', 1, 0, broken)
+            await coalescer.aclose()
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import asyncio
+from datetime import datetime
+from telegram import Update, Message, User, Chat
+from dispatch import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id, chat_id):
+    """Build a real text Update for the given chat"""
+    user = User(id=chat_id, first_name="Test", is_bot=False)
+    chat = Chat(id=chat_id, type="private")
+    message = Message(message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text="hi")
+    return Update(update_id=update_id, message=message)
+
+
+class TestChatOrderedUpdateProcessor(unittest.TestCase):
+    def test_same_chat_runs_in_order(self):
+        """Test that updates of one chat never overlap and keep arrival order"""
+        async def run_test():
+            processor = ChatOrderedUpdateProcessor(8)
+            events = []
+
+            async def work(update_id, delay):
+                events.append(("start", update_id))
+                await asyncio.sleep(delay)
+                events.append(("end", update_id))
+
+            # The first update is the slowest; a plain concurrent dispatcher would finish it last
+            delays = [0.03, 0.01, 0.0]
+            await asyncio.gather(*(
+                processor.process_update(make_update(i, 42), work(i, delay))
+                for i, delay in enumerate(delays)
+            ))
+            await asyncio.sleep(0.1)
+
+            self.assertEqual(events, [
+                ("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2),
+            ])
+            self.assertEqual(processor.busy_chats, 0)
+
+        asyncio.run(run_test())
+
+    def test_different_chats_run_concurrently(self):
+        """Test that a busy chat does not block other chats"""
+        async def run_test():
+            processor = ChatOrderedUpdateProcessor(4)
+            release = asyncio.Event()
+            finished = []
+
+            async def slow():
+                await release.wait()
+                finished.append("busy")
+
+            async def fast(name):
+                finished.append(name)
+
+            busy = [asyncio.create_task(processor.process_update(make_update(i, 1), slow()))
+                    for i in range(10)]
+            await asyncio.sleep(0)
+            await asyncio.wait_for(asyncio.gather(
+                processor.process_update(make_update(100, 2), fast("chat2")),
+                processor.process_update(make_update(101, 3), fast("chat3")),
+            ), timeout=1)
+
+            self.assertEqual(finished, ["chat2", "chat3"])
+            release.set()
+            await asyncio.gather(*busy)
+            await asyncio.sleep(0.05)
+            self.assertEqual(finished.count("busy"), 10)
+
+        asyncio.run(run_test())
+
+    def test_rejects_non_positive_limit(self):
+        """Test that the concurrency limit must be positive"""
+        with self.assertRaises(ValueError):
+            ChatOrderedUpdateProcessor(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import unittest
+from unittest.mock import patch
+from telegram import Update
+import events
+from events import CommandEvent, MessageEvent, MergedMessageEvent, PhotoEvent, DocumentEvent, encode
+
+
+def make_update(**message_fields):
+    message = {
+        "message_id": 7,
+        "date": 1760788800,
+        "chat": {"id": -100, "type": "group"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Zoë", "username": "zoe"},
+    }
+    message.update(message_fields)
+    return Update.de_json({"update_id": 1, "message": message}, None)
+
+
+def legacy_payload(update, kind):
+    """The dict the handlers built before the event model"""
+    user, message = update.effective_user, update.message
+    if kind == 'command':
+        return {"type": "command", "command": "start", "user_id": user.id, "username": user.username,
+                "first_name": user.first_name, "last_name": user.last_name,
+                "timestamp": message.date.isoformat()}
+    data = {"type": kind, "message_id": message.message_id}
+    if kind == 'message':
+        data["text"] = message.text
+    elif kind == 'photo':
+        data.update(photo_file_id=message.photo[-1].file_id, caption=message.caption)
+    elif kind == 'document':
+        data.update(document_file_id=message.document.file_id, document_name=message.document.file_name,
+                    document_mime_type=message.document.mime_type, caption=message.caption)
+    data.update(user_id=user.id, username=user.username, first_name=user.first_name,
+                last_name=user.last_name, chat_id=message.chat_id, timestamp=message.date.isoformat())
+    return data
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        photo = [
+            {"file_id": "small", "file_unique_id": "s", "width": 90, "height": 90},
+            {"file_id": "large", "file_unique_id": "l", "width": 1280, "height": 960},
+        ]
+        document = {"file_id": "doc", "file_unique_id": "d", "file_name": "ü.pdf", "mime_type": "application/pdf"}
+        updates = [
+            (make_update(text="/start"), 'command'),
+            (make_update(text='say "hi"\n'), 'message'),
+            (make_update(photo=photo), 'photo'),
+            (make_update(document=document, caption="scan"), 'document'),
+        ]
+        self.cases = []
+        for update, kind in updates:
+            if kind == 'command':
+                event = CommandEvent.from_update(update, "start")
+            else:
+                event = {'message': MessageEvent, 'photo': PhotoEvent, 'document': DocumentEvent}[kind].from_update(update)
+            self.cases.append((event, update, kind))
+
+    def test_fields_match_legacy_payloads(self):
+        """Test that every event has exactly the legacy field names, values and order"""
+        for event, update, kind in self.cases:
+            expected = legacy_payload(update, kind)
+            self.assertEqual(list(event.to_dict().items()), list(expected.items()))
+            self.assertEqual(event['type'], kind)
+            self.assertEqual(event.get('chat_id'), expected.get('chat_id'))
+            self.assertIsNone(event.get('missing'))
+            with self.assertRaises(KeyError):
+                event['missing']
+
+    def test_encoders_agree(self):
+        """Test that the slot writer, the json fallback and orjson produce the same bytes"""
+        for event, update, kind in self.cases:
+            expected = json.dumps(legacy_payload(update, kind), separators=(',', ':'), ensure_ascii=False).encode()
+            self.assertEqual(event.encode(), expected)
+            with patch.object(events, 'orjson', None):
+                self.assertEqual(encode(event), expected)
+                self.assertEqual(json.loads(encode([event, {"n": 1}])), [json.loads(expected), {"n": 1}])
+            if events.orjson is not None:
+                self.assertEqual(encode(event), expected)
+
+    def test_merged_message_event(self):
+        """Test that merged messages keep every message id and encode like the dict"""
+        parts = [MessageEvent.from_update(make_update(message_id=i, text=text)) for i, text in ((7, "a"), (8, "ü"))]
+        event = MergedMessageEvent.from_events(parts)
+        self.assertEqual((event['type'], event['message_id'], event['message_ids'], event['text']),
+                         ('message', 8, [7, 8], "a\nü"))
+        self.assertEqual(event.encode(), json.dumps(event.to_dict(), separators=(',', ':'), ensure_ascii=False).encode())
+
+    def test_events_have_no_instance_dict(self):
+        """Test that events are slotted"""
+        event = self.cases[1][0]
+        self.assertFalse(hasattr(event, '__dict__'))
+        with self.assertRaises(AttributeError):
+            event.extra = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
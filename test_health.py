@@ -0,0 +1,141 @@
+import time
+import socket
+import unittest
+import asyncio
+from unittest.mock import Mock, patch
+
+import httpx
+from telegram.request import HTTPXRequest
+
+import bot
+from health import LoopWatchdog, HealthChecks, PollingRequest
+from http_server import Request
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+class TestLoopWatchdog(unittest.TestCase):
+    def test_blocking_call_is_logged_with_its_stack(self):
+        """Test that a synchronous call blocking the loop is measured and its stack logged once"""
+        watchdog = LoopWatchdog(threshold=0.1, interval=0.02)
+
+        async def run_test():
+            watchdog.start()
+            await asyncio.sleep(0.1)
+            block_the_loop(0.4)
+            await asyncio.sleep(0.1)
+            await watchdog.stop()
+
+        with self.assertLogs('health', level='WARNING') as logs:
+            asyncio.run(run_test())
+        self.assertEqual(watchdog.stalls, 1)
+        self.assertGreaterEqual(watchdog.max_lag, 0.3)
+        self.assertIn('in block_the_loop', logs.output[0])
+        self.assertIn('time.sleep(seconds)', logs.output[0])
+        self.assertFalse(watchdog.running)
+
+    def test_disabled_with_zero_threshold(self):
+        async def run_test():
+            watchdog = LoopWatchdog(threshold=0)
+            watchdog.start()
+            running = watchdog.running
+            await watchdog.stop()
+            return running
+
+        self.assertFalse(asyncio.run(run_test()))
+
+
+class TestHealthChecks(unittest.TestCase):
+    def setUp(self):
+        self.watchdog = Mock(running=True, current_lag=0.01, max_lag=0.2, stalls=0)
+        self.n8n_client = Mock()
+        self.n8n_client.reachable.return_value = True
+        self.checks = HealthChecks(self.watchdog, self.n8n_client, max_lag=1, max_poll_age=30)
+
+    def test_readiness(self):
+        """Test that readiness needs running bots with fresh polls and reachable webhooks"""
+        self.assertEqual(self.checks.readiness()[0], False)
+
+        polling = Mock(last_answer=None)
+        self.checks.add_bot("Polling Bot", Mock(running=True), ['http://n8n/a'], polling)
+        self.checks.add_bot("Webhook Bot", Mock(running=True), ['http://n8n/b'])
+        ready, details = self.checks.readiness()
+        self.assertFalse(ready)
+        self.assertEqual(details['bots'], {"Polling Bot": ["no getUpdates answer yet"], "Webhook Bot": 'ok'})
+
+        polling.last_answer = time.monotonic()
+        self.assertTrue(self.checks.readiness()[0])
+
+        polling.last_answer = time.monotonic() - 45
+        self.n8n_client.reachable.side_effect = lambda url: url != 'http://n8n/b'
+        ready, details = self.checks.readiness()
+        self.assertFalse(ready)
+        self.assertEqual(details['bots'], {
+            "Polling Bot": ["no getUpdates answer for 45s"], "Webhook Bot": ["n8n circuit open for http://n8n/b"],
+        })
+
+        self.checks.remove_bot("Polling Bot")
+        self.n8n_client.reachable.side_effect = None
+        self.assertTrue(self.checks.readiness()[0])
+
+    def test_liveness_fails_when_loop_lags(self):
+        self.assertTrue(self.checks.liveness()[0])
+        self.checks.add_bot("Webhook Bot", Mock(running=True), [])
+        self.watchdog.current_lag = 2.5
+        healthy, details = self.checks.liveness()
+        self.assertFalse(healthy)
+        self.assertEqual(details['loop_lag_ms'], 2500.0)
+        self.assertFalse(self.checks.readiness()[0])
+
+        response = asyncio.run(self.checks.handle_readyz(Request('GET', '/readyz', {}, {}, b'')))
+        self.assertEqual((response.status, response.content_type), (503, 'application/json'))
+
+
+class TestPollingRequest(unittest.TestCase):
+    @patch.object(HTTPXRequest, 'do_request')
+    def test_only_successful_answers_count(self, mock_do_request):
+        async def run_test():
+            request = PollingRequest(connection_pool_size=1)
+            mock_do_request.return_value = (409, b'{"ok": false}')
+            await request.do_request('https://api.telegram.org/bot1/getUpdates', 'POST')
+            conflicted = request.last_answer
+            mock_do_request.return_value = (200, b'{"ok": true, "result": []}')
+            await request.do_request('https://api.telegram.org/bot1/getUpdates', 'POST')
+            return conflicted, request.last_answer
+
+        conflicted, answered = asyncio.run(run_test())
+        self.assertIsNone(conflicted)
+        self.assertIsNotNone(answered)
+
+
+class TestHealthEndpoints(unittest.TestCase):
+    def test_endpoints_served(self):
+        """Test that /healthz and /readyz are served on the health port"""
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+
+        async def run_test():
+            await bot.start_services(metrics_port=0, callback_port=0, health_port=port)
+            try:
+                async with httpx.AsyncClient() as client:
+                    healthz = await client.get(f'http://127.0.0.1:{port}/healthz')
+                    readyz = await client.get(f'http://127.0.0.1:{port}/readyz')
+                return healthz, readyz, bot.watchdog.running
+            finally:
+                await bot.stop_services(None)
+
+        with patch.dict(bot.health_checks._bots, clear=True):
+            healthz, readyz, watching = asyncio.run(run_test())
+        self.assertEqual(healthz.status_code, 200)
+        self.assertEqual(healthz.json()['status'], 'ok')
+        self.assertEqual(readyz.status_code, 503)
+        self.assertEqual(readyz.json()['error'], "no bot is running")
+        self.assertTrue(watching)
+        self.assertFalse(bot.watchdog.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import asyncio
+import httpx
+from http_server import HttpServer, Response
+
+
+class TestHttpServer(unittest.TestCase):
+    def test_routes_and_errors(self):
+        """Test routing, unknown paths and wrong methods"""
+        async def echo(request):
+            return Response(200, request.body[::-1], headers={'X-Path': request.path})
+
+        async def broken(request):
+            raise RuntimeError("boom")
+
+        async def run_test():
+            server = HttpServer('127.0.0.1', 0)
+            server.add_route('POST', '/echo', echo)
+            server.add_route('GET', '/broken', broken)
+            await server.start()
+            base = f"http://127.0.0.1:{server.bound_port}"
+            try:
+                async with httpx.AsyncClient() as client:
+                    ok = await client.post(base + '/echo', content=b'abc')
+                    again = await client.post(base + '/echo', content=b'xyz')
+                    missing = await client.get(base + '/nope')
+                    wrong_method = await client.get(base + '/echo')
+                    failed = await client.get(base + '/broken')
+            finally:
+                await server.stop()
+            return ok, again, missing, wrong_method, failed
+
+        ok, again, missing, wrong_method, failed = asyncio.run(run_test())
+        self.assertEqual((ok.status_code, ok.content), (200, b'cba'))
+        self.assertEqual(ok.headers['x-path'], '/echo')
+        self.assertEqual(again.content, b'zyx')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(wrong_method.status_code, 405)
+        self.assertEqual(failed.status_code, 500)
+
+    def test_chunked_and_oversized_bodies(self):
+        """Test that chunked bodies are decoded and oversized ones rejected"""
+        async def length(request):
+            return Response(200, str(len(request.body)))
+
+        async def chunks():
+            yield b'hello '
+            yield b'world'
+
+        async def run_test():
+            server = HttpServer('127.0.0.1', 0, max_body_size=16)
+            server.add_route('POST', '/len', length)
+            await server.start()
+            base = f"http://127.0.0.1:{server.bound_port}"
+            try:
+                async with httpx.AsyncClient() as client:
+                    chunked = await client.post(base + '/len', content=chunks())
+                    too_big = await client.post(base + '/len', content=b'x' * 17)
+            finally:
+                await server.stop()
+            return chunked, too_big
+
+        chunked, too_big = asyncio.run(run_test())
+        self.assertEqual(chunked.text, '11')
+        self.assertEqual(too_big.status_code, 413)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import asyncio
+from email import policy
+from email.parser import BytesParser
+from types import SimpleNamespace
+from unittest.mock import Mock, AsyncMock, patch
+
+import bot
+from events import CommandEvent
+from http_server import HttpServer, Response
+from media_relay import MediaRelay, MediaRelayError, RelayPolicy
+from n8n_client import N8nClient
+from resilience import ResilientN8nClient
+
+FILE_BYTES = bytes(range(256)) * 1024  # 256 KB
+TOKEN = '123:SECRET'
+
+
+def parse_form(content_type, body):
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+    )
+    return {
+        part.get_param('name', header='content-disposition'): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+
+class TestMediaRelay(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.event = CommandEvent()
+        self.event.command = 'upload'
+        self.event.user_id = 42
+        self.event.username = 'zoe'
+        self.event.first_name = 'Zoë'
+        self.event.last_name = None
+        self.event.timestamp = '2025-10-18T12:00:00+00:00'
+
+    def run_relay(self, file_size=None, max_bytes=1024 * 1024, file_status=200):
+        async def serve_file(request):
+            return Response(file_status, FILE_BYTES if file_status == 200 else b'', content_type='image/jpeg')
+
+        async def n8n(request):
+            self.received.append(request)
+            return Response(200, b'{"reply": "got it"}', content_type='application/json')
+
+        async def run_test():
+            server = HttpServer('127.0.0.1', 0, max_body_size=4 * 1024 * 1024)
+            server.add_route('GET', f'/file/bot{TOKEN}/photos/a.jpg', serve_file)
+            server.add_route('POST', '/webhook', n8n)
+            await server.start()
+            base = f"http://127.0.0.1:{server.bound_port}"
+            telegram_bot = Mock()
+            telegram_bot.get_file = AsyncMock(return_value=SimpleNamespace(
+                file_path=f"{base}/file/bot{TOKEN}/photos/a.jpg", file_size=file_size))
+            client = N8nClient()
+            resilient = ResilientN8nClient(client, failure_threshold=1)
+            relay = MediaRelay(resilient, chunk_size=16 * 1024)
+            self.resilient = resilient
+            try:
+                return await relay.relay(telegram_bot, base + '/webhook', self.event, 'file-id',
+                                         'a "b".jpg', 'image/jpeg', max_bytes)
+            finally:
+                await relay.aclose()
+                await client.aclose()
+                await server.stop()
+
+        return asyncio.run(run_test())
+
+    def test_streams_fields_and_file(self):
+        """Test that event fields and the file arrive as a chunked multipart upload"""
+        response = self.run_relay(file_size=len(FILE_BYTES))
+        self.assertEqual(response, {"reply": "got it"})
+        request = self.received[0]
+        self.assertEqual(request.headers['transfer-encoding'], 'chunked')
+        form = parse_form(request.headers['content-type'], request.body)
+        self.assertEqual(form['type'][1], b'command')
+        self.assertEqual(form['user_id'][1], b'42')
+        self.assertEqual(form['first_name'][1], 'Zoë'.encode())
+        self.assertNotIn('last_name', form)
+        self.assertEqual(form['file'], ('a %22b%22.jpg', FILE_BYTES))
+        self.assertNotIn(TOKEN.encode(), request.body)
+
+    def test_declared_size_over_cap(self):
+        """Test that a file known to be too large is refused before n8n is called"""
+        with self.assertRaises(MediaRelayError):
+            self.run_relay(file_size=len(FILE_BYTES), max_bytes=1024)
+        self.assertEqual(self.received, [])
+
+    def test_streamed_size_over_cap(self):
+        """Test that a file without a declared size is cut off at the cap without tripping the breaker"""
+        with self.assertRaises(MediaRelayError):
+            self.run_relay(max_bytes=100 * 1024)
+        [webhook] = self.resilient.snapshot().values()
+        self.assertEqual((webhook['state'], webhook['failures']), ('closed', 0))
+
+    def test_download_failure_hides_token(self):
+        """Test that a failed download is reported without the tokenised file URL"""
+        with self.assertRaises(MediaRelayError) as cm:
+            self.run_relay(file_status=404)
+        self.assertNotIn(TOKEN, str(cm.exception))
+        self.assertEqual(self.received, [])
+
+
+class TestRelayPolicy(unittest.TestCase):
+    def test_policy(self):
+        """Test the size cap, MIME allow-list and option parsing"""
+        relay_policy = RelayPolicy.from_option({"max_bytes": 1000, "mime_types": ["image/*", "application/pdf"]})
+        self.assertTrue(relay_policy.allows(1000, 'image/png'))
+        self.assertTrue(relay_policy.allows(None, 'application/pdf'))
+        self.assertFalse(relay_policy.allows(1001, 'image/png'))
+        self.assertFalse(relay_policy.allows(10, 'application/zip'))
+        self.assertFalse(relay_policy.allows(10, None))
+        self.assertIsNone(RelayPolicy.from_option(False))
+        self.assertEqual(RelayPolicy.from_option(True).mime_types, RelayPolicy().mime_types)
+
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
+    def test_handler_falls_back_to_file_id(self, mock_send_to_n8n):
+        """Test that the document handler sends the plain event when relaying fails"""
+        mock_send_to_n8n.return_value = {"reply": "Document received"}
+        document = SimpleNamespace(file_id='doc', file_unique_id='d', file_name='a.pdf',
+                                   mime_type='application/pdf', file_size=10)
+        message = Mock(message_id=1, chat_id=2, caption=None, document=document)
+        message.reply_text = AsyncMock()
+        update = Mock(message=message)
+        update.effective_user = Mock(id=3, username='u', first_name='F', last_name='L')
+        context = Mock()
+
+        handler = bot.create_document_handler('http://n8n/hook', RelayPolicy())
+        with patch.object(bot.media_relay, 'relay', AsyncMock(side_effect=MediaRelayError("nope"))) as relay:
+            asyncio.run(handler(update, context))
+
+        relay.assert_called_once()
+        mock_send_to_n8n.assert_called_once()
+        self.assertEqual(mock_send_to_n8n.call_args[0][0]['document_file_id'], 'doc')
+        message.reply_text.assert_called_once_with("Document received")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import asyncio
+from unittest.mock import patch
+import httpx
+import bot
+import metrics
+from http_server import HttpServer
+from metrics import MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render_text_format(self):
+        """Test counters, gauges and cumulative histogram buckets in the Prometheus text format"""
+        registry = MetricsRegistry()
+        updates = registry.counter('updates_total', 'Updates', ('bot',))
+        depth = registry.gauge('depth', 'Depth')
+        latency = registry.histogram('latency_seconds', 'Latency', ('bot',), buckets=(0.1, 1.0))
+
+        updates.inc(bot='Primary Bot')
+        updates.inc(2, bot='Primary Bot')
+        depth.set_function(lambda: 7)
+        latency.observe(0.05, bot='TVO "Bot"')
+        latency.observe(0.5, bot='TVO "Bot"')
+        latency.observe(3, bot='TVO "Bot"')
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE updates_total counter', lines)
+        self.assertIn('updates_total{bot="Primary Bot"} 3', lines)
+        self.assertIn('depth 7', lines)
+        self.assertIn('latency_seconds_bucket{bot="TVO \\"Bot\\"",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{bot="TVO \\"Bot\\"",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{bot="TVO \\"Bot\\"",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{bot="TVO \\"Bot\\""} 3.55', lines)
+        self.assertIn('latency_seconds_count{bot="TVO \\"Bot\\""} 3', lines)
+
+    def test_failing_gauge_function_skipped(self):
+        """Test that a gauge callback that raises does not break the scrape"""
+        registry = MetricsRegistry()
+        pending = registry.gauge('pending', 'Pending', ('bot',))
+        pending.set_function(lambda: 1 / 0, bot='Primary Bot')
+        pending.set_function(lambda: 2, bot='TVO Bot')
+        lines = registry.render().splitlines()
+        self.assertIn('pending{bot="TVO Bot"} 2', lines)
+        self.assertFalse(any('Primary Bot' in line for line in lines))
+
+    def test_wrong_labels_rejected(self):
+        """Test that a series must carry exactly the declared labels"""
+        counter = MetricsRegistry().counter('c_total', 'C', ('bot', 'handler'))
+        with self.assertRaises(ValueError):
+            counter.inc(bot='Primary Bot')
+
+    def test_instrument_counts_and_labels(self):
+        """Test that instrumented handlers are counted, timed and expose their labels"""
+        seen = []
+
+        async def handler(update, context):
+            seen.append(metrics.current_labels.get())
+            if update == 'bad':
+                raise RuntimeError("boom")
+
+        wrapped = metrics.instrument(handler, 'Instrumented Bot', 'message')
+
+        async def run_test():
+            await wrapped('ok', None)
+            with self.assertRaises(RuntimeError):
+                await wrapped('bad', None)
+
+        asyncio.run(run_test())
+        self.assertEqual(seen, [('Instrumented Bot', 'message')] * 2)
+        key = ('Instrumented Bot', 'message')
+        self.assertEqual(metrics.UPDATES._values[key], 2)
+        self.assertEqual(metrics.UPDATE_ERRORS._values[key], 1)
+        self.assertEqual(sum(metrics.HANDLER_LATENCY._values[key][:-1]), 2)
+        self.assertEqual(metrics.IN_FLIGHT._values[('Instrumented Bot',)], 0)
+        self.assertEqual(metrics.current_labels.get(), ('', ''))
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics is served with the Prometheus content type"""
+        async def run_test():
+            server = HttpServer('127.0.0.1', 0)
+            server.add_route('GET', '/metrics', metrics.registry.handle)
+            await server.start()
+            try:
+                async with httpx.AsyncClient() as client:
+                    return await client.get(f"http://127.0.0.1:{server.bound_port}/metrics")
+            finally:
+                await server.stop()
+
+        response = asyncio.run(run_test())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE telegram_handler_duration_seconds histogram', response.text)
+
+
+    def test_reply_cache_exported(self):
+        """Test that the bot's reply cache hits and misses are read at scrape time"""
+        cache = bot.ReplyCache(60, 1024 * 1024)
+
+        async def run_test():
+            await bot.start_services(metrics_port=0, callback_port=0)
+            try:
+                cache.get('http://n8n/hook', "hello")
+                cache.put('http://n8n/hook', "hello", {"reply": "hi"})
+                cache.get('http://n8n/hook', "Hello")
+                return metrics.registry.render()
+            finally:
+                await bot.stop_services(None)
+
+        with patch('bot.reply_cache', cache):
+            text = asyncio.run(run_test())
+        self.assertIn('n8n_reply_cache{stat="hits"} 1', text)
+        self.assertIn('n8n_reply_cache{stat="misses"} 1', text)
+        self.assertIn('n8n_reply_cache{stat="entries"} 1', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import Mock, patch, AsyncMock
+import asyncio
+import httpx
+from n8n_client import N8nClient
+
+
+class TestN8nClient(unittest.TestCase):
+    def test_pool_shared_per_host(self):
+        """Test that webhooks on the same host reuse one connection pool"""
+        async def run_test():
+            client = N8nClient(pool_size=5, timeout=3, connect_timeout=1)
+            first = client._client_for("https://n8n.example.com/webhook/a")
+            second = client._client_for("https://n8n.example.com/webhook/b")
+            other = client._client_for("https://other.example.com/webhook/a")
+
+            self.assertIs(first, second)
+            self.assertIsNot(first, other)
+            self.assertEqual(first.timeout.read, 3)
+            self.assertEqual(first.timeout.connect, 1)
+
+            await client.aclose()
+            self.assertTrue(first.is_closed)
+
+        asyncio.run(run_test())
+
+    @patch('n8n_client.httpx.AsyncClient.post', new_callable=AsyncMock)
+    def test_post_empty_response(self, mock_post):
+        """Test that an empty n8n response is returned as None"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.content = b''
+        mock_post.return_value = mock_response
+
+        async def run_test():
+            client = N8nClient()
+            result = await client.post("http://localhost:5678/webhook/test", {"test": "data"})
+            await client.aclose()
+            return result
+
+        self.assertIsNone(asyncio.run(run_test()))
+
+    @patch('n8n_client.httpx.AsyncClient.post', new_callable=AsyncMock)
+    def test_post_timeout(self, mock_post):
+        """Test that a timed out n8n call is logged and returns None"""
+        mock_post.side_effect = httpx.ReadTimeout("timed out")
+
+        async def run_test():
+            client = N8nClient()
+            result = await client.post("http://localhost:5678/webhook/test", {"test": "data"})
+            await client.aclose()
+            return result
+
+        self.assertIsNone(asyncio.run(run_test()))
+
+
+    def stream(self, content_type, chunks):
+        """Stream a reply served as chunks with content_type; returns (final text, texts seen)"""
+        async def body():
+            for chunk in chunks:
+                yield chunk
+
+        def handler(request):
+            self.assertIn('application/x-ndjson', request.headers['accept'])
+            return httpx.Response(200, headers={'Content-Type': content_type}, content=body())
+
+        seen = []
+
+        async def on_text(text):
+            seen.append(text)
+
+        async def run_test():
+            client = N8nClient()
+            client._clients[('http', 'n8n')] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            try:
+                return await client.stream("http://n8n/webhook/chat", {"text": "hi"}, on_text)
+            finally:
+                await client.aclose()
+
+        return asyncio.run(run_test()), seen
+
+    def test_stream_ndjson(self):
+        """Test that n8n's NDJSON items are passed on as they arrive, split across chunks or not"""
+        text, seen = self.stream('application/x-ndjson', [
+            b'{"type":"begin","metadata":{}}\n{"type":"item","content":"Hel',
+            b'lo"}\n', b'{"type":"item","content":" there"}\n{"type":"end"}\n',
+        ])
+        self.assertEqual(text, "Hello there")
+        self.assertEqual(seen, ["Hello", "Hello there"])
+
+    def test_stream_plain_text_and_json(self):
+        """Test chunked text replies, and JSON bodies read whole"""
+        self.assertEqual(self.stream('text/plain; charset=utf-8', [b'Hi', b'', b' you']), ('Hi you', ['Hi', 'Hi you']))
+        self.assertEqual(self.stream('application/json', [b'{"reply": ', b'"Done"}']), ('Done', ['Done']))
+        self.assertEqual(self.stream('application/json', [b'{"status": "ok"}']), (None, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
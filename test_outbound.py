@@ -0,0 +1,150 @@
+import time
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+
+from telegram.error import RetryAfter
+
+import bot
+from outbound import OutboundScheduler, TokenBucket, REPLY, REACTION
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refill(self):
+        """Test that tokens are spent and come back at the configured rate"""
+        bucket = TokenBucket(rate=2, capacity=2, now=0)
+        bucket.take(0)
+        bucket.take(0)
+        self.assertAlmostEqual(bucket.wait_time(0), 0.5)
+        self.assertEqual(bucket.wait_time(0.5), 0)
+        self.assertFalse(bucket.full(0.5))
+        self.assertTrue(bucket.full(10))
+
+
+class TestOutboundScheduler(unittest.TestCase):
+    def test_chat_rate_and_priority(self):
+        """Test that one chat is limited to its rate and replies overtake queued reactions"""
+        sent = []
+
+        def call(name):
+            async def send():
+                sent.append((name, time.monotonic()))
+                return name
+            return send
+
+        async def run_test():
+            scheduler = OutboundScheduler(global_rate=100, chat_rate=10)
+            scheduler.submit(1, call('reaction-1'), REACTION)
+            scheduler.submit(1, call('reaction-2'), REACTION)
+            reply = scheduler.submit(1, call('reply'), REPLY)
+            self.assertEqual(await reply, 'reply')
+            await scheduler.aclose()
+
+        asyncio.run(run_test())
+        self.assertEqual([name for name, _ in sent], ['reply', 'reaction-1', 'reaction-2'])
+        gaps = [b[1] - a[1] for a, b in zip(sent, sent[1:])]
+        self.assertTrue(all(gap >= 0.08 for gap in gaps), gaps)
+
+    def test_chats_served_side_by_side(self):
+        """Test that a busy chat does not hold up other chats"""
+        async def run_test():
+            scheduler = OutboundScheduler(global_rate=100, chat_rate=1)
+            started = time.monotonic()
+            futures = [scheduler.submit(chat_id, AsyncMock(return_value=chat_id)) for chat_id in range(20)]
+            results = await asyncio.gather(*futures)
+            elapsed = time.monotonic() - started
+            await scheduler.aclose()
+            return results, elapsed
+
+        results, elapsed = asyncio.run(run_test())
+        self.assertEqual(results, list(range(20)))
+        self.assertLess(elapsed, 0.5)
+
+    def test_superseded_reaction_dropped(self):
+        """Test that a newer reaction replaces one that has not been sent yet"""
+        async def run_test():
+            scheduler = OutboundScheduler(global_rate=100, chat_rate=5)
+            blocker = AsyncMock()
+            old, new = AsyncMock(), AsyncMock(return_value='new')
+            scheduler.submit(-5, blocker, REACTION)
+            superseded = scheduler.submit(-5, old, REACTION, supersede=True)
+            latest = scheduler.submit(-5, new, REACTION, supersede=True)
+            self.assertIsNone(await superseded)
+            self.assertEqual(await latest, 'new')
+            await scheduler.aclose()
+            return scheduler, blocker, old
+
+        scheduler, blocker, old = asyncio.run(run_test())
+        blocker.assert_awaited_once()
+        old.assert_not_awaited()
+        self.assertEqual((scheduler.dropped, scheduler.pending), (1, 0))
+
+    def test_retry_after(self):
+        """Test that a 429 pauses the chat and the call is retried"""
+        send = AsyncMock(side_effect=[RetryAfter(0), 'ok'])
+        failing = AsyncMock(side_effect=RuntimeError("bad request"))
+
+        async def run_test():
+            scheduler = OutboundScheduler(global_rate=100, chat_rate=100)
+            result = await scheduler.submit(1, send)
+            with self.assertRaises(RuntimeError):
+                await scheduler.submit(2, failing)
+            await scheduler.aclose()
+            return result, scheduler.retried
+
+        self.assertEqual(asyncio.run(run_test()), ('ok', 1))
+        self.assertEqual(send.await_count, 2)
+
+
+class TestHandlerEnqueues(unittest.TestCase):
+    @patch('bot.send_to_n8n', new_callable=AsyncMock)
+    def test_handler_returns_before_reaction_is_sent(self, mock_send_to_n8n):
+        """Test that a rate-limited bot's handler queues its reaction and returns"""
+        mock_send_to_n8n.return_value = None
+        context = Mock()
+        context.bot.id = 99
+        context.bot.set_message_reaction = AsyncMock()
+        update = Mock()
+        update.message.chat_id = 5
+        update.message.message_id = 7
+        handler = bot.create_message_handler('http://n8n/hook')
+
+        async def run_test():
+            scheduler = OutboundScheduler()
+            bot.outbound_schedulers[99] = scheduler
+            try:
+                await handler(update, context)
+                context.bot.set_message_reaction.assert_not_called()
+                self.assertEqual(scheduler.pending, 1)
+                await scheduler.aclose()
+            finally:
+                del bot.outbound_schedulers[99]
+
+        asyncio.run(run_test())
+        context.bot.set_message_reaction.assert_called_once_with(chat_id=5, message_id=7, reaction="👍")
+
+    def test_busy_notice_survives_later_reaction(self):
+        """Test that a queued busy notice is still sent when a reaction is queued after it in the chat"""
+        telegram_bot = Mock(id=98)
+        notice, reaction = AsyncMock(return_value='notice'), AsyncMock(return_value='reaction')
+
+        async def run_test():
+            scheduler = OutboundScheduler(global_rate=100, chat_rate=100)
+            bot.outbound_schedulers[98] = scheduler
+            try:
+                scheduler.submit(5, AsyncMock(), REACTION)
+                busy = asyncio.ensure_future(bot.send_to_telegram(telegram_bot, 5, 'busy', notice, wait=True))
+                await asyncio.sleep(0)
+                await bot.send_to_telegram(telegram_bot, 5, 'reaction', reaction)
+                result = await busy
+                await scheduler.aclose()
+                return result, scheduler.dropped
+            finally:
+                del bot.outbound_schedulers[98]
+
+        self.assertEqual(asyncio.run(run_test()), ('notice', 0))
+        reaction.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, AsyncMock
+import asyncio
+import httpx
+from outbox import Outbox
+
+
+WEBHOOK_URL = 'http://localhost:5678/webhook/test'
+
+
+def connect_error():
+    return httpx.ConnectError("Connection refused")
+
+
+def status_error(status):
+    request = httpx.Request("POST", WEBHOOK_URL)
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'outbox.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_outbox(self, client, on_replayed=None):
+        return Outbox(self.path, client, on_replayed=on_replayed, base_delay=0.01, poll_interval=0.01)
+
+    def test_immediate_delivery(self):
+        """Test that a reachable n8n gets the event right away with an idempotency key"""
+        client = Mock()
+        client.request = AsyncMock(return_value={"reply": "hi"})
+
+        async def run_test():
+            outbox = self.make_outbox(client)
+            await outbox.open()
+            result = await outbox.send(WEBHOOK_URL, {"text": "hello"}, bot_id=7)
+            await outbox.stop()
+            return outbox, result
+
+        outbox, result = asyncio.run(run_test())
+        self.assertEqual(result, {"reply": "hi"})
+        self.assertEqual(outbox.depth, 0)
+        url, data, headers = client.request.call_args[0]
+        self.assertEqual((url, data), (WEBHOOK_URL, {"text": "hello"}))
+        self.assertIn('X-Idempotency-Key', headers)
+
+    def test_replay_after_restart(self):
+        """Test that events queued while n8n is down survive a restart and are sent once"""
+        down = Mock()
+        down.request = AsyncMock(side_effect=connect_error())
+        up = Mock()
+        up.request = AsyncMock(return_value={"reply": "late"})
+        replayed = AsyncMock()
+
+        async def run_test():
+            outbox = self.make_outbox(down)
+            await outbox.open()
+            first = await outbox.send(WEBHOOK_URL, {"n": 1}, bot_id=7)
+            second = await outbox.send(WEBHOOK_URL, {"n": 2}, bot_id=7)
+            await outbox.stop()
+            self.assertIsNone(first)
+            self.assertIsNone(second)
+            # The second event queues behind the first instead of hitting n8n again
+            self.assertEqual(down.request.call_count, 1)
+
+            restarted = self.make_outbox(up, on_replayed=replayed)
+            await restarted.open()
+            self.assertEqual(restarted.depth, 2)
+            restarted.start_replay()
+            for _ in range(100):
+                if restarted.depth == 0:
+                    break
+                await asyncio.sleep(0.01)
+            await restarted.stop()
+
+            again = self.make_outbox(up)
+            await again.open()
+            self.assertEqual(again.depth, 0)
+            await again.stop()
+
+        asyncio.run(run_test())
+        self.assertEqual([c[0][1] for c in up.request.call_args_list], [{"n": 1}, {"n": 2}])
+        replayed.assert_any_call(7, {"n": 1}, {"reply": "late"})
+        self.assertEqual(replayed.call_count, 2)
+
+    def test_rejected_event_is_dropped(self):
+        """Test that a 4xx response is not retried forever"""
+        client = Mock()
+        client.request = AsyncMock(side_effect=status_error(400))
+
+        async def run_test():
+            outbox = self.make_outbox(client)
+            await outbox.open()
+            result = await outbox.send(WEBHOOK_URL, {"bad": True})
+            await outbox.stop()
+            return outbox, result
+
+        outbox, result = asyncio.run(run_test())
+        self.assertIsNone(result)
+        self.assertEqual(outbox.depth, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import time
+import signal
+import tempfile
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+
+import bot
+from profiling import Profiler, ProfilerBusy, CPU, MEMORY
+
+
+def spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.directory.name, interval=0.005)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cpu_profile_is_folded_stacks(self):
+        """Test that a CPU profile counts the stacks of code blocking the loop, in folded format"""
+        async def run_test():
+            task = self.profiler.start(CPU, 0.3)
+            await asyncio.sleep(0.05)
+            spin(0.15)
+            return await task
+
+        path = asyncio.run(run_test())
+        self.assertTrue(os.path.basename(path).startswith('cpu-'))
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        stacks = {line.rsplit(' ', 1)[0]: int(line.rsplit(' ', 1)[1]) for line in lines}
+        spinning = [stack for stack in stacks if 'spin (' in stack]
+        self.assertTrue(spinning)
+        self.assertTrue(spinning[0].startswith('MainThread;'))
+        self.assertIn('run_test (', spinning[0])
+        self.assertGreater(sum(stacks[stack] for stack in spinning), 5)
+
+    def test_memory_report_lists_allocations(self):
+        """Test that a memory profile reports the lines that allocated during the run"""
+        held = []
+
+        async def run_test():
+            task = self.profiler.start(MEMORY, 0.2)
+            await asyncio.sleep(0.05)
+            held.extend(bytearray(1024) for _ in range(2000))
+            return await task
+
+        path = asyncio.run(run_test())
+        with open(path, encoding='utf-8') as f:
+            report = f.read()
+        self.assertIn("Top 25 allocation growth by line", report)
+        self.assertIn(f"{os.path.basename(__file__)}:", report.split("Top 25 allocations by line")[0])
+
+    def test_one_run_at_a_time(self):
+        """Test that a second profile is refused while one runs, and aclose() ends it early"""
+        async def run_test():
+            task = self.profiler.start(CPU, 30)
+            with self.assertRaises(ProfilerBusy):
+                self.profiler.start(MEMORY, 1)
+            with self.assertRaises(ValueError):
+                Profiler(self.directory.name).start('disk', 1)
+            started = time.monotonic()
+            await self.profiler.aclose()
+            return task.result(), time.monotonic() - started
+
+        path, elapsed = asyncio.run(run_test())
+        self.assertLess(elapsed, 5)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(self.profiler.busy)
+
+
+class TestProfileTriggers(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sigusr2_starts_memory_profile(self):
+        profiler = Profiler(self.directory.name)
+
+        async def run_test():
+            signals = bot.install_profile_signals()
+            try:
+                os.kill(os.getpid(), signal.SIGUSR2)
+                await asyncio.sleep(0.1)
+                busy = profiler.busy
+                await profiler.aclose()
+                return busy
+            finally:
+                loop = asyncio.get_running_loop()
+                for sig in signals:
+                    loop.remove_signal_handler(sig)
+
+        with patch('bot.profiler', profiler):
+            self.assertTrue(asyncio.run(run_test()))
+        [name] = os.listdir(self.directory.name)
+        self.assertTrue(name.startswith('memory-'))
+
+    def test_profile_command(self):
+        """Test that /profile starts a run and replies with the profile's path when it is written"""
+        update = Mock()
+        update.message.chat_id = 5
+        update.message.reply_text = AsyncMock()
+        context = Mock()
+        context.bot.id = 7171
+        context.args = ['cpu', '0.2']
+        tasks = []
+        context.application.create_task.side_effect = lambda coroutine, update=None: tasks.append(
+            asyncio.ensure_future(coroutine))
+
+        async def run_test():
+            await bot.create_profile_handler()(update, context)
+            await asyncio.gather(*tasks)
+            context.args = ['cpu', 'soon']
+            await bot.create_profile_handler()(update, context)
+
+        with patch('bot.profiler', Profiler(self.directory.name)):
+            asyncio.run(run_test())
+        replies = [call.args[0] for call in update.message.reply_text.call_args_list]
+        self.assertEqual(replies[0], "Profiling cpu for 0.2s...")
+        self.assertTrue(replies[1].startswith(f"Profile written to {self.directory.name}"))
+        self.assertTrue(replies[2].startswith("Cannot profile:"))
+
+    @patch('bot.Application')
+    def test_command_only_for_admins(self, mock_application_class):
+        mock_app = Mock()
+        mock_application_class.builder.return_value.token.return_value.get_updates_request.return_value \
+            .build.return_value = mock_app
+        mock_app.initialize = AsyncMock()
+        mock_app.start = AsyncMock()
+        mock_app.updater.start_polling = AsyncMock()
+
+        asyncio.run(bot.run_bot('test_token', 'http://n8n/hook', "Admin Bot", options={'profile_admins': [42]}))
+        handler = mock_app.add_handler.call_args_list[-1].args[0]
+        self.assertEqual(handler.commands, frozenset({'profile'}))
+        self.assertEqual(handler.filters.user_ids, frozenset({42}))
+        bot.health_checks.remove_bot("Admin Bot")
+
+
+if __name__ == '__main__':
+    unittest.main()
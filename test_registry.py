@@ -0,0 +1,74 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+from registry import load_bot_configs, parse_bot_configs, HANDLER_TYPES
+
+
+LEGACY_ENV = {
+    'TELEGRAM_BOT_TOKEN': 'token-primary',
+    'N8N_WEBHOOK_URL': 'http://localhost:5678/webhook/primary',
+    'TELEGRAM_BOT_TOKEN_TVO': 'token-tvo',
+    'N8N_WEBHOOK_URL_TVO': 'http://localhost:5678/webhook/tvo',
+}
+
+
+class TestRegistry(unittest.TestCase):
+    def test_legacy_environment(self):
+        """Test that without a config file the Primary and TVO bots come from the environment"""
+        with patch.dict(os.environ, LEGACY_ENV, clear=True):
+            bots = load_bot_configs()
+        self.assertEqual([b.name for b in bots], ["Primary Bot", "TVO Bot"])
+        self.assertEqual(bots[1].token, 'token-tvo')
+        self.assertEqual(bots[1].handlers, HANDLER_TYPES)
+
+    def test_legacy_environment_missing(self):
+        """Test that a missing legacy variable is reported by name"""
+        env = dict(LEGACY_ENV)
+        del env['N8N_WEBHOOK_URL_TVO']
+        with patch.dict(os.environ, env, clear=True):
+            with self.assertRaises(ValueError) as cm:
+                load_bot_configs()
+        self.assertIn("N8N_WEBHOOK_URL_TVO", str(cm.exception))
+
+    def test_config_file(self):
+        """Test loading any number of bots with defaults and per-bot options"""
+        config = {
+            "defaults": {"welcome_message": "hi"},
+            "bots": [
+                {"name": "A", "token_env": "TOKEN_A", "webhook_url": "http://n8n/a"},
+                {"name": "B", "token": "token-b", "webhook_url": "http://n8n/b",
+                 "welcome_message": "hello", "handlers": ["document"]},
+            ] + [{"name": f"T{i}", "token": f"t{i}", "webhook_url": "http://n8n/t"} for i in range(30)],
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'bots.json')
+            with open(path, 'w') as f:
+                json.dump(config, f)
+            with patch.dict(os.environ, {'TOKEN_A': 'token-a'}, clear=True):
+                bots = load_bot_configs(path)
+
+        self.assertEqual(len(bots), 32)
+        self.assertEqual(bots[0].token, 'token-a')
+        self.assertEqual(bots[0].options, {"welcome_message": "hi"})
+        self.assertEqual(bots[1].options["welcome_message"], "hello")
+        self.assertEqual(bots[1].handlers, ["document"])
+
+    def test_invalid_configs(self):
+        """Test that broken registries fail loudly at startup"""
+        with self.assertRaises(ValueError):
+            parse_bot_configs({"bots": []})
+        with self.assertRaises(ValueError):
+            parse_bot_configs({"bots": [{"name": "A", "token": "t"}]})
+        with self.assertRaises(ValueError):
+            parse_bot_configs({"bots": [
+                {"name": "A", "token": "t", "webhook_url": "u"},
+                {"name": "A", "token": "t2", "webhook_url": "u"},
+            ]})
+        with self.assertRaises(ValueError):
+            parse_bot_configs({"bots": [{"token": "t", "webhook_url": "u", "handlers": ["video"]}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import patch
+from reply_cache import ReplyCache
+
+
+WEBHOOK_URL = 'http://localhost:5678/webhook/test'
+
+
+class TestReplyCache(unittest.TestCase):
+    def test_hit_on_normalised_text(self):
+        """Test that case and whitespace differences hit the same entry"""
+        cache = ReplyCache(ttl=60)
+        self.assertIsNone(cache.get(WEBHOOK_URL, "Opening hours?"))
+        cache.put(WEBHOOK_URL, "Opening hours?", {"reply": "9 to 5"})
+
+        self.assertEqual(cache.get(WEBHOOK_URL, "  opening   HOURS? "), {"reply": "9 to 5"})
+        self.assertIsNone(cache.get('http://localhost:5678/webhook/other', "Opening hours?"))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_expiry_and_directives(self):
+        """Test the default TTL, cache_ttl overrides and no_cache"""
+        cache = ReplyCache(ttl=10)
+        with patch('reply_cache.time.monotonic', return_value=1000.0):
+            cache.put(WEBHOOK_URL, "a", {"reply": "default ttl"})
+            cache.put(WEBHOOK_URL, "b", {"reply": "long", "cache_ttl": 3600})
+            cache.put(WEBHOOK_URL, "c", {"reply": "never", "no_cache": True})
+            cache.put(WEBHOOK_URL, "d", {"reply": "never", "cache_ttl": 0})
+            cache.put(WEBHOOK_URL, "e", {"status": "no reply"})
+        self.assertEqual(len(cache), 2)
+
+        with patch('reply_cache.time.monotonic', return_value=1011.0):
+            self.assertIsNone(cache.get(WEBHOOK_URL, "a"))
+            self.assertEqual(cache.get(WEBHOOK_URL, "b")["reply"], "long")
+        self.assertEqual(len(cache), 1)
+
+    def test_lru_memory_bound(self):
+        """Test that the least recently used entries are evicted to stay under max_bytes"""
+        cache = ReplyCache(ttl=60, max_bytes=1500)
+        for i in range(5):
+            cache.put(WEBHOOK_URL, f"question {i}", {"reply": "x" * 100})
+            cache.get(WEBHOOK_URL, "question 0")
+
+        self.assertLessEqual(cache.size, 1500)
+        self.assertGreater(cache.evictions, 0)
+        self.assertIsNotNone(cache.get(WEBHOOK_URL, "question 0"))
+        self.assertIsNone(cache.get(WEBHOOK_URL, "question 1"))
+        self.assertEqual(cache.stats()["entries"], len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
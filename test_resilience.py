@@ -0,0 +1,167 @@
+import unittest
+from unittest.mock import Mock, AsyncMock, patch
+import asyncio
+import httpx
+import metrics
+from events import MessageEvent
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, ResilientN8nClient
+
+
+WEBHOOK_URL = 'http://localhost:5678/webhook/test'
+
+
+def status_error(status):
+    request = httpx.Request("POST", WEBHOOK_URL)
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_half_open_close(self):
+        """Test that the breaker opens at the threshold and one probe closes it again"""
+        breaker = CircuitBreaker(WEBHOOK_URL, failure_threshold=3, reset_timeout=30)
+        with patch('resilience.time.monotonic', return_value=100.0):
+            for _ in range(3):
+                self.assertTrue(breaker.allow())
+                breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+
+        with patch('resilience.time.monotonic', return_value=131.0):
+            self.assertTrue(breaker.allow())
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.rejected, 2)
+
+    def test_failed_probe_reopens(self):
+        """Test that a failed half-open probe opens the circuit again"""
+        breaker = CircuitBreaker(WEBHOOK_URL, failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+    def test_state_exported_per_webhook(self):
+        """Test that /metrics shows each webhook's circuit state and the requests it shed"""
+        url = 'http://localhost:5678/webhook/tenant-b'
+        breaker = CircuitBreaker(url, failure_threshold=1, reset_timeout=30)
+        text = metrics.registry.render()
+        self.assertIn(f'n8n_circuit_state{{webhook="{url}"}} 0', text)
+        breaker.record_failure()
+        breaker.allow()
+        text = metrics.registry.render()
+        self.assertIn(f'n8n_circuit_state{{webhook="{url}"}} 2', text)
+        self.assertIn(f'n8n_circuit_rejected_total{{webhook="{url}"}} 1', text)
+
+
+class TestResilientN8nClient(unittest.TestCase):
+    def test_fails_fast_when_open(self):
+        """Test that an open circuit raises without calling n8n and post() returns None"""
+        client = Mock()
+        client.request = AsyncMock(side_effect=httpx.ConnectError("down"))
+        resilient = ResilientN8nClient(client, failure_threshold=2, reset_timeout=60)
+
+        async def run_test():
+            for _ in range(2):
+                with self.assertRaises(httpx.ConnectError):
+                    await resilient.request(WEBHOOK_URL, {"type": "message"})
+            with self.assertRaises(CircuitOpenError):
+                await resilient.request(WEBHOOK_URL, {"type": "message"})
+            return await resilient.post(WEBHOOK_URL, {"type": "message"})
+
+        self.assertIsNone(asyncio.run(run_test()))
+        self.assertEqual(client.request.call_count, 2)
+        self.assertEqual(resilient.snapshot()[WEBHOOK_URL]['state'], 'open')
+
+    def test_rejections_do_not_open_circuit(self):
+        """Test that 4xx answers count as a healthy webhook"""
+        client = Mock()
+        client.request = AsyncMock(side_effect=status_error(400))
+        resilient = ResilientN8nClient(client, failure_threshold=1)
+
+        async def run_test():
+            for _ in range(3):
+                await resilient.post(WEBHOOK_URL, {"type": "message"})
+
+        asyncio.run(run_test())
+        self.assertEqual(client.request.call_count, 3)
+        self.assertEqual(resilient.snapshot()[WEBHOOK_URL]['state'], 'closed')
+
+    def test_adaptive_timeout(self):
+        """Test that the timeout follows p99 latency within its bounds"""
+        resilient = ResilientN8nClient(Mock(), min_timeout=1, max_timeout=10, timeout_multiplier=2)
+        self.assertEqual(resilient.timeout_for(WEBHOOK_URL), 10)
+        latency = resilient._state(WEBHOOK_URL).latency
+        for _ in range(100):
+            latency.record(0.2)
+        self.assertEqual(resilient.timeout_for(WEBHOOK_URL), 1)
+        for _ in range(100):
+            latency.record(2.0)
+        self.assertEqual(resilient.timeout_for(WEBHOOK_URL), 4.0)
+
+    def test_hedged_request(self):
+        """Test that a slow idempotent request is hedged and the fast copy wins"""
+        calls = []
+
+        async def request(webhook_url, data, headers=None, timeout=None):
+            calls.append(headers['X-Idempotency-Key'])
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+                return {"reply": "slow"}
+            return {"reply": "fast"}
+
+        client = Mock()
+        client.request = request
+        resilient = ResilientN8nClient(client, hedge_types={"command"})
+        latency = resilient._state(WEBHOOK_URL).latency
+        for _ in range(LatencyTracker().min_samples):
+            latency.record(0.01)
+
+        async def run_test():
+            command = await asyncio.wait_for(resilient.request(WEBHOOK_URL, {"type": "command"}), 0.5)
+            return command
+
+        self.assertEqual(asyncio.run(run_test()), {"reply": "fast"})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0], calls[1])
+        self.assertEqual(resilient.snapshot()[WEBHOOK_URL]['hedges'], 1)
+
+    def test_hedged_event(self):
+        """Test that the Event objects handlers send are hedged like dicts"""
+        calls = []
+
+        async def request(webhook_url, data, headers=None, timeout=None):
+            calls.append(data)
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+            return {"reply": f"copy {len(calls)}"}
+
+        client = Mock()
+        client.request = request
+        resilient = ResilientN8nClient(client, hedge_types={"message"})
+        latency = resilient._state(WEBHOOK_URL).latency
+        for _ in range(LatencyTracker().min_samples):
+            latency.record(0.01)
+        event = MessageEvent()
+        event.message_id = event.chat_id = event.user_id = 1
+        event.username = event.first_name = event.last_name = None
+        event.timestamp = "2025-10-18T12:00:00+00:00"
+        event.text = "hello"
+
+        response = asyncio.run(asyncio.wait_for(resilient.request(WEBHOOK_URL, event), 0.5))
+        self.assertEqual(response, {"reply": "copy 2"})
+        self.assertEqual(calls, [event, event])
+        self.assertTrue(resilient._hedgeable([event, event.to_dict()]))
+
+    def test_no_hedge_for_other_types(self):
+        """Test that event types not listed as idempotent are sent once"""
+        resilient = ResilientN8nClient(Mock(), hedge_types={"command"})
+        self.assertFalse(resilient._hedgeable({"type": "message"}))
+        self.assertTrue(resilient._hedgeable([{"type": "command"}, {"type": "command"}]))
+        self.assertFalse(resilient._hedgeable([{"type": "command"}, {"type": "photo"}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+import asyncio
+from unittest.mock import Mock, patch
+
+import httpx
+
+import bot
+from events import CommandEvent, MessageEvent, DocumentEvent
+from routing import Route, Router, fan_out, FIRST_REPLY, ALL_ACK
+
+ROUTES = [
+    {"name": "vip", "user_ids": [7], "webhook_url": "http://n8n/vip"},
+    {"name": "ingest", "types": ["document", "photo"], "webhook_url": "http://n8n/ingest"},
+    {"name": "control", "types": ["command"], "webhook_url": "http://n8n/control"},
+    {"name": "urgent", "chat_ids": [-100], "text": "urgent|asap", "ignore_case": True,
+     "webhook_urls": ["default", "http://n8n/pager"], "policy": "all_ack"},
+    {"name": "invoices", "types": ["message"], "text": "^invoice \\d+"},
+]
+
+
+def make_event(event_class=MessageEvent, chat_id=1, user_id=1, **fields):
+    event = event_class()
+    event.user_id = user_id
+    event.username = event.first_name = event.last_name = None
+    event.timestamp = "2025-10-18T12:00:00+00:00"
+    if event_class is not CommandEvent:
+        event.message_id = 1
+        event.chat_id = chat_id
+    for name, value in fields.items():
+        setattr(event, name, value)
+    return event
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router.from_option(ROUTES, 'http://n8n/main')
+
+    def route_name(self, event):
+        return self.router.match(event).name
+
+    def test_rules_match_in_order(self):
+        """Test routing by type, chat, user and text, with the first matching rule winning"""
+        document = dict(document_file_id='f', document_name='a.pdf', document_mime_type='application/pdf', caption=None)
+        self.assertEqual(self.route_name(make_event(DocumentEvent, **document)), 'ingest')
+        self.assertEqual(self.route_name(make_event(DocumentEvent, user_id=7, **document)), 'vip')
+        self.assertEqual(self.route_name(make_event(CommandEvent, command='start')), 'control')
+        self.assertEqual(self.route_name(make_event(chat_id=-100, text="this is URGENT")), 'urgent')
+        self.assertEqual(self.route_name(make_event(chat_id=-200, text="this is urgent")), 'default')
+        self.assertEqual(self.route_name(make_event(chat_id=-100, text="invoice 12")), 'invoices')
+        self.assertEqual(self.route_name(make_event(text="pay invoice 12")), 'default')
+
+    def test_destinations_and_policies(self):
+        urgent = self.router.match(make_event(chat_id=-100, text="asap"))
+        self.assertEqual(urgent.destinations, ('http://n8n/main', 'http://n8n/pager'))
+        self.assertEqual(urgent.policy, ALL_ACK)
+        self.assertEqual(self.router.default_route.destinations, ('http://n8n/main',))
+        self.assertEqual(self.router.default_route.policy, FIRST_REPLY)
+
+    def test_invalid_options(self):
+        self.assertIsNone(Router.from_option(None, 'http://n8n/main'))
+        self.assertIsNone(Router.from_option({"policy": "all_ack", "rules": []}, 'http://n8n/main'))
+        with self.assertRaises(ValueError):
+            Router.from_option([{"text": "("}], 'http://n8n/main')
+        with self.assertRaises(ValueError):
+            Router.from_option([{"types": ["message"], "policy": "any"}], 'http://n8n/main')
+
+
+class TestFanOut(unittest.TestCase):
+    def run_fan_out(self, policy, answers):
+        """Fan out to one destination per answer: (delay, response or exception)"""
+        route = Route('test', tuple(answers), policy)
+        background = set()
+        finished = []
+
+        async def send(url):
+            delay, answer = answers[url]
+            await asyncio.sleep(delay)
+            finished.append(url)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        async def run_test():
+            response = await fan_out(route, send, background)
+            finished_first = list(finished)
+            await asyncio.gather(*background)
+            return response, finished_first
+
+        return asyncio.run(run_test())
+
+    def test_first_reply_wins(self):
+        """Test that the first reply is returned while slower destinations still get the event"""
+        response, finished = self.run_fan_out(FIRST_REPLY, {
+            'a': (0, {"status": "ok"}),
+            'b': (0.01, httpx.ConnectError("down")),
+            'c': (0.02, {"reply": "from c"}),
+            'd': (0.2, {"reply": "from d"}),
+        })
+        self.assertEqual(response, {"reply": "from c"})
+        self.assertEqual(finished, ['a', 'b', 'c'])
+
+    def test_first_reply_without_reply(self):
+        response, _ = self.run_fan_out(FIRST_REPLY, {'a': (0.01, {"status": "ok"}), 'b': (0, None)})
+        self.assertEqual(response, {"status": "ok"})
+
+    def test_all_must_acknowledge(self):
+        """Test that all_ack returns the first reply in order only when every destination succeeded"""
+        response, finished = self.run_fan_out(ALL_ACK, {
+            'a': (0.02, {"status": "ok"}), 'b': (0.01, {"reply": "from b"}), 'c': (0, {"reply": "from c"}),
+        })
+        self.assertEqual(response, {"reply": "from b"})
+        self.assertEqual(sorted(finished), ['a', 'b', 'c'])
+        with self.assertLogs('routing', level='ERROR'):
+            response, _ = self.run_fan_out(ALL_ACK, {
+                'a': (0, {"reply": "from a"}), 'b': (0.01, httpx.ConnectError("down")),
+            })
+        self.assertIsNone(response)
+
+
+class TestRoutedBot(unittest.TestCase):
+    def test_send_to_n8n_uses_routes(self):
+        """Test that a bot with routes sends each event to the destinations its rules pick"""
+        telegram_bot = Mock(id=5151)
+        calls = []
+
+        async def fake_request(webhook_url, data, headers=None):
+            calls.append(webhook_url)
+            return {"reply": "paged"} if webhook_url.endswith('pager') else {"status": "ok"}
+
+        async def run_test():
+            bot.routers[telegram_bot.id] = Router.from_option(ROUTES, 'http://n8n/main')
+            try:
+                with patch.object(bot.resilient_client, 'request', side_effect=fake_request):
+                    urgent = await bot.send_to_n8n(make_event(chat_id=-100, text="asap"), 'http://n8n/main',
+                                                   telegram_bot)
+                    await bot.send_to_n8n(make_event(CommandEvent, command='help'), 'http://n8n/main', telegram_bot)
+                    await bot.send_to_n8n(make_event(text="hi"), 'http://n8n/main', telegram_bot)
+                    await bot.send_to_n8n(make_event(text="hi"), 'http://n8n/main', Mock(id=1))
+                return urgent
+            finally:
+                del bot.routers[telegram_bot.id]
+
+        self.assertEqual(asyncio.run(run_test()), {"reply": "paged"})
+        self.assertEqual(sorted(calls[:2]), ['http://n8n/main', 'http://n8n/pager'])
+        self.assertEqual(calls[2:], ['http://n8n/control', 'http://n8n/main', 'http://n8n/main'])
+
+
+if __name__ == '__main__':
+    unittest.main()
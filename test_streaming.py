@@ -0,0 +1,115 @@
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+
+from telegram.error import BadRequest
+
+import bot
+from streaming import StreamingReply
+
+
+def make_message(chat_id=5):
+    message = Mock(chat_id=chat_id, message_id=1, text="question")
+    sent = []
+
+    async def reply_text(text):
+        reply = Mock(text=text)
+        reply.edit_text = AsyncMock()
+        sent.append(reply)
+        return reply
+
+    message.reply_text = AsyncMock(side_effect=reply_text)
+    return message, sent
+
+
+class TestStreamingReply(unittest.TestCase):
+    def test_first_text_sent_then_edits_throttled(self):
+        """Test that the first text is sent at once and later text is edited in no faster than the interval"""
+        message, sent = make_message()
+
+        async def run_test():
+            reply = StreamingReply(message, interval=0.1)
+            for text in ("Hel", "Hello", "Hello th"):
+                await reply.update(text)
+            await asyncio.sleep(0.12)
+            await reply.update("Hello there")
+            await reply.update("Hello there!")
+            await reply.finish()
+            return reply
+
+        reply = asyncio.run(run_test())
+        self.assertTrue(reply.started)
+        message.reply_text.assert_called_once_with("Hel")
+        self.assertEqual([c.args[0] for c in sent[0].edit_text.call_args_list], ["Hello there", "Hello there!"])
+
+    def test_long_reply_continues_in_new_message(self):
+        """Test that text past Telegram's length limit goes into a second message"""
+        message, sent = make_message(chat_id=-100)
+
+        async def run_test():
+            reply = StreamingReply(message)
+            self.assertEqual(reply.interval, 3.0)
+            await reply.update("a" * 4000)
+            await reply.update("a" * 5000)
+            await reply.finish()
+
+        asyncio.run(run_test())
+        self.assertEqual([len(m.text) for m in sent], [4000, 904])
+        sent[0].edit_text.assert_called_once_with("a" * 4096)
+
+    def test_failed_edit_retried_at_finish(self):
+        """Test that a failed edit does not end the stream and is made up for at the end"""
+        message, sent = make_message()
+
+        async def run_test():
+            reply = StreamingReply(message, interval=0)
+            await reply.update("a")
+            sent[0].edit_text.side_effect = [BadRequest("flood"), None]
+            await reply.update("ab")
+            await reply.finish()
+
+        asyncio.run(run_test())
+        self.assertEqual(sent[0].edit_text.call_count, 2)
+
+
+class TestStreamingHandler(unittest.TestCase):
+    def test_message_handler_streams_reply(self):
+        """Test that a streaming bot replies with the first chunk and edits in the rest, without a reaction"""
+        message, sent = make_message()
+        update = Mock(message=message)
+        update.effective_user = Mock(id=3, username='u', first_name='F', last_name=None)
+        context = Mock()
+        context.bot.set_message_reaction = AsyncMock()
+
+        async def fake_stream(webhook_url, data, on_text, headers=None):
+            await on_text("Thinking")
+            await on_text("Thinking... done")
+            return "Thinking... done"
+
+        handler = bot.create_message_handler('http://n8n/hook', stream_replies=True)
+        with patch.object(bot.resilient_client, 'stream', side_effect=fake_stream) as stream:
+            asyncio.run(handler(update, context))
+
+        self.assertEqual(stream.call_args[0][1]['text'], "question")
+        message.reply_text.assert_called_once_with("Thinking")
+        sent[0].edit_text.assert_called_once_with("Thinking... done")
+        context.bot.set_message_reaction.assert_not_called()
+
+    def test_message_handler_reacts_without_streamed_reply(self):
+        """Test that a stream that fails before any text falls back to the reaction"""
+        message, sent = make_message()
+        update = Mock(message=message)
+        update.effective_user = Mock(id=3, username='u', first_name='F', last_name=None)
+        context = Mock()
+        context.bot.set_message_reaction = AsyncMock()
+
+        handler = bot.create_message_handler('http://n8n/hook', stream_replies=True)
+        with patch.object(bot.resilient_client, 'stream', AsyncMock(side_effect=bot.httpx.ReadTimeout("slow"))):
+            asyncio.run(handler(update, context))
+
+        message.reply_text.assert_not_called()
+        context.bot.set_message_reaction.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import time
+import pickle
+import unittest
+import asyncio
+from registry import BotConfig
+from unittest.mock import patch
+from supervisor import HashRing, Supervisor, assign_bots, configure_worker
+
+
+def make_bots(count, **options):
+    return [BotConfig(f"bot-{i}", f"token-{i}", "http://n8n/hook", dict(options)) for i in range(count)]
+
+
+def echo_worker(worker_id, bots, control, status, report_interval):
+    """Stand-in worker: reports load, acknowledges assignments and exits on stop"""
+    status.send({'worker': worker_id, 'pid': os.getpid(), 'bots': [b.name for b in bots]})
+    while True:
+        message = control.recv()
+        if message[0] == 'stop':
+            return
+        status.send({'worker': worker_id, 'assigned': sorted(b.name for b in message[1])})
+
+
+def crashing_worker(worker_id, bots, control, status, report_interval):
+    """Stand-in worker that dies right after starting"""
+    status.send({'worker': worker_id, 'pid': os.getpid()})
+    os._exit(3)
+
+
+async def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.05)
+
+
+class TestSharding(unittest.TestCase):
+    def test_consistent_hashing_moves_few_bots(self):
+        """Test that adding a worker moves only about 1/N of the bots"""
+        keys = [f"bot-{i}" for i in range(2000)]
+        before = HashRing(range(4))
+        after = HashRing(range(5))
+        moved = sum(before.node_for(k) != after.node_for(k) for k in keys)
+        self.assertLess(moved / len(keys), 0.3)
+        self.assertEqual({after.node_for(k) for k in keys}, set(range(5)))
+
+    def test_assign_bots_with_pin(self):
+        """Test that every bot is assigned once and the worker option pins a bot"""
+        bots = make_bots(20)
+        bots.append(BotConfig("pinned", "t", "http://n8n/hook", {"worker": 6}))
+        assignments = assign_bots(bots, 3)
+        names = sorted(b.name for group in assignments.values() for b in group)
+        self.assertEqual(names, sorted(b.name for b in bots))
+        self.assertIn("pinned", [b.name for b in assignments[0]])
+
+    def test_bot_config_is_picklable(self):
+        """Test that bot configs can be sent to worker processes"""
+        bot = pickle.loads(pickle.dumps(BotConfig("a", "t", "u", {"handlers": ["start"]})))
+        self.assertEqual((bot.name, bot.options), ("a", {"handlers": ["start"]}))
+
+
+    def test_workers_get_their_own_outbox(self):
+        """Test that each worker queues and replays events in an outbox file of its own"""
+        with patch.dict(os.environ, {'N8N_OUTBOX_PATH': '/data/outbox.db'}):
+            configure_worker(2)
+            self.assertEqual(os.environ['N8N_OUTBOX_PATH'], '/data/outbox.worker2.db')
+        with patch.dict(os.environ, {}, clear=True):
+            configure_worker(2)
+            self.assertNotIn('N8N_OUTBOX_PATH', os.environ)
+
+
+class TestSupervisor(unittest.TestCase):
+    def test_reports_rebalances_and_drains(self):
+        """Test that workers report load, grow without restarts, and drain on stop"""
+        async def run_test():
+            supervisor = Supervisor(make_bots(6), 2, drain_timeout=5, target=echo_worker)
+            task = asyncio.create_task(supervisor.run())
+            await wait_for(lambda: len(supervisor.load) == 2)
+            pids = {w.id: w.process.pid for w in supervisor.workers.values()}
+
+            await supervisor.rebalance(make_bots(6), 3)
+            await wait_for(lambda: len(supervisor.load) == 3)
+            # Existing workers kept running and were told their new bot set
+            for worker_id, pid in pids.items():
+                self.assertEqual(supervisor.workers[worker_id].process.pid, pid)
+            total = sum(len(w.bots) for w in supervisor.workers.values())
+            self.assertEqual(total, 6)
+
+            processes = [w.process for w in supervisor.workers.values()]
+            supervisor.stop()
+            await asyncio.wait_for(task, 10)
+            return processes
+
+        processes = asyncio.run(run_test())
+        self.assertTrue(all(p.exitcode == 0 for p in processes))
+
+    def test_restarts_crashed_worker(self):
+        """Test that a crashed worker is restarted with backoff"""
+        async def run_test():
+            supervisor = Supervisor(make_bots(2), 1, drain_timeout=1, target=crashing_worker,
+                                    base_backoff=0.05, max_backoff=0.2)
+            task = asyncio.create_task(supervisor.run())
+            await wait_for(lambda: supervisor.workers and supervisor.workers[0].failures >= 2)
+            supervisor.stop()
+            await asyncio.wait_for(task, 10)
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
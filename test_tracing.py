@@ -0,0 +1,142 @@
+import os
+import json
+import tempfile
+import unittest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+
+import bot
+import tracing
+from n8n_client import N8nClient
+from tracing import Tracer
+
+
+def read_spans(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def make_update(update_id=1, chat_id=55, text="hello"):
+    update = Mock(update_id=update_id)
+    update.effective_message.chat_id = chat_id
+    update.effective_user.id = 1
+    update.message.chat_id = chat_id
+    update.message.message_id = update_id
+    update.message.text = text
+    update.message.reply_text = AsyncMock()
+    return update
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'spans.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @patch('n8n_client.httpx.AsyncClient.post', new_callable=AsyncMock)
+    def test_update_spans_and_trace_header(self, mock_post):
+        """Test that an update gets a root span, stage spans under it, and its trace id reaches n8n"""
+        mock_post.return_value = Mock(status_code=200, content=b'{"reply": "hi"}')
+        tracer = Tracer(self.path)
+
+        async def handler(update, context):
+            with tracing.span('build_payload'):
+                data = {"text": update.message.text}
+            with tracing.span('n8n'):
+                await client.post("http://n8n/webhook", data)
+            with tracing.span('telegram.reply'):
+                raise RuntimeError("Telegram is down")
+
+        async def run_test():
+            callback = tracing.instrument(handler, tracer, "Test Bot", 'message')
+            with self.assertRaises(RuntimeError):
+                await callback(make_update(update_id=7), Mock())
+            await client.aclose()
+
+        client = N8nClient()
+        tracer.open()
+        asyncio.run(run_test())
+        tracer.close()
+
+        spans = {span['name']: span for span in read_spans(self.path)}
+        root = spans['update message']
+        self.assertEqual(set(spans), {'update message', 'build_payload', 'n8n', 'telegram.reply'})
+        self.assertIsNone(root['parent_span_id'])
+        self.assertEqual(root['attributes'], {'bot': "Test Bot", 'handler': 'message', 'update_id': 7, 'chat_id': 55})
+        self.assertEqual({span['trace_id'] for span in spans.values()}, {root['trace_id']})
+        self.assertEqual({spans[name]['parent_span_id'] for name in ('build_payload', 'n8n')}, {root['span_id']})
+        self.assertEqual((root['status'], spans['telegram.reply']['status']), ('error', 'error'))
+        headers = mock_post.call_args.kwargs['headers']
+        self.assertEqual(headers[tracing.TRACE_HEADER], f"00-{root['trace_id']}-{spans['n8n']['span_id']}-01")
+        self.assertEqual(headers['Content-Type'], 'application/json')
+
+    def test_sampling_rotation_and_otlp(self):
+        """Test that unsampled updates write nothing, files rotate, and OTLP documents are valid"""
+        headers = []
+
+        async def handler(update, context):
+            with tracing.span('stage', step=1):
+                headers.append(tracing.trace_headers())
+
+        async def run_test(tracer):
+            callback = tracing.instrument(handler, tracer, "Test Bot", 'message')
+            for update_id in range(20):
+                await callback(make_update(update_id), Mock())
+
+        unsampled = Tracer(self.path, sample_rate=0)
+        unsampled.open()
+        asyncio.run(run_test(unsampled))
+        unsampled.close()
+        self.assertEqual((unsampled.exported, os.path.getsize(self.path)), (0, 0))
+        self.assertEqual(headers, [None] * 20)
+
+        otlp = Tracer(self.path, max_bytes=2000, backups=2, format='otlp')
+        otlp.open()
+        asyncio.run(run_test(otlp))
+        otlp.close()
+        self.assertEqual(otlp.exported, 40)
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        span = read_spans(self.path)[-1]['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+        self.assertEqual(span['name'], 'update message')
+        self.assertIn({'key': 'update_id', 'value': {'intValue': '19'}}, span['attributes'])
+        self.assertEqual(span['status'], {'code': 1})
+
+        with self.assertRaises(ValueError):
+            Tracer(self.path, format='zipkin')
+
+
+class TestTracedBot(unittest.TestCase):
+    def test_queued_reply_is_child_of_update(self):
+        """Test that a reply the outbound scheduler sends later is traced under its update"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'spans.jsonl')
+            tracer = Tracer(path)
+            context = Mock()
+            context.bot.id = 6161
+
+            async def run_test():
+                bot.outbound_schedulers[context.bot.id] = bot.OutboundScheduler()
+                try:
+                    handler = bot.create_message_handler('http://n8n/hook')
+                    callback = tracing.instrument(handler, tracer, "Test Bot", 'message')
+                    with patch('bot.send_to_n8n', new_callable=AsyncMock) as mock_send:
+                        mock_send.return_value = {"reply": "hi"}
+                        with patch('bot.MessageEvent.from_update', return_value={"text": "hello"}):
+                            await callback(make_update(), context)
+                finally:
+                    await bot.outbound_schedulers.pop(context.bot.id).aclose()
+
+            tracer.open()
+            asyncio.run(run_test())
+            tracer.close()
+            spans = {span['name']: span for span in read_spans(path)}
+
+        self.assertEqual(set(spans), {'update message', 'build_payload', 'telegram.reply'})
+        self.assertEqual(spans['telegram.reply']['parent_span_id'], spans['update message']['span_id'])
+        self.assertIn('queued_ms', spans['telegram.reply']['attributes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import unittest
+from unittest.mock import Mock, AsyncMock
+import asyncio
+import httpx
+from telegram import Update
+from http_server import HttpServer
+from webhook_server import TelegramWebhookIngress, SECRET_HEADER
+
+
+UPDATE = {
+    "update_id": 1001,
+    "message": {
+        "message_id": 5,
+        "date": 1700000000,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "hello",
+    },
+}
+
+
+def make_application():
+    application = Mock()
+    application.bot.defaults = None
+    application.bot.set_webhook = AsyncMock()
+    application.update_queue = asyncio.Queue()
+    return application
+
+
+class TestTelegramWebhookIngress(unittest.TestCase):
+    def test_requires_base_url(self):
+        """Test that webhook mode needs a public base URL"""
+        with self.assertRaises(ValueError):
+            TelegramWebhookIngress(HttpServer('127.0.0.1', 0), None)
+
+    def test_routes_updates_per_bot(self):
+        """Test that each bot gets its own path and secret, and bad secrets are rejected"""
+        async def run_test():
+            server = HttpServer('127.0.0.1', 0)
+            ingress = TelegramWebhookIngress(server, 'https://bot.example.com/', secret='s3cret')
+            first, second = make_application(), make_application()
+            await ingress.register(first, 'token-1', 'First Bot')
+            await ingress.register(second, 'token-2', 'Second Bot')
+            await server.start()
+            base = f"http://127.0.0.1:{server.bound_port}"
+            path = ingress.path_for('token-2')
+            body = json.dumps(UPDATE)
+            try:
+                async with httpx.AsyncClient() as client:
+                    forbidden = await client.post(base + path, content=body, headers={
+                        SECRET_HEADER: ingress.secret_token_for('token-1')})
+                    accepted = await client.post(base + path, content=body, headers={
+                        SECRET_HEADER: ingress.secret_token_for('token-2')})
+                    invalid = await client.post(base + path, content=b'not json', headers={
+                        SECRET_HEADER: ingress.secret_token_for('token-2')})
+            finally:
+                await server.stop()
+            return ingress, first, second, forbidden, accepted, invalid
+
+        ingress, first, second, forbidden, accepted, invalid = asyncio.run(run_test())
+        self.assertNotEqual(ingress.path_for('token-1'), ingress.path_for('token-2'))
+        self.assertNotIn('token-2', ingress.path_for('token-2'))
+        kwargs = second.bot.set_webhook.call_args.kwargs
+        self.assertEqual(kwargs['url'], 'https://bot.example.com' + ingress.path_for('token-2'))
+        self.assertEqual(kwargs['secret_token'], ingress.secret_token_for('token-2'))
+
+        self.assertEqual(forbidden.status_code, 403)
+        self.assertEqual(accepted.status_code, 200)
+        self.assertEqual(invalid.status_code, 400)
+        self.assertTrue(first.update_queue.empty())
+        update = second.update_queue.get_nowait()
+        self.assertIsInstance(update, Update)
+        self.assertEqual(update.message.text, "hello")
+
+
+if __name__ == '__main__':
+    unittest.main()
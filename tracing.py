@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import queue
+import random
+import secrets
+import logging
+import functools
+import contextvars
+import logging.handlers
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# JSONL file spans are written to, rotated at TRACE_MAX_BYTES keeping TRACE_BACKUPS old files; unset disables tracing
+TRACE_PATH = os.getenv('TRACE_PATH')
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv('TRACE_BACKUPS', '3'))
+# Fraction of updates traced, from 0 to 1
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+# 'jsonl' writes one flat span per line; 'otlp' writes OTLP/JSON ResourceSpans, as the collector's file exporter does
+TRACE_FORMAT = os.getenv('TRACE_FORMAT', 'jsonl')
+
+TRACE_FORMATS = ('jsonl', 'otlp')
+
+# W3C trace context header sent to n8n with every request made for a traced update
+TRACE_HEADER = 'traceparent'
+
+SERVICE_NAME = 'telegram-n8n-bridge'
+
+# Span of the stage running now, if its update is traced
+current_span = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    """One timed stage of an update; the root span covers the whole handler"""
+
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'start_ns', 'end_ns', 'error')
+
+    def __init__(self, tracer, trace_id, parent_id, name, attributes):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'start_time_unix_nano': self.start_ns,
+            'end_time_unix_nano': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'status': 'error' if self.error else 'ok',
+            'error': self.error,
+        }
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()
+                           if value is not None],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span]}],
+        }]}
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Tracer:
+    """Sample updates and write their spans to a rotating file
+
+    Spans are handed to a background thread through a queue as they end,
+    so the event loop never waits for the file. Children of a span that
+    ended, such as a reply the outbound scheduler sends later, are still
+    written with its trace and parent ids.
+    """
+
+    def __init__(self, path=TRACE_PATH, sample_rate=TRACE_SAMPLE_RATE, max_bytes=TRACE_MAX_BYTES,
+                 backups=TRACE_BACKUPS, format=TRACE_FORMAT):
+        if format not in TRACE_FORMATS:
+            raise ValueError(f"Trace format must be one of {', '.join(TRACE_FORMATS)}, got {format!r}")
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.format = format
+        self._queue = queue.SimpleQueue()
+        self._listener = None
+        self.exported = 0
+
+    def open(self):
+        handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding='utf-8'
+        )
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def close(self):
+        """Write the spans still queued and close the file"""
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+    def export(self, span):
+        if self._listener is None:
+            return
+        document = span.to_otlp() if self.format == 'otlp' else span.to_dict()
+        line = json.dumps(document, separators=(',', ':'), default=str)
+        self._queue.put_nowait(logging.makeLogRecord({'msg': line, 'args': None}))
+        self.exported += 1
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """Root span of one update, or no span at all if the update is not sampled"""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            yield None
+            return
+        with _run_span(Span(self, secrets.token_hex(16), None, name, attributes)) as span:
+            yield span
+
+
+@contextmanager
+def _run_span(span):
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        current_span.reset(token)
+        span.tracer.export(span)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """Child span of parent, by default the current span; nothing happens for untraced updates"""
+    parent = parent or current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _run_span(Span(parent.tracer, parent.trace_id, parent.span_id, name, attributes)) as child:
+        yield child
+
+
+def trace_headers():
+    """Headers that carry the current span to n8n, or None if the update is not traced"""
+    current = current_span.get()
+    return {TRACE_HEADER: current.traceparent} if current is not None else None
+
+
+def instrument(callback, tracer, bot_name, handler_type):
+    """Wrap a handler callback so each update it handles gets a root span"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        message = update.effective_message
+        with tracer.trace(f"update {handler_type}", bot=bot_name, handler=handler_type, update_id=update.update_id,
+                          chat_id=message.chat_id if message is not None else None):
+            return await callback(update, context)
+
+    return wrapper
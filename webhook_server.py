@@ -0,0 +1,79 @@
+import os
+import hmac
+import json
+import hashlib
+import logging
+import secrets
+
+from telegram import Update
+
+from http_server import Response
+
+logger = logging.getLogger(__name__)
+
+# 'polling' (getUpdates per bot) or 'webhook' (one local server for every bot)
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+# Public HTTPS URL that Telegram can reach, e.g. https://bot.example.com
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')
+# Shared secret for the X-Telegram-Bot-Api-Secret-Token check; random per process if unset
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+class TelegramWebhookIngress:
+    """Receive updates for every bot on one HttpServer and feed each to its Application
+
+    Each bot gets its own unguessable path derived from its token, and its own
+    secret token that Telegram echoes back in every request.
+    """
+
+    def __init__(self, http_server, base_url, secret=None):
+        if not base_url:
+            raise ValueError("WEBHOOK_BASE_URL not found in environment variables")
+        self.http_server = http_server
+        self.base_url = base_url.rstrip('/')
+        self.secret = secret or secrets.token_hex(32)
+        self._bots = {}
+
+    @staticmethod
+    def path_for(token):
+        """Return the webhook path for a bot token without exposing the token"""
+        return '/telegram/' + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    def secret_token_for(self, token):
+        """Return the per-bot value Telegram must send in the secret token header"""
+        return hmac.new(self.secret.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+    async def register(self, application, token, bot_name):
+        """Route updates for this bot's path to application and point Telegram at it"""
+        path = self.path_for(token)
+        secret_token = self.secret_token_for(token)
+        self._bots[path] = (application, secret_token, bot_name)
+        self.http_server.add_route('POST', path, self.handle_update)
+        await application.bot.set_webhook(
+            url=self.base_url + path,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"{bot_name} is receiving updates via webhook")
+
+    def unregister(self, token):
+        path = self.path_for(token)
+        self._bots.pop(path, None)
+        self.http_server.remove_route('POST', path)
+
+    async def handle_update(self, request):
+        application, secret_token, bot_name = self._bots[request.path]
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret_token):
+            logger.warning(f"Rejected webhook request for {bot_name} with a bad secret token")
+            return Response(403, 'Forbidden')
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"Invalid update received for {bot_name}: {e}")
+            return Response(400, 'Bad Request')
+        await application.update_queue.put(update)
+        return Response(200, 'OK')